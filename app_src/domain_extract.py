@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Извлечение доменов из URL, HTML и JS.
+
+Все регулярные выражения компилируются один раз при импорте, HTML и JS
+просматриваются за один проход (все шаблоны объединены в одно выражение,
+которое захватывает сразу хост, а не весь URL). Нормализация хоста
+(нижний регистр, порт, www., IDNA -> punycode) кэшируется в LRU.
+"""
+import re
+from functools import lru_cache
+
+# Символы хоста: до первого разделителя пути/запроса/кавычки/экранирования
+_HOST_CHARS = r'''[^"'/\\?#\s]+'''
+
+# "https://host", "//host", а также экранированные в JSON "https:\/\/host"
+_JS_URL_RE = re.compile(r'''["'](?:https?:)?(?:\\?/){2}(''' + _HOST_CHARS + ')', re.IGNORECASE)
+_HTML_URL_RE = re.compile(r'''\b(?:src|href|action)\s*=\s*["']https?:(?:\\?/){2}(''' + _HOST_CHARS + ')', re.IGNORECASE)
+
+_SCHEME_RE = re.compile(r'^[a-zA-Z][a-zA-Z0-9+.\-]*://')
+# blob:https://host/uuid - хост берется из вложенного URL
+_BLOB_PREFIX_RE = re.compile(r'^blob:', re.IGNORECASE)
+_NETLOC_END_RE = re.compile(r'[/?#]')
+_FALLBACK_DOMAIN_RE = re.compile(r'([a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}')
+_IPV4_RE = re.compile(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$')
+_VALID_DOMAIN_RE = re.compile(r'^[a-z0-9\-\.]+$')
+
+HOST_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=HOST_CACHE_SIZE)
+def normalize_host(netloc):
+    """
+    Приводит netloc к домену для списков: нижний регистр, без порта и www.,
+    национальные домены - в punycode. Возвращает None для IP и мусора.
+    """
+    domain = netloc.lower()
+
+    # Удаляем порт, если он есть (например site.com:8080)
+    if ':' in domain:
+        domain = domain.split(':')[0]
+
+    # Национальные домены (пример.рф) - в punycode, как их видит winws в SNI
+    if not domain.isascii():
+        try:
+            domain = domain.encode('idna').decode('ascii')
+        except UnicodeError:
+            return None
+
+    # Удаляем префикс www.
+    if domain.startswith('www.'):
+        domain = domain[4:]
+
+    # Фильтрация IP-адресов (нам нужны только доменные имена)
+    if _IPV4_RE.match(domain):
+        return None
+
+    # Базовая валидация
+    if '.' not in domain or len(domain) < 4:
+        return None
+
+    # Проверка на допустимые символы
+    if not _VALID_DOMAIN_RE.match(domain):
+        return None
+
+    return domain
+
+
+def _netloc(url):
+    """netloc URL без urlparse: между схемой (или //) и первым /, ? или #."""
+    url = _BLOB_PREFIX_RE.sub('', url, count=1)
+    scheme = _SCHEME_RE.match(url)
+    if scheme:
+        rest = url[scheme.end():]
+    elif url.startswith('//'):
+        rest = url[2:]
+    else:
+        rest = url
+    end = _NETLOC_END_RE.search(rest)
+    return rest[:end.start()] if end else rest
+
+
+def extract_domain_from_url(url):
+    """Извлекает чистый домен из URL (или голого домена), убирает www и IP-адреса."""
+    if not url:
+        return None
+    try:
+        netloc = _netloc(url)
+        if not netloc:
+            # Кривой URL: пытаемся найти паттерн домена регуляркой
+            match = _FALLBACK_DOMAIN_RE.search(url)
+            if not match:
+                return None
+            netloc = match.group(0)
+        return normalize_host(netloc)
+    except Exception:
+        return None
+
+
+def extract_many(urls):
+    """Пакетный вариант extract_domain_from_url: множество доменов из итерируемого набора URL."""
+    domains = set()
+    seen_netlocs = set()
+    for url in urls:
+        if not url:
+            continue
+        netloc = _netloc(url)
+        if netloc:
+            if netloc in seen_netlocs:
+                continue
+            seen_netlocs.add(netloc)
+        domain = normalize_host(netloc) if netloc else extract_domain_from_url(url)
+        if domain:
+            domains.add(domain)
+    return domains
+
+
+def _scan(pattern, text):
+    domains = set()
+    for host in set(pattern.findall(text)):
+        domain = normalize_host(host)
+        if domain:
+            domains.add(domain)
+    return domains
+
+
+def extract_domains_from_js(js_content):
+    """Извлекает домены из JavaScript кода (один проход по тексту)."""
+    return _scan(_JS_URL_RE, js_content)
+
+
+def extract_domains_from_html(html_content):
+    """Извлекает домены из атрибутов src/href/action HTML (один проход по тексту)."""
+    return _scan(_HTML_URL_RE, html_content)
@@ -4,12 +4,13 @@ import threading
 import subprocess
 import sys
 import os
-import re
 from urllib.parse import urlparse
 import gc
 import psutil
 import json
 import time
+from process_table import process_table
+from domain_extract import extract_domain_from_url, extract_domains_from_html, extract_domains_from_js, extract_many
 
 def check_dependencies():
     """Проверяет наличие Selenium для Performance API"""
@@ -46,101 +47,21 @@ def is_media_url(url):
     except:
         return False
 
-def extract_domain_from_url(url):
-    """Извлекает чистый домен из URL, убирает www и IP-адреса"""
-    try:
-        if not url:
-            return None
-
-        # Если передан просто домен без протокола
-        if not url.startswith(('http://', 'https://', '//')):
-            if '://' not in url:
-                url = 'http://' + url
-            
-        parsed = urlparse(url)
-        domain = parsed.netloc.lower()
-        
-        # Если не удалось извлечь через urlparse (например, кривой url)
-        if not domain:
-            # Пытаемся найти паттерн домена регуляркой
-            match = re.search(r'([a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}', url)
-            if match:
-                domain = match.group(0).lower()
-            else:
-                return None
-
-        # Удаляем порт, если он есть (например site.com:8080)
-        if ':' in domain:
-            domain = domain.split(':')[0]
-            
-        # Удаляем префикс www.
-        if domain.startswith('www.'):
-            domain = domain[4:]
-
-        # Фильтрация IP-адресов (нам нужны только доменные имена)
-        if re.match(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$', domain):
-            return None
-
-        # Базовая валидация
-        if '.' not in domain or len(domain) < 4:
-            return None
-            
-        # Проверка на допустимые символы
-        if not re.match(r'^[a-z0-9\-\.]+$', domain):
-            return None
-            
-        return domain
-    except:
-        return None
-
 def cleanup_browser_resources():
     """Очищает ресурсы браузеров"""
     try:
-        for proc in psutil.process_iter(['pid', 'name']):
-            try:
-                if proc.info['name'] and ('chrome' in proc.info['name'].lower() or 'chromium' in proc.info['name'].lower()):
-                    if proc.pid != os.getpid():
-                        proc.terminate()
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                continue
+        for pid, name, _ in process_table.snapshot(max_age=0.5).items():
+            name = name.lower()
+            if ('chrome' in name or 'chromium' in name) and pid != os.getpid():
+                try:
+                    psutil.Process(pid).terminate()
+                except (psutil.NoSuchProcess, psutil.AccessDenied):
+                    continue
+        process_table.invalidate()
         gc.collect()
     except Exception as e:
         print(f"Ошибка при очистке ресурсов: {e}")
 
-def extract_domains_from_js(js_content):
-    """Извлекает домены из JavaScript кода"""
-    domains = set()
-    patterns = [
-        r'["\']https?://([^"\']+)["\']',
-        r'["\']//([^"\']+)["\']',
-        r'api\s*:\s*["\']https?://([^"\']+)["\']',
-    ]
-    
-    for pattern in patterns:
-        matches = re.findall(pattern, js_content, re.IGNORECASE)
-        for match in matches:
-            domain = extract_domain_from_url(match)
-            if domain:
-                domains.add(domain)
-    return domains
-
-def extract_domains_from_html(html_content):
-    """Извлекает домены из HTML контента"""
-    domains = set()
-    tag_patterns = [
-        r'src=["\']https?://([^"\']+)["\']',
-        r'href=["\']https?://([^"\']+)["\']',
-        r'action=["\']https?://([^"\']+)["\']',
-    ]
-    
-    for pattern in tag_patterns:
-        matches = re.findall(pattern, html_content, re.IGNORECASE)
-        for match in matches:
-            domain = extract_domain_from_url(match)
-            if domain:
-                domains.add(domain)
-    return domains
-
 def analyze_site_domains_performance(url: str, log_callback):
     """Анализ через Performance API (единственный оставшийся метод)"""
     driver = None
@@ -197,7 +118,7 @@ def analyze_site_domains_performance(url: str, log_callback):
                 all_domains.add(main_domain)
             
             def collect_domains_from_logs():
-                domains_found = set()
+                urls = []
                 try:
                     logs = driver.get_log('performance')
                     for entry in logs:
@@ -215,12 +136,11 @@ def analyze_site_domains_performance(url: str, log_callback):
                                     target_url = message['params']['request'].get('url', '')
 
                             if target_url:
-                                domain = extract_domain_from_url(target_url)
-                                if domain:
-                                    domains_found.add(domain)
+                                urls.append(target_url)
                         except:
                             continue
-                    return domains_found
+                    # Одним пакетом: повторяющиеся хосты нормализуются один раз
+                    return extract_many(urls)
                 except Exception as e:
                     log_callback(f"Ошибка чтения логов: {e}")
                     return set()
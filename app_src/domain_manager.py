@@ -5,6 +5,8 @@ import datetime
 import tkinter as tk
 from tkinter import messagebox
 from domain_finder import check_dependencies, analyze_site_domains_performance, extract_domain_from_url
+from domain_trie import DomainTrie, normalize_domain
+from list_store import list_store, list_compactor
 
 class DomainManager:
     """Класс для управления анализом доменов"""
@@ -147,17 +149,8 @@ class DomainManager:
             log_callback(f"[INFO] 📂 Чтение текущего кастомного списка: {custom_list_path}")
             
             # Чтение текущего кастомного списка
-            existing_domains_set = set()
-            existing_lines = []
             try:
-                with open(custom_list_path, 'r', encoding='utf-8') as f:
-                    for line_num, line in enumerate(f, 1):
-                        line = line.strip()
-                        if line and not line.startswith('#'):
-                            existing_lines.append(line)
-                            existing_domains_set.add(line)
-                        elif line.startswith('#'):
-                            log_callback(f"[DEBUG] 📝 Комментарий в строке {line_num}: {line[:50]}...")
+                existing_lines = self._read_domains(custom_list_path)
             except Exception as e:
                 log_callback(f"[ERROR] ❌ Ошибка чтения файла списка: {e}")
                 return
@@ -168,85 +161,79 @@ class DomainManager:
             base_dir = os.path.dirname(os.path.abspath(__file__))
             lists_dir = os.path.join(base_dir, 'lists')
             exclude_dir = os.path.join(base_dir, 'exclude')
-            list_google_path = os.path.join(lists_dir, 'list-google.txt')
-            list_general_path = os.path.join(lists_dir, 'list-general.txt')
-            list_exclude_path = os.path.join(exclude_dir, 'list-exclude.txt')
-            list_exclude_user_path = os.path.join(exclude_dir, 'list-exclude-user.txt')
+            blocking_lists = [
+                (os.path.join(lists_dir, 'list-google.txt'), "списке блокировки Google"),
+                (os.path.join(lists_dir, 'list-general.txt'), "общем списке блокировки"),
+                (os.path.join(exclude_dir, 'list-exclude.txt'), "списке исключений"),
+                (os.path.join(exclude_dir, 'list-exclude-user.txt'), "пользовательском списке исключений"),
+            ]
             
-            log_callback(f"[INFO] 🔒 Загрузка списков блокировки: {list_google_path}, {list_general_path}, {list_exclude_path}, {list_exclude_user_path}")
+            log_callback(f"[INFO] 🔒 Загрузка списков блокировки: {', '.join(path for path, _ in blocking_lists)}")
             
-            blocked_domains_set = set()
-            # Читаем list-google.txt
-            try:
-                with open(list_google_path, 'r', encoding='utf-8') as f:
-                    for line_num, line in enumerate(f, 1):
-                        line = line.strip()
-                        if line and not line.startswith('#'):
-                            blocked_domains_set.add(line)
-                        elif line.startswith('#'):
-                            log_callback(f"[DEBUG] 📝 Комментарий в списке блокировки Google строка {line_num}: {line[:50]}...")
-            except Exception as e:
-                log_callback(f"[WARN] ⚠ Ошибка чтения {list_google_path}: {e}")
-                # Не прерываем, просто продолжаем без этого списка
-            
-            # Читаем list-general.txt
-            try:
-                with open(list_general_path, 'r', encoding='utf-8') as f:
-                    for line_num, line in enumerate(f, 1):
-                        line = line.strip()
-                        if line and not line.startswith('#'):
-                            blocked_domains_set.add(line)
-                        elif line.startswith('#'):
-                            log_callback(f"[DEBUG] 📝 Комментарий в общем списке блокировки строка {line_num}: {line[:50]}...")
-            except Exception as e:
-                log_callback(f"[WARN] ⚠ Ошибка чтения {list_general_path}: {e}")
-            
-            # Читаем list-exclude.txt
-            try:
-                with open(list_exclude_path, 'r', encoding='utf-8') as f:
-                    for line_num, line in enumerate(f, 1):
-                        line = line.strip()
-                        if line and not line.startswith('#'):
-                            blocked_domains_set.add(line)
-                        elif line.startswith('#'):
-                            log_callback(f"[DEBUG] 📝 Комментарий в списке исключений строка {line_num}: {line[:50]}...")
-            except Exception as e:
-                log_callback(f"[WARN] ⚠ Ошибка чтения {list_exclude_path}: {e}")
+            # Суффиксные деревья: запись покрывает все свои поддомены (как в winws).
+            # Деревья кэшируются в list_store и пересобираются только при изменении файла.
+            blocked_tries = []
+            for path, label in blocking_lists:
+                try:
+                    blocked_tries.append(self._domain_trie(path))
+                except Exception as e:
+                    # Не прерываем, просто продолжаем без этого списка
+                    log_callback(f"[WARN] ⚠ Ошибка чтения {path}: {e}")
             
-            # Читаем list-exclude-user.txt
-            try:
-                with open(list_exclude_user_path, 'r', encoding='utf-8') as f:
-                    for line_num, line in enumerate(f, 1):
-                        line = line.strip()
-                        if line and not line.startswith('#'):
-                            blocked_domains_set.add(line)
-                        elif line.startswith('#'):
-                            log_callback(f"[DEBUG] 📝 Комментарий в пользовательском списке исключений строка {line_num}: {line[:50]}...")
-            except Exception as e:
-                log_callback(f"[WARN] ⚠ Ошибка чтения {list_exclude_user_path}: {e}")
+            log_callback(f"[INFO] 🔒 Загружено {sum(len(t) for t in blocked_tries)} доменов в списки блокировки (после свертки поддоменов).")
             
-            log_callback(f"[INFO] 🔒 Загружено {len(blocked_domains_set)} уникальных доменов в списки блокировки.")
+            # Остальные списки из lists/ - только для информации, где домен уже обходится
+            other_tries = []
+            blocking_paths = {os.path.normcase(path) for path, _ in blocking_lists}
+            for filename in list_store.list_dir(lists_dir):
+                path = os.path.join(lists_dir, filename)
+                if os.path.normcase(path) in blocking_paths:
+                    continue
+                try:
+                    other_tries.append(self._domain_trie(path))
+                except Exception:
+                    continue
  
             # Определяем домены, которые нужно оставить (не в блокировке)
-            kept_existing = []
             removed_blocked = 0
             removed_duplicates = 0
-            seen = set()
+            removed_redundant = 0
+            removed_invalid = 0
             
-            log_callback("[INFO] 🔄 Фильтрация существующих доменов (удаление дубликатов и заблокированных)...")
+            log_callback("[INFO] 🔄 Фильтрация существующих доменов (удаление дубликатов, заблокированных и покрытых родителем)...")
+            custom_trie = DomainTrie()
+            candidates = []
+            seen = set()
             for domain in existing_lines:
-                if domain in blocked_domains_set:
-                    removed_blocked += 1
-                    log_callback(f"[DEBUG] 🗑 Удален заблокированный домен: {domain}")
+                if not normalize_domain(domain):
+                    # Строка из одних точек - не домен, в дерево не попадает
+                    removed_invalid += 1
+                    log_callback(f"[DEBUG] 🗑 Удалена пустая запись: {domain}")
                     continue
-                if domain in seen:
+                if normalize_domain(domain) in seen:
                     removed_duplicates += 1
                     log_callback(f"[DEBUG] 🗑 Удален дубликат: {domain}")
                     continue
-                seen.add(domain)
+                seen.add(normalize_domain(domain))
+                cover = self._find_cover(blocked_tries, domain)
+                if cover:
+                    removed_blocked += 1
+                    log_callback(f"[DEBUG] 🗑 Удален заблокированный домен: {domain} (покрыт {cover[0]} из {cover[1]})")
+                    continue
+                custom_trie.insert(domain)
+                candidates.append(domain)
+            
+            # Домены, у которых в списке есть родитель, избыточны: winws сам применит родителя
+            kept_existing = []
+            for domain in candidates:
+                cover = custom_trie.find_cover(domain)
+                if cover and cover[0] != normalize_domain(domain):
+                    removed_redundant += 1
+                    log_callback(f"[DEBUG] 🗑 Удален поддомен, покрытый родителем {cover[0]}: {domain}")
+                    continue
                 kept_existing.append(domain)
  
-            log_callback(f"[INFO] ✅ После фильтрации осталось {len(kept_existing)} доменов. Удалено: {removed_duplicates} дубликатов, {removed_blocked} заблокированных.")
+            log_callback(f"[INFO] ✅ После фильтрации осталось {len(kept_existing)} доменов. Удалено: {removed_duplicates} дубликатов, {removed_invalid} пустых, {removed_blocked} заблокированных, {removed_redundant} поддоменов.")
  
             # Обрабатываем новые домены
             added_domains = []
@@ -256,17 +243,39 @@ class DomainManager:
                 if not clean_domain:
                     log_callback(f"[WARN] ⚠ Не удалось извлечь домен из: {domain}")
                     continue
-                if clean_domain in blocked_domains_set:
-                    log_callback(f"[DEBUG] 🗑 Новый домен заблокирован, пропускаем: {clean_domain}")
+                cover = self._find_cover(blocked_tries, clean_domain)
+                if cover:
+                    log_callback(f"[DEBUG] 🗑 Новый домен заблокирован ({cover[0]} в {cover[1]}), пропускаем: {clean_domain}")
                     continue
-                if clean_domain in seen:
-                    log_callback(f"[DEBUG] 🗑 Новый домен уже существует (дубликат), пропускаем: {clean_domain}")
+                cover = custom_trie.find_cover(clean_domain)
+                if cover:
+                    if cover[0] == clean_domain:
+                        log_callback(f"[DEBUG] 🗑 Новый домен уже существует (дубликат), пропускаем: {clean_domain}")
+                    else:
+                        log_callback(f"[DEBUG] 🗑 Новый домен уже покрыт родителем {cover[0]}, пропускаем: {clean_domain}")
                     continue
-                seen.add(clean_domain)
+                custom_trie.insert(clean_domain)
                 added_domains.append(clean_domain)
-                log_callback(f"[INFO]   + {clean_domain}")
+                other_cover = self._find_cover(other_tries, clean_domain)
+                if other_cover:
+                    log_callback(f"[INFO]   + {clean_domain} (также покрыт {other_cover[0]} в {other_cover[1]})")
+                else:
+                    log_callback(f"[INFO]   + {clean_domain}")
+            
+            # Новый родитель мог покрыть уже существующие поддомены - убираем их
+            pruned = []
+            for domain in kept_existing:
+                cover = custom_trie.find_cover(domain)
+                if cover and cover[0] != normalize_domain(domain):
+                    pruned.append(domain)
+            if pruned:
+                removed_redundant += len(pruned)
+                pruned_set = set(pruned)
+                kept_existing = [d for d in kept_existing if d not in pruned_set]
+                for domain in pruned:
+                    log_callback(f"[DEBUG] 🗑 Удален поддомен, покрытый новым родителем: {domain}")
  
-            if not added_domains and removed_blocked == 0 and removed_duplicates == 0:
+            if not added_domains and removed_blocked == 0 and removed_duplicates == 0 and removed_redundant == 0 and removed_invalid == 0:
                 log_callback("[INFO] ℹ️ Новых доменов не найдено (все уже есть в выбранном списке или заблокированы).")
                 return
  
@@ -274,12 +283,16 @@ class DomainManager:
             new_lines = kept_existing + added_domains
             log_callback(f"[INFO] 📋 Формирование нового списка: {len(kept_existing)} существующих + {len(added_domains)} новых = {len(new_lines)} всего.")
  
-            # Записываем обратно в файл
+            # Записываем в файл: если ничего не удаляется - только дописываем новые строки,
+            # иначе атомарно переписываем файл (комментарии сохраняются)
             try:
-                log_callback(f"[INFO] 💾 Запись обновленного списка в файл: {custom_list_path}")
-                with open(custom_list_path, 'w', encoding='utf-8') as f:
-                    for line in new_lines:
-                        f.write(line + '\n')
+                if removed_blocked == 0 and removed_duplicates == 0 and removed_redundant == 0 and removed_invalid == 0:
+                    log_callback(f"[INFO] 💾 Дописывание {len(added_domains)} доменов в файл: {custom_list_path}")
+                    list_store.append_entries(custom_list_path, added_domains)
+                    list_compactor.schedule(custom_list_path)
+                else:
+                    log_callback(f"[INFO] 💾 Запись обновленного списка в файл: {custom_list_path}")
+                    list_store.rewrite_entries(custom_list_path, keep=kept_existing, extra=added_domains)
                 log_callback("[INFO] ✅ Файл успешно записан.")
             except Exception as e:
                 log_callback(f"[ERROR] ❌ Ошибка записи файла списка: {e}")
@@ -288,12 +301,16 @@ class DomainManager:
             # Логируем результаты
             if removed_duplicates > 0:
                 log_callback(f"[WARN] ⚠ Удалено {removed_duplicates} дубликатов из кастомного списка.")
+            if removed_invalid > 0:
+                log_callback(f"[WARN] ⚠ Удалено {removed_invalid} пустых записей (без имени домена) из кастомного списка.")
             if removed_blocked > 0:
                 log_callback(f"[WARN] ⚠ Удалено {removed_blocked} доменов, присутствующих в списках блокировки.")
+            if removed_redundant > 0:
+                log_callback(f"[WARN] ⚠ Удалено {removed_redundant} поддоменов, уже покрытых родительским доменом.")
             if added_domains:
                 log_callback(f"[INFO] ✓ Добавлено {len(added_domains)} новых доменов в {os.path.basename(custom_list_path)}")
             else:
-                log_callback(f"[INFO] ✓ Очистка кастомного списка завершена. Удалено дубликатов: {removed_duplicates}, заблокированных: {removed_blocked}.")
+                log_callback(f"[INFO] ✓ Очистка кастомного списка завершена. Удалено дубликатов: {removed_duplicates}, пустых: {removed_invalid}, заблокированных: {removed_blocked}, поддоменов: {removed_redundant}.")
  
             log_callback(f"[INFO] 🏁 Обработка доменов завершена. Итоговый список содержит {len(new_lines)} доменов.")
             self.app.root.after(0, self._propose_restart_after_domain_update)
@@ -303,7 +320,46 @@ class DomainManager:
             import traceback
             log_callback(f"[ERROR] 📋 Трассировка: {traceback.format_exc()}")
     
+    def _read_domains(self, path):
+        """Читает домены из файла списка (без пустых строк и комментариев)."""
+        return list(list_store.get_lines(path))
+
+    def _domain_trie(self, path):
+        """Суффиксное дерево списка из общего кэша; тег записи - имя файла."""
+        tag = os.path.basename(path)
+        return list_store.get_derived(path, 'domain_trie', lambda lines: DomainTrie(lines, tag))
+
+    @staticmethod
+    def _find_cover(tries, domain):
+        for trie in tries:
+            cover = trie.find_cover(domain)
+            if cover:
+                return cover
+        return None
+
     def _propose_restart_after_domain_update(self):
         if self.app.active_processes:
-            if messagebox.askyesno("Обновление", "Домены добавлены. Чтобы изменения вступили в силу, нужно перезапустить процессы.\n\nОстановить все текущие процессы?"):
-                self.app.stop_process()
\ No newline at end of file
+            # Сравнение плана читает файлы - делаем это не в UI-потоке
+            self.app.run_in_thread(self._check_restart_after_domain_update, self.app.game_filter_var.get(),
+                                   self.app._winws_debug_enabled())
+
+    def _check_restart_after_domain_update(self, game_filter_enabled, debug):
+        try:
+            stale = self.app.check_pending_changes(game_filter_enabled, debug)
+        except Exception as e:
+            self.domain_log(f"[WARN] ⚠ Не удалось сравнить план запуска: {e}")
+            stale = None
+        if stale == []:
+            self.domain_log("[INFO] ℹ️ Итоговые списки запущенного процесса не изменились, перезапуск не нужен.")
+            return
+        self.app.root.after(0, lambda: self._ask_restart_after_domain_update(stale))
+
+    def _ask_restart_after_domain_update(self, stale):
+        if not self.app.active_processes:
+            return
+        details = ""
+        if stale:
+            self.app._show_stale_lists(stale)
+            details = f"\n\nИзменены: {', '.join(stale)}"
+        if messagebox.askyesno("Обновление", f"Домены добавлены. Чтобы изменения вступили в силу, нужно перезапустить процессы.{details}\n\nПерезапустить процесс?"):
+            self.app.run_all_configured(confirm=False)
\ No newline at end of file
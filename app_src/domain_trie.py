@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Суффиксное дерево доменов по перевернутым меткам (com -> example -> cdn).
+
+winws применяет запись hostlist ко всем поддоменам, поэтому домен,
+у которого в дереве уже есть родитель, считается покрытым и не хранится.
+Узел - dict {метка: дочерний узел}, конечная запись - не-dict значение (тег),
+поэтому потомки покрытых доменов не занимают память.
+"""
+
+
+def normalize_domain(domain):
+    """Приводит строку hostlist к виду для сравнения: нижний регистр, без точек по краям."""
+    return domain.strip().lower().strip('.')
+
+
+class DomainTrie:
+    def __init__(self, domains=(), tag=True):
+        self._root = {}
+        self._count = 0
+        for domain in domains:
+            self.insert(domain, tag)
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, domain):
+        return self.covers(domain)
+
+    def insert(self, domain, tag=True):
+        """
+        Добавляет домен. Возвращает False, если он уже покрыт родителем (или равен
+        существующей записи). Поддомены, которые новая запись покрывает, удаляются.
+        """
+        labels = normalize_domain(domain).split('.')
+        if not labels[-1]:
+            return False
+        node = self._root
+        for label in reversed(labels[1:]):
+            child = node.get(label)
+            if child is None:
+                child = node[label] = {}
+            elif not isinstance(child, dict):
+                return False
+            node = child
+        existing = node.get(labels[0])
+        if existing is not None and not isinstance(existing, dict):
+            return False
+        if existing:
+            self._count -= self._count_terminals(existing)
+        node[labels[0]] = tag
+        self._count += 1
+        return True
+
+    def find_cover(self, domain):
+        """Возвращает (покрывающий домен, тег) или None."""
+        labels = normalize_domain(domain).split('.')
+        node = self._root
+        for depth, label in enumerate(reversed(labels), 1):
+            child = node.get(label)
+            if child is None:
+                return None
+            if not isinstance(child, dict):
+                return '.'.join(labels[-depth:]), child
+            node = child
+        return None
+
+    def covers(self, domain):
+        return self.find_cover(domain) is not None
+
+    def minimize(self):
+        """Минимальный отсортированный список доменов, покрывающий то же множество."""
+        result = []
+        stack = [(self._root, [])]
+        while stack:
+            node, suffix = stack.pop()
+            for label, child in node.items():
+                path = [label] + suffix
+                if isinstance(child, dict):
+                    stack.append((child, path))
+                else:
+                    result.append('.'.join(path))
+        result.sort()
+        return result
+
+    @staticmethod
+    def _count_terminals(node):
+        count = 0
+        stack = [node]
+        while stack:
+            for child in stack.pop().values():
+                if isinstance(child, dict):
+                    stack.append(child)
+                else:
+                    count += 1
+        return count
@@ -4,20 +4,9 @@ import requests
 import zipfile
 import shutil
 import glob
+from list_store import list_store
 
 def is_custom_list_valid(filepath):
     """Проверяет, существует ли custom_list и не пуст ли он."""
-    if not os.path.exists(filepath):
-        return False
-    if os.path.getsize(filepath) == 0:
-        return False
-    try:
-        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-            for line in f:
-                # Убираем пробелы и проверяем, что строка не пустая и не комментарий
-                stripped_line = line.strip()
-                if stripped_line and not stripped_line.startswith('#'):
-                    return True
-    except Exception:
-        return False
-    return False
\ No newline at end of file
+    # Разбор файла кэшируется в list_store и повторяется только при его изменении
+    return list_store.has_entries(filepath)
\ No newline at end of file
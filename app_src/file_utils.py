@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+
+
+def atomic_write_text(path, text, encoding='utf-8'):
+    """
+    Атомарно записывает текст в файл: временный файл в той же папке,
+    fsync и os.replace. При сбое старый файл остается целым.
+    """
+    dirname = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.tmp_', suffix='.txt', dir=dirname)
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding, newline='\n') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def append_lines(path, lines, encoding='utf-8'):
+    """
+    Дописывает строки в конец файла с fsync. Если файл не заканчивается
+    переводом строки, сначала добавляется перевод строки.
+    """
+    lines = list(lines)
+    if not lines:
+        return 0
+    prefix = ""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) not in (b'\n', b'\r'):
+                    prefix = "\n"
+    except FileNotFoundError:
+        pass
+    with open(path, 'a', encoding=encoding, newline='\n') as f:
+        f.write(prefix + "".join(line + "\n" for line in lines))
+        f.flush()
+        os.fsync(f.fileno())
+    return len(lines)
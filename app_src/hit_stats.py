@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Статистика попаданий доменов из hostlist.
+
+В режиме --debug winws пишет, в какой профиль попал пакет и с каким hostname.
+По номеру профиля находится секция плана (WinwsOutputParser.section_lists),
+а HitStats по спискам секции находит запись hostlist, которая покрывает
+hostname (домен или его родитель).
+Для каждой записи хранится число попаданий и день последнего попадания.
+
+Формат файла компактный:
+    {"version": 1, "lists": {"list-x.txt": {"since": день, "days": N, "day": день,
+                                            "hits": {"домен": [попаданий, день]}}}}
+где день - номер суток от эпохи (UTC), since - первый день учета, days - сколько
+разных дней учет реально велся (winws работал в режиме учета), day - последний
+из них. Без days запись без попаданий нельзя отличить от записи, за которой
+просто не наблюдали (например, приложение не запускалось месяц).
+"""
+import os
+import json
+import time
+import threading
+import logging
+
+from domain_trie import DomainTrie
+from file_utils import atomic_write_text
+from list_store import list_store
+
+logger = logging.getLogger("process_manager.hit_stats")
+
+STATS_VERSION = 1
+# Сколько пар (списки секции, hostname) помнить без повторного поиска по спискам
+RESOLVE_CACHE_SIZE = 50000
+
+
+def today():
+    return int(time.time() // 86400)
+
+
+def _list_trie(path):
+    # Тот же ключ кэша, что и у DomainManager: дерево строится один раз на версию файла
+    tag = os.path.basename(path)
+    return list_store.get_derived(path, 'domain_trie', lambda lines: DomainTrie(lines, tag))
+
+
+class HitStats:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._lists = {}
+        self._tracked = set()
+        self._resolved = {}
+        # День, за который уже отмечено наблюдение (чтобы не обходить списки на каждой строке)
+        self._observed_day = None
+        self._dirty = False
+        self._autosave_stop = None
+        self.recorded = 0
+        self.unattributed = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == STATS_VERSION:
+                self._lists = data.get("lists", {})
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to load hit stats from {self.path}: {e}")
+
+    def set_plan(self, plan):
+        """Начинает учет по спискам плана запуска."""
+        with self._lock:
+            self._tracked = {path for section in plan.sections for path in section.lists}
+            self._resolved.clear()
+            self._observed_day = None
+
+    def clear_plan(self):
+        """Учет остановлен (winws остановлен или запущен без учета)."""
+        with self._lock:
+            self._tracked = set()
+            self._resolved.clear()
+            self._observed_day = None
+
+    def _list_info(self, name):
+        day = today()
+        return self._lists.setdefault(name, {"since": day, "days": 0, "day": None, "hits": {}})
+
+    def observe(self):
+        """
+        Вызывается на каждую строку вывода winws в режиме учета: день засчитывается
+        как день учета, только если winws действительно работал и присылал вывод.
+        """
+        day = today()
+        if day == self._observed_day:
+            return
+        with self._lock:
+            if self._tracked:
+                self._touch_day()
+                self._observed_day = day
+
+    def _touch_day(self):
+        """Отмечает текущий день как день учета для всех списков текущего плана."""
+        day = today()
+        for path in self._tracked:
+            info = self._list_info(os.path.basename(path))
+            if info.get("day") != day:
+                info["day"] = day
+                info["days"] = info.get("days", 0) + 1
+                self._dirty = True
+
+    def _resolve(self, list_paths, hostname):
+        for path in list_paths:
+            try:
+                cover = _list_trie(path).find_cover(hostname)
+            except Exception:
+                continue
+            if cover:
+                return cover[1], cover[0]
+        return None
+
+    def record(self, list_paths, hostname):
+        """
+        Учитывает пакет с hostname, попавший в секцию списков list_paths
+        (кортеж путей). Возвращает (список, запись) или None.
+        """
+        if not hostname or not list_paths:
+            return None
+        key = (list_paths, hostname)
+        with self._lock:
+            resolved = self._resolved.get(key, False)
+            if resolved is False:
+                resolved = self._resolve(list_paths, hostname)
+                if len(self._resolved) >= RESOLVE_CACHE_SIZE:
+                    self._resolved.clear()
+                self._resolved[key] = resolved
+            if resolved is None:
+                self.unattributed += 1
+                return None
+            list_name, domain = resolved
+            hits = self._list_info(list_name)["hits"]
+            item = hits.get(domain)
+            if item is None:
+                hits[domain] = [1, today()]
+            else:
+                item[0] += 1
+                item[1] = today()
+            self.recorded += 1
+            self._dirty = True
+            return resolved
+
+    def flush(self):
+        """Сохраняет статистику на диск, если она менялась."""
+        with self._lock:
+            if not self._dirty:
+                return False
+            text = json.dumps({"version": STATS_VERSION, "lists": self._lists}, ensure_ascii=False, separators=(',', ':'))
+            self._dirty = False
+        try:
+            atomic_write_text(self.path, text)
+            return True
+        except Exception as e:
+            logger.warning(f"Failed to save hit stats to {self.path}: {e}")
+            with self._lock:
+                self._dirty = True
+            return False
+
+    def start_autosave(self, interval=60.0):
+        if self._autosave_stop is not None:
+            return
+        stop = self._autosave_stop = threading.Event()
+
+        def loop():
+            while not stop.wait(interval):
+                self.flush()
+
+        threading.Thread(target=loop, daemon=True).start()
+
+    def stop_autosave(self):
+        if self._autosave_stop is not None:
+            self._autosave_stop.set()
+            self._autosave_stop = None
+        self.flush()
+
+    def prune_report(self, list_path, days):
+        """
+        Записи списка без попаданий за последние days дней.
+        Возвращает dict: entries, unused (список записей), tracked_days, ready
+        (учет велся не меньше days дней - только тогда удаление имеет смысл).
+        """
+        name = os.path.basename(list_path)
+        day = today()
+        with self._lock:
+            info = self._lists.get(name)
+            hits = dict(info["hits"]) if info else {}
+            tracked_days = info.get("days", 0) if info else 0
+        entries = [line.strip() for line in list_store.get_lines(list_path)]
+        cutoff = day - days
+        unused = []
+        for entry in entries:
+            item = hits.get(entry.lower().strip('.'))
+            if item is None or item[1] < cutoff:
+                unused.append(entry)
+        return {
+            "list": name,
+            "entries": len(entries),
+            "unused": unused,
+            "tracked_days": tracked_days,
+            "ready": tracked_days >= days,
+        }
+
+    def prune_apply(self, list_path, days):
+        """Удаляет из списка записи без попаданий за days дней. Возвращает (удалено, отчет)."""
+        report = self.prune_report(list_path, days)
+        if not report["ready"] or not report["unused"]:
+            return 0, report
+        unused = {entry.lower() for entry in report["unused"]}
+        keep = [entry for entry in list_store.get_lines(list_path) if entry.lower() not in unused]
+        _, dropped = list_store.rewrite_entries(list_path, keep=keep)
+        with self._lock:
+            hits = self._lists.get(report["list"], {}).get("hits", {})
+            for entry in unused:
+                hits.pop(entry.strip('.'), None)
+            self._dirty = True
+        logger.info(f"Pruned {dropped} unused entries from {list_path}")
+        return dropped, report
+
+    def stats(self):
+        with self._lock:
+            return {
+                "lists": len(self._lists),
+                "domains": sum(len(info["hits"]) for info in self._lists.values()),
+                "recorded": self.recorded,
+                "unattributed": self.unattributed,
+            }
@@ -6,6 +6,10 @@ import time
 import socket
 import os
 import ipaddress
+import ipset_index
+from file_utils import atomic_write_text
+from list_store import list_store
+from process_table import process_table
 
 class IPGrabberWindow(tk.Toplevel):
     def __init__(self, parent, app_dir, log_callback, on_save_callback):
@@ -22,6 +26,10 @@ class IPGrabberWindow(tk.Toplevel):
         self.captured_ips = set()
         self.capture_thread = None
         self.connection_count = 0
+        # IP, которые уже покрыты существующими ipset: { ip: [имена ipset] }
+        self.covered_ips = {}
+        # IP из exclude-ipset (обход к ним не применяется): { ip: [имена exclude-наборов] }
+        self.excluded_ips = {}
         
         self.create_widgets()
         self.refresh_processes()
@@ -86,14 +94,10 @@ class IPGrabberWindow(tk.Toplevel):
         try:
             # Собираем уникальные имена процессов для удобства, но храним и PID
             seen_names = set()
-            for proc in psutil.process_iter(['pid', 'name']):
-                try:
-                    name = proc.info['name']
-                    if name and name not in seen_names:
-                        self.all_processes.append((proc.info['pid'], name))
-                        seen_names.add(name)
-                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                    pass
+            for pid, name, _ in process_table.snapshot().items():
+                if name and name not in seen_names:
+                    self.all_processes.append((pid, name))
+                    seen_names.add(name)
         except Exception:
             pass
         
@@ -129,6 +133,8 @@ class IPGrabberWindow(tk.Toplevel):
             self.btn_start.config(text="Остановить захват")
             
             self.captured_ips.clear()
+            self.covered_ips.clear()
+            self.excluded_ips.clear()
             self.ip_listbox.delete(0, tk.END)
             self.connection_count = 0
             self.lbl_status.config(text=f"ПЫЛЕСОСИМ {self.selected_name}...", foreground="green")
@@ -140,7 +146,7 @@ class IPGrabberWindow(tk.Toplevel):
             self.is_capturing = False
             self.btn_start.config(text="Начать захват")
             
-            self.lbl_status.config(text=f"Захват остановлен. Найдено уникальных IP: {len(self.captured_ips)}", foreground="black")
+            self.lbl_status.config(text=f"Захват остановлен. Найдено уникальных IP: {len(self.captured_ips)} (уже в ipset: {len(self.covered_ips)}, исключено: {len(self.excluded_ips)})", foreground="black")
             if self.captured_ips:
                 self.btn_save.config(state=tk.NORMAL)
 
@@ -160,6 +166,13 @@ class IPGrabberWindow(tk.Toplevel):
         target_name = self.selected_name
         self.log_callback(f"[IP GRABBER] Старт захвата для {target_name}")
         
+        # Индекс существующих ipset, чтобы сразу видеть, что уже покрыто
+        try:
+            index = ipset_index.build_app_index(self.app_dir)
+        except Exception as e:
+            index = None
+            self.log_callback(f"[IP GRABBER] Не удалось загрузить ipset для сверки: {e}")
+        
         # Кэш PIDов, чтобы не искать их каждый раз (обновляем раз в 3 сек)
         target_pids = []
         last_pid_refresh = 0
@@ -169,12 +182,8 @@ class IPGrabberWindow(tk.Toplevel):
             
             # Обновление списка PIDов (если процесс перезапустился или появились новые окна)
             if current_time - last_pid_refresh > 3.0:
-                target_pids = []
-                for proc in psutil.process_iter(['pid', 'name']):
-                    try:
-                        if proc.info['name'].lower() == target_name.lower():
-                            target_pids.append(proc.info['pid'])
-                    except: pass
+                # Общий снимок: полный обход только если снимок старше 3 сек
+                target_pids = process_table.pids_by_name(target_name, max_age=3.0)
                 last_pid_refresh = current_time
             
             if not target_pids:
@@ -183,6 +192,7 @@ class IPGrabberWindow(tk.Toplevel):
                 continue
 
             active_conns = 0
+            new_ips = []
             
             # Сканируем соединения только для целевых PID
             for pid in target_pids:
@@ -200,8 +210,7 @@ class IPGrabberWindow(tk.Toplevel):
                             if self.is_public_ip(ip):
                                 if ip not in self.captured_ips:
                                     self.captured_ips.add(ip)
-                                    # Обновляем UI
-                                    self.after(0, lambda i=ip: self.ip_listbox.insert(0, i))
+                                    new_ips.append(ip)
                                     self.log_callback(f"[IP GRABBER] Найден: {ip}:{port} ({conn.status})")
                                     
                 except (psutil.NoSuchProcess, psutil.AccessDenied):
@@ -210,8 +219,27 @@ class IPGrabberWindow(tk.Toplevel):
                 except Exception:
                     pass
             
+            # Сверяем новые IP с ipset одной пакетной проверкой и обновляем UI
+            if new_ips:
+                matched = index.covering_sets_many(new_ips) if index else {}
+                for ip in new_ips:
+                    names = matched.get(ip, [])
+                    # Exclude-набор не покрывает адрес, а отменяет для него обход (даже если он есть в ipset)
+                    excluded = [name for name in names if name.startswith(ipset_index.EXCLUDE_PREFIX)]
+                    included = [name for name in names if name not in excluded]
+                    if excluded:
+                        self.excluded_ips[ip] = excluded
+                        text = f"{ip}    ✗ исключен: {', '.join(excluded)}"
+                    elif included:
+                        self.covered_ips[ip] = included
+                        text = f"{ip}    ✓ уже в: {', '.join(included)}"
+                    else:
+                        text = ip
+                    self.after(0, lambda t=text: self.ip_listbox.insert(0, t))
+            
             # Обновляем статистику в UI
-            self.after(0, lambda c=active_conns: self.lbl_stats.config(text=f"Активных соединений: {c}"))
+            stats_text = f"Активных соединений: {active_conns} | Уже в ipset: {len(self.covered_ips)}/{len(self.captured_ips)} | Исключено: {len(self.excluded_ips)}"
+            self.after(0, lambda t=stats_text: self.lbl_stats.config(text=t))
             
             # Пауза меньше, чтобы не грузить ЦП, но и не пропускать пакеты
             time.sleep(0.2)
@@ -228,35 +256,27 @@ class IPGrabberWindow(tk.Toplevel):
         
         target_path = os.path.join(ipsets_dir, default_name)
         
-        mode = 'w'
+        entries = list(self.captured_ips)
         if os.path.exists(target_path):
-            if messagebox.askyesno("Файл существует", f"Файл {default_name} уже существует.\nДа - перезаписать полностью.\nНет - добавить новые IP к существующим."):
-                mode = 'w'
-            else:
-                mode = 'a'
-                # Читаем старые, чтобы не дублировать
+            if not messagebox.askyesno("Файл существует", f"Файл {default_name} уже существует.\nДа - перезаписать полностью.\nНет - добавить новые IP к существующим."):
+                # Объединяем со старыми записями: дубли и вложенные подсети схлопнутся при агрегации
                 try:
-                    with open(target_path, 'r') as f:
-                        for line in f:
-                            self.captured_ips.add(line.strip())
-                except: pass
+                    entries.extend(list_store.get_lines(target_path))
+                except Exception as e:
+                    self.log_callback(f"[IP GRABBER] Не удалось прочитать {default_name}: {e}")
 
         try:
-            with open(target_path, mode, encoding='utf-8') as f:
-                if mode == 'w':
-                    f.write(f"# Auto-generated IPSet for {self.selected_name}\n")
-                
-                # Сортируем как IP адреса, если возможно, иначе как строки
-                try:
-                    sorted_ips = sorted(list(self.captured_ips), key=lambda ip: ipaddress.ip_address(ip))
-                except:
-                    sorted_ips = sorted(list(self.captured_ips))
-                    
-                for ip in sorted_ips:
-                    if ip and not ip.startswith('#'):
-                        f.write(ip + "\n")
+            # Сворачиваем адреса в минимальный набор CIDR и вычитаем exclude-ipset
+            exclude_set = ipset_index.load_exclude_set(self.app_dir)
+            cidrs = ipset_index.aggregate_entries(entries, exclude_set)
+            
+            content = f"# Auto-generated IPSet for {self.selected_name}\n" + "".join(c + "\n" for c in cidrs)
+            atomic_write_text(target_path, content)
             
-            messagebox.showinfo("Успех", f"Сохранено {len(self.captured_ips)} IP в файл:\n{default_name}\n\nТеперь выберите этот файл в колонке 'IPSet'!")
+            raw_count = sum(1 for e in entries if e.strip() and not e.strip().startswith('#'))
+            report = f"Записано {len(cidrs)} строк вместо {raw_count} (сэкономлено {max(raw_count - len(cidrs), 0)})"
+            self.log_callback(f"[IP GRABBER] {default_name}: {report}")
+            messagebox.showinfo("Успех", f"{report} в файл:\n{default_name}\n\nТеперь выберите этот файл в колонке 'IPSet'!")
             
             if self.on_save_callback:
                 self.on_save_callback()
@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""
+Скомпилированный индекс ipset-файлов.
+
+Файлы ipsets/*.txt и exclude/ipset-exclude*.txt разбираются один раз
+в отсортированные слитые интервалы целых чисел (отдельно IPv4 и IPv6),
+после чего проверка адреса - это bisect за O(log n).
+"""
+import os
+import socket
+import heapq
+import bisect
+import ipaddress
+import logging
+
+from file_utils import atomic_write_text
+from list_store import list_store
+
+logger = logging.getLogger("process_manager.ipset_index")
+
+# Префикс имен exclude-наборов в ipset_files: такие наборы выводят адрес из-под обхода
+EXCLUDE_PREFIX = "exclude/"
+
+def ip_to_int(ip):
+    """Возвращает (версия, число) для строки адреса или None, если это не IP."""
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+    except (OSError, ValueError, TypeError):
+        pass
+    try:
+        return 6, int.from_bytes(socket.inet_pton(socket.AF_INET6, ip), 'big')
+    except (OSError, ValueError, TypeError):
+        pass
+    try:
+        addr = ipaddress.ip_address(ip)
+        return addr.version, int(addr)
+    except ValueError:
+        return None
+
+
+def parse_network(line):
+    """Разбирает строку ipset (адрес или CIDR) в (версия, начало, конец) или None."""
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    try:
+        net = ipaddress.ip_network(line, strict=False)
+    except ValueError:
+        return None
+    start = int(net.network_address)
+    return net.version, start, start + net.num_addresses - 1
+
+
+def merge_intervals(intervals):
+    """Сортирует и сливает пересекающиеся и смежные интервалы [start, end]."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(s, e) for s, e in merged]
+
+
+def subtract_intervals(intervals, excluded):
+    """Вычитает слитые интервалы excluded из слитых интервалов intervals."""
+    result = []
+    j = 0
+    for start, end in intervals:
+        while j < len(excluded) and excluded[j][1] < start:
+            j += 1
+        k = j
+        cur = start
+        while k < len(excluded) and excluded[k][0] <= end:
+            ex_start, ex_end = excluded[k]
+            if ex_start > cur:
+                result.append((cur, ex_start - 1))
+            cur = max(cur, ex_end + 1)
+            if cur > end:
+                break
+            k += 1
+        if cur <= end:
+            result.append((cur, end))
+    return result
+
+
+def interval_to_cidrs(start, end, version):
+    """Минимальный набор CIDR-префиксов, точно покрывающий интервал [start, end]."""
+    bits = 32 if version == 4 else 128
+    cidrs = []
+    while start <= end:
+        # Самый большой выровненный блок, начинающийся в start и не выходящий за end
+        size_bits = (start & -start).bit_length() - 1 if start else bits
+        while size_bits > 0 and start + (1 << size_bits) - 1 > end:
+            size_bits -= 1
+        cidrs.append((start, bits - size_bits))
+        start += 1 << size_bits
+    return cidrs
+
+
+def format_cidr(version, start, prefixlen):
+    if version == 4:
+        address = socket.inet_ntop(socket.AF_INET, start.to_bytes(4, 'big'))
+        return address if prefixlen == 32 else f"{address}/{prefixlen}"
+    address = socket.inet_ntop(socket.AF_INET6, start.to_bytes(16, 'big'))
+    return address if prefixlen == 128 else f"{address}/{prefixlen}"
+
+
+class IntervalSet:
+    """Множество адресов в виде слитых интервалов для IPv4 и IPv6."""
+
+    def __init__(self, v4=(), v6=(), source_entries=0):
+        v4 = merge_intervals(v4)
+        v6 = merge_intervals(v6)
+        self._starts = {4: [s for s, _ in v4], 6: [s for s, _ in v6]}
+        self._ends = {4: [e for _, e in v4], 6: [e for _, e in v6]}
+        self.source_entries = source_entries
+
+    @classmethod
+    def from_lines(cls, lines):
+        v4, v6 = [], []
+        count = 0
+        for line in lines:
+            parsed = parse_network(line)
+            if not parsed:
+                continue
+            version, start, end = parsed
+            (v4 if version == 4 else v6).append((start, end))
+            count += 1
+        return cls(v4, v6, count)
+
+    @classmethod
+    def from_file(cls, path):
+        return cls.from_lines(list_store.get_lines(path))
+
+    def intervals(self, version):
+        return list(zip(self._starts[version], self._ends[version]))
+
+    def subtract(self, other):
+        """Новое множество: адреса self, не входящие в other."""
+        return IntervalSet(
+            subtract_intervals(self.intervals(4), other.intervals(4)),
+            subtract_intervals(self.intervals(6), other.intervals(6))
+        )
+
+    def to_cidrs(self):
+        """Минимальный список CIDR-строк (сначала IPv4, затем IPv6)."""
+        lines = []
+        for version in (4, 6):
+            for start, end in self.intervals(version):
+                for net_start, prefixlen in interval_to_cidrs(start, end, version):
+                    lines.append(format_cidr(version, net_start, prefixlen))
+        return lines
+
+    def interval_count(self):
+        return len(self._starts[4]) + len(self._starts[6])
+
+    def address_count(self, version=4):
+        return sum(e - s + 1 for s, e in zip(self._starts[version], self._ends[version]))
+
+    def contains_int(self, version, value):
+        starts = self._starts[version]
+        i = bisect.bisect_right(starts, value) - 1
+        return i >= 0 and value <= self._ends[version][i]
+
+    def contains(self, ip):
+        parsed = ip_to_int(ip)
+        return bool(parsed) and self.contains_int(*parsed)
+
+    def contains_many(self, ips):
+        """Пакетная проверка: список bool в порядке входных адресов."""
+        bisect_right = bisect.bisect_right
+        starts, ends = self._starts, self._ends
+        result = []
+        for ip in ips:
+            parsed = ip_to_int(ip)
+            if not parsed:
+                result.append(False)
+                continue
+            version, value = parsed
+            i = bisect_right(starts[version], value) - 1
+            result.append(i >= 0 and value <= ends[version][i])
+        return result
+
+
+def load_ipset_file(path):
+    """Возвращает IntervalSet для файла; разбор кэшируется в list_store до изменения файла."""
+    try:
+        interval_set = list_store.get_derived(path, 'ipset', IntervalSet.from_lines)
+    except OSError:
+        return IntervalSet()
+    except Exception as e:
+        logger.warning(f"Failed to parse ipset {path}: {e}")
+        return IntervalSet()
+    return interval_set
+
+
+class IPSetIndex:
+    """Индекс нескольких именованных ipset: принадлежность и список покрывающих наборов."""
+
+    def __init__(self, named_sets):
+        # {имя: IntervalSet}, порядок сохраняется для стабильного вывода
+        self.sets = dict(named_sets)
+        v4, v6 = [], []
+        for interval_set in self.sets.values():
+            v4.extend(interval_set.intervals(4))
+            v6.extend(interval_set.intervals(6))
+        self.union = IntervalSet(v4, v6)
+
+    def contains(self, ip):
+        return self.union.contains(ip)
+
+    def covering_sets(self, ip):
+        parsed = ip_to_int(ip)
+        if not parsed or not self.union.contains_int(*parsed):
+            return []
+        return [name for name, s in self.sets.items() if s.contains_int(*parsed)]
+
+    def contains_many(self, ips):
+        return self.union.contains_many(ips)
+
+    def covering_sets_many(self, ips):
+        """Пакетный вариант covering_sets: {ip: [имена наборов]} только для покрытых адресов."""
+        ips = list(ips)
+        result = {}
+        for ip, hit in zip(ips, self.union.contains_many(ips)):
+            if hit:
+                result[ip] = self.covering_sets(ip)
+        return result
+
+
+def _exclude_ipset_paths(app_dir):
+    exclude_dir = os.path.join(app_dir, 'exclude')
+    return [os.path.join(exclude_dir, name) for name in list_store.list_dir(exclude_dir)
+            if name.startswith('ipset-exclude')]
+
+
+def load_exclude_set(app_dir):
+    """Объединение всех exclude/ipset-exclude*.txt."""
+    v4, v6 = [], []
+    for path in _exclude_ipset_paths(app_dir):
+        interval_set = load_ipset_file(path)
+        v4.extend(interval_set.intervals(4))
+        v6.extend(interval_set.intervals(6))
+    return IntervalSet(v4, v6)
+
+
+def aggregate_entries(entries, exclude_set=None):
+    """
+    Сворачивает адреса/префиксы в минимальный набор CIDR,
+    предварительно вычитая exclude_set. Возвращает список строк.
+    """
+    interval_set = IntervalSet.from_lines(entries)
+    if exclude_set is not None:
+        interval_set = interval_set.subtract(exclude_set)
+    return interval_set.to_cidrs()
+
+
+def _covered(starts, sizes, net, net_end):
+    """(число записей, число адресов) записей, целиком лежащих в [net, net_end]."""
+    lo = bisect.bisect_left(starts, net)
+    hi = bisect.bisect_right(starts, net_end)
+    return hi - lo, sum(sizes[starts[i]] for i in range(lo, hi)), lo, hi
+
+
+def slim_interval_set(interval_set, target_entries=None, max_extra_addresses=None, min_prefix=None):
+    """
+    Лоссовое сжатие ipset: жадно расширяет префиксы (например, несколько /24 -> /22),
+    выбирая каждый раз слияние с наименьшим числом лишних адресов на убранную строку.
+    Останавливается, когда записей не больше target_entries или следующее слияние
+    превысит бюджет max_extra_addresses. Возвращает (список CIDR-строк, шаги),
+    где шаг = (версия, начало, длина префикса, слито записей, добавлено адресов).
+    """
+    min_prefix = min_prefix or {4: 16, 6: 32}
+    bits_of = {4: 32, 6: 128}
+    starts = {}
+    sizes = {}
+    for version in (4, 6):
+        cidrs = [c for start, end in interval_set.intervals(version) for c in interval_to_cidrs(start, end, version)]
+        starts[version] = [start for start, _ in cidrs]
+        sizes[version] = {start: 1 << (bits_of[version] - plen) for start, plen in cidrs}
+
+    heap = []
+
+    def push_pair(version, left, right):
+        bits = bits_of[version]
+        right_end = right + sizes[version][right] - 1
+        plen = bits - (left ^ right_end).bit_length()
+        if plen < min_prefix[version]:
+            return
+        net = left & ~((1 << (bits - plen)) - 1)
+        net_end = net + (1 << (bits - plen)) - 1
+        count, covered, _, _ = _covered(starts[version], sizes[version], net, net_end)
+        if count < 2:
+            return
+        cost = (net_end - net + 1) - covered
+        heapq.heappush(heap, (cost / (count - 1), cost, version, net, plen))
+
+    for version in (4, 6):
+        st = starts[version]
+        for i in range(len(st) - 1):
+            push_pair(version, st[i], st[i + 1])
+
+    total = len(starts[4]) + len(starts[6])
+    extra_total = 0
+    steps = []
+    while heap and (target_entries is None or total > target_entries):
+        _, cost, version, net, plen = heapq.heappop(heap)
+        st, sz = starts[version], sizes[version]
+        net_end = net + (1 << (bits_of[version] - plen)) - 1
+        count, covered, lo, hi = _covered(st, sz, net, net_end)
+        # Кандидат устарел: внутри меньше двух записей или сеть уже поглощена более широкой
+        if count < 2 or (lo > 0 and st[lo - 1] + sz[st[lo - 1]] - 1 >= net):
+            continue
+        actual_cost = (net_end - net + 1) - covered
+        if actual_cost != cost:
+            heapq.heappush(heap, (actual_cost / (count - 1), actual_cost, version, net, plen))
+            continue
+        if max_extra_addresses is not None and extra_total + cost > max_extra_addresses:
+            continue
+
+        for start in st[lo:hi]:
+            del sz[start]
+        st[lo:hi] = [net]
+        sz[net] = net_end - net + 1
+        total -= count - 1
+        extra_total += cost
+        steps.append((version, net, plen, count, cost))
+
+        if lo > 0:
+            push_pair(version, st[lo - 1], net)
+        if lo + 1 < len(st):
+            push_pair(version, net, st[lo + 1])
+
+    lines = []
+    for version in (4, 6):
+        for start in starts[version]:
+            plen = bits_of[version] - (sizes[version][start].bit_length() - 1)
+            lines.append(format_cidr(version, start, plen))
+    return lines, steps
+
+
+def slim_ipset_file(path, target_entries=None, max_extra_addresses=None, output_path=None):
+    """
+    Пишет сжатую копию ipset рядом с оригиналом (ipset-x.txt -> ipset-x-slim.txt)
+    с отчетом в заголовке. Возвращает (путь, строки отчета).
+    """
+    source = IntervalSet.from_file(path)
+    exact = source.to_cidrs()
+    lines, steps = slim_interval_set(source, target_entries, max_extra_addresses)
+
+    # Группируем шаги по итоговой длине префикса: "/22: 120 слияний, +30000 адресов"
+    by_prefix = {}
+    for version, _, plen, count, cost in steps:
+        key = f"{'IPv4' if version == 4 else 'IPv6'} /{plen}"
+        merges, removed, added = by_prefix.get(key, (0, 0, 0))
+        by_prefix[key] = (merges + 1, removed + count - 1, added + cost)
+
+    extra_total = sum(cost for *_, cost in steps)
+    report = [
+        f"Сжатие {os.path.basename(path)}: {source.source_entries} строк -> {len(exact)} без потерь -> {len(lines)} после сжатия",
+        f"Добавлено лишних адресов: {extra_total}",
+    ]
+    for key in sorted(by_prefix, key=lambda k: (k.split()[0], int(k.split('/')[1]))):
+        merges, removed, added = by_prefix[key]
+        report.append(f"  {key}: слияний {merges}, убрано строк {removed}, добавлено адресов {added}")
+
+    if output_path is None:
+        root, ext = os.path.splitext(path)
+        output_path = f"{root}-slim{ext or '.txt'}"
+    content = "".join(f"# {line}\n" for line in report) + "".join(line + "\n" for line in lines)
+    atomic_write_text(output_path, content)
+    logger.info(f"Slimmed ipset written to {output_path}: {len(lines)} entries, +{extra_total} addresses")
+    return output_path, report
+
+
+def ipset_files(app_dir):
+    """Все ipset-файлы приложения: {имя для UI: путь}."""
+    files = {}
+    ipsets_dir = os.path.join(app_dir, 'ipsets')
+    for filename in list_store.list_dir(ipsets_dir):
+        files[filename] = os.path.join(ipsets_dir, filename)
+    for path in _exclude_ipset_paths(app_dir):
+        files[EXCLUDE_PREFIX + os.path.basename(path)] = path
+    return files
+
+
+def build_app_index(app_dir):
+    """Строит индекс по всем ipset приложения (разбор файлов кэшируется по mtime)."""
+    return IPSetIndex((name, load_ipset_file(path)) for name, path in ipset_files(app_dir).items())
@@ -0,0 +1,539 @@
+# -*- coding: utf-8 -*-
+"""
+Компилятор плана запуска winws.
+
+Собирает секции (--new) из профилей всех активных списков в один план:
+списки с одинаковым профилем и ipset объединяются в один набор секций
+с несколькими --hostlist, а полностью совпадающие секции выбрасываются.
+Так каждый пакет проходит через меньшее число фильтров.
+"""
+import os
+import re
+import shlex
+import hashlib
+import logging
+
+from list_store import list_store
+
+logger = logging.getLogger("process_manager.launch_plan")
+
+GLOBAL_TCP_PORTS = "80,443,2053,2083,2087,2096,8443"
+GLOBAL_UDP_PORTS = "443,19294-19344,50000-50100"
+GAME_PORTS = "1024-65535"
+
+# Аргументы-файлы, содержимое которых входит в отпечаток секции.
+# --hostlist-auto не входит: этот файл дописывает сам winws.
+FINGERPRINT_FILE_ARGS = ('--hostlist=', '--hostlist-exclude=', '--ipset=', '--ipset-exclude=')
+
+
+def build_global_args(game_filter_enabled):
+    """Глобальные аргументы захвата для единого процесса."""
+    game_ports = f",{GAME_PORTS}" if game_filter_enabled else ""
+    return [
+        f"--wf-tcp={GLOBAL_TCP_PORTS}{game_ports}",
+        f"--wf-udp={GLOBAL_UDP_PORTS}{game_ports}",
+        "--ctrack-disable=1"
+    ]
+
+
+def format_profile_args(profile, base_dir, game_filter_enabled):
+    """Подставляет пути и игровой фильтр в строку аргументов профиля."""
+    bin_dir = os.path.join(base_dir, 'bin').replace('\\', '/')
+    lists_dir = os.path.join(base_dir, 'lists').replace('\\', '/')
+    exclude_dir = os.path.join(base_dir, 'exclude').replace('\\', '/')
+    return profile["args"].format(
+        LISTS_DIR=lists_dir,
+        BIN_DIR=bin_dir,
+        EXCLUDE_DIR=exclude_dir,
+        GAME_FILTER=GAME_PORTS if game_filter_enabled else "12"
+    )
+
+
+def clean_profile_args(args_str):
+    """
+    Удаляет глобальные аргументы захвата (--wf-...),
+    чтобы они не конфликтовали при склейке через --new.
+    """
+    cleaned = re.sub(r'--wf-tcp=[^ ]+', '', args_str)
+    cleaned = re.sub(r'--wf-udp=[^ ]+', '', cleaned)
+    return cleaned.strip()
+
+
+def _fwd(path):
+    return path.replace('\\', '/')
+
+
+def split_args(args_str):
+    try:
+        return shlex.split(args_str)
+    except Exception as e:
+        logger.warning(f"Failed to shlex.split args, falling back to simple split: {e}")
+        return args_str.split()
+
+
+def split_sections(args_list):
+    """Делит плоский список аргументов на секции по --new."""
+    sections = [[]]
+    for arg in args_list:
+        if arg == "--new":
+            sections.append([])
+        else:
+            sections[-1].append(arg)
+    return [s for s in sections if s]
+
+
+def _is_list_hostlist_arg(arg):
+    """Аргумент hostlist, который нужно заменить на путь списка из таблицы."""
+    if arg.startswith('--hostlist=') or arg.startswith('--hostlist-auto='):
+        return 'list-general.txt' in arg or 'custom_list.txt' in arg
+    return False
+
+
+def _uses_autohostlist(profile_args):
+    """--hostlist-auto принимает только один файл, такие профили не объединяем."""
+    return any(arg.startswith('--hostlist-auto=') and _is_list_hostlist_arg(arg) for arg in profile_args)
+
+
+class Section:
+    """Одна секция winws (фрагмент между --new) и списки, которые ее породили."""
+
+    def __init__(self, args, lists, profile_name):
+        self.args = list(args)
+        self.lists = list(lists)
+        self.profile_name = profile_name
+
+    def key(self):
+        return tuple(self.args)
+
+    def arg_bytes(self):
+        return sum(len(a.encode('utf-8')) + 1 for a in self.args)
+
+    def digest(self, file_digest=None):
+        """
+        Хэш аргументов секции, в котором пути списков заменены хэшем их содержимого:
+        тот же список под другим именем (например, пересобранный кэш) - та же секция.
+        """
+        file_digest = file_digest or list_store.get_digest
+        h = hashlib.sha256()
+        for arg in self.args:
+            if arg.startswith(FINGERPRINT_FILE_ARGS):
+                prefix, path = arg.split('=', 1)
+                path = path.strip('"')
+                arg = f"{prefix}=sha256:{file_digest(path)}"
+            h.update(arg.encode('utf-8') + b'\0')
+        return h.hexdigest()
+
+    def __repr__(self):
+        return f"Section({self.profile_name!r}, lists={self.lists!r}, args={len(self.args)})"
+
+
+class LaunchPlan:
+    """Результат компиляции: глобальные аргументы + упорядоченные секции."""
+
+    def __init__(self, global_args, sections, source_section_count=0):
+        self.global_args = list(global_args)
+        self.sections = sections
+        # Сколько секций было бы без объединения и дедупликации
+        self.source_section_count = source_section_count
+
+    def to_args(self):
+        args = list(self.global_args)
+        for i, section in enumerate(self.sections):
+            if i > 0:
+                args.append("--new")
+            args.extend(section.args)
+        return args
+
+    def stats(self):
+        args = self.to_args()
+        return {
+            "sections": len(self.sections),
+            "source_sections": self.source_section_count,
+            "args": len(args),
+            "arg_bytes": sum(len(a.encode('utf-8')) + 1 for a in args),
+        }
+
+    def describe(self):
+        """Человекочитаемое описание плана (по строке на секцию)."""
+        st = self.stats()
+        lines = [
+            f"План запуска: {st['sections']} секций (без оптимизации: {st['source_sections']}), "
+            f"{st['args']} аргументов, {st['arg_bytes']} байт"
+        ]
+        for i, section in enumerate(self.sections, 1):
+            lists_str = ", ".join(os.path.basename(l) for l in section.lists) or "-"
+            filters = " ".join(a for a in section.args if a.startswith('--filter-'))
+            lines.append(f"  #{i} [{section.profile_name}] {filters or '(все пакеты)'} <- {lists_str}")
+        return lines
+
+    def diff(self, other):
+        """
+        Сравнивает план с другим (other - старый план).
+        Возвращает (добавленные, удаленные) секции.
+        """
+        old_keys = {s.key() for s in other.sections} if other else set()
+        new_keys = {s.key() for s in self.sections}
+        added = [s for s in self.sections if s.key() not in old_keys]
+        removed = [s for s in other.sections if s.key() not in new_keys] if other else []
+        return added, removed
+
+    def fingerprint(self, file_digest=None):
+        """
+        Снимок плана для последующего сравнения: глобальные аргументы и
+        {хэш секции: секция}. Файлы хэшируются в момент вызова.
+        """
+        return {
+            "global": tuple(self.global_args),
+            "sections": {section.digest(file_digest): section for section in self.sections},
+        }
+
+
+def compare_fingerprints(old, new):
+    """
+    Возвращает (добавленные, удаленные) секции между двумя отпечатками.
+    При смене глобальных аргументов считаются измененными все секции.
+    """
+    if old["global"] != new["global"]:
+        return list(new["sections"].values()), list(old["sections"].values())
+    added = [s for d, s in new["sections"].items() if d not in old["sections"]]
+    removed = [s for d, s in old["sections"].items() if d not in new["sections"]]
+    return added, removed
+
+
+def changed_lists(added, removed):
+    """Пути списков, чьи секции добавились, пропали или изменились."""
+    paths = []
+    for section in added + removed:
+        for path in section.lists:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def _process_section_args(args, list_paths, ipset_path, user_hostlist_exclude, user_ipset_exclude, resolve_ipset_path):
+    processed = []
+    for arg in args:
+        # 1. Обработка hostlist (замена путей; при объединении - несколько --hostlist)
+        if _is_list_hostlist_arg(arg):
+            prefix = arg.split('=')[0]
+            for list_path in list_paths:
+                processed.append(f"{prefix}={_fwd(list_path)}")
+
+        # 2. Инъекция пользовательских исключений доменов (как в BAT)
+        elif arg.startswith('--hostlist-exclude='):
+            processed.append(arg)
+            processed.append(f'--hostlist-exclude={user_hostlist_exclude}')
+
+        # 3. Инъекция пользовательских исключений IP
+        elif arg.startswith('--ipset-exclude='):
+            processed.append(arg)
+            processed.append(f'--ipset-exclude={user_ipset_exclude}')
+
+        # 4. IPSet: выбранный в UI или путь из профиля (с исправлением папки)
+        elif arg.startswith('--ipset='):
+            if ipset_path and ipset_path != "OFF":
+                processed.append(f"--ipset={_fwd(ipset_path)}")
+            else:
+                raw_path = arg.split('=', 1)[1].strip('"')
+                processed.append(f"--ipset={_fwd(resolve_ipset_path(raw_path))}")
+        else:
+            processed.append(arg)
+    return processed
+
+
+def compile_launch_plan(configs, base_dir, game_filter_enabled, user_hostlist_exclude, user_ipset_exclude,
+                        resolve_ipset_path=None, optimize=True):
+    """
+    Компилирует список (list_path, profile, ipset_path) в LaunchPlan.
+    optimize=False воспроизводит старую склейку "профиль на каждый список".
+    """
+    if resolve_ipset_path is None:
+        resolve_ipset_path = lambda path: path
+
+    # Группируем списки по (профиль, ipset), сохраняя порядок первого появления
+    groups = []
+    group_index = {}
+    for list_path, profile, ipset_path in configs:
+        profile_args = split_args(clean_profile_args(format_profile_args(profile, base_dir, game_filter_enabled)))
+        group_key = (profile.get('name', 'unnamed'), ipset_path or "OFF")
+        if optimize and group_key in group_index and not _uses_autohostlist(profile_args):
+            groups[group_index[group_key]][1].append(list_path)
+            continue
+        group_index.setdefault(group_key, len(groups))
+        groups.append((profile, [list_path], ipset_path, profile_args))
+
+    sections = []
+    seen = {}
+    source_count = 0
+    for profile, list_paths, ipset_path, profile_args in groups:
+        for section_args in split_sections(profile_args):
+            source_count += len(list_paths)
+            args = _process_section_args(
+                section_args, list_paths, ipset_path,
+                user_hostlist_exclude, user_ipset_exclude, resolve_ipset_path
+            )
+            section = Section(args, list_paths, profile.get('name', 'unnamed'))
+            key = section.key()
+            if optimize and key in seen:
+                # Точно такая же секция уже есть выше - winws все равно выберет ее первой
+                for lp in list_paths:
+                    if lp not in seen[key].lists:
+                        seen[key].lists.append(lp)
+                logger.debug(f"Dropped duplicate section of {section.profile_name} for {list_paths}")
+                continue
+            seen[key] = section
+            sections.append(section)
+
+    plan = LaunchPlan(build_global_args(game_filter_enabled), sections, source_count)
+    logger.debug(f"Compiled launch plan: {plan.stats()}")
+    return plan
+
+
+# --- Шардирование: несколько winws с непересекающимися фильтрами WinDivert ---
+
+PORT_MAX = 65535
+_SHARD_PROTOCOLS = ("tcp", "udp")
+
+
+def parse_port_ranges(spec):
+    """
+    '80,443,1024-65535' -> отсортированные непересекающиеся [(lo, hi)].
+    ValueError, если часть не разбирается (например, '*' или отрицание '~'):
+    угадывать, какие порты имелись в виду, нельзя.
+    """
+    ranges = []
+    for part in spec.strip().strip('"').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        lo, _, hi = part.partition('-')
+        try:
+            lo = int(lo)
+            hi = int(hi) if hi else lo
+        except ValueError:
+            raise ValueError(f"unsupported port spec {part!r} in {spec!r}") from None
+        if lo > hi:
+            lo, hi = hi, lo
+        ranges.append((max(lo, 0), min(hi, PORT_MAX)))
+    return _merge_ranges(ranges)
+
+
+def format_port_ranges(ranges):
+    return ",".join(str(lo) if lo == hi else f"{lo}-{hi}" for lo, hi in ranges)
+
+
+def _merge_ranges(ranges):
+    merged = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1] + 1:
+            if hi > merged[-1][1]:
+                merged[-1] = (merged[-1][0], hi)
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def _intersect_ranges(a, b):
+    result, i, j = [], 0, 0
+    while i < len(a) and j < len(b):
+        lo, hi = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+        if lo <= hi:
+            result.append((lo, hi))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def _subtract_ranges(a, b):
+    result = []
+    for lo, hi in a:
+        for blo, bhi in b:
+            if bhi < lo or blo > hi:
+                continue
+            if blo > lo:
+                result.append((lo, blo - 1))
+            lo = bhi + 1
+            if lo > hi:
+                break
+        if lo <= hi:
+            result.append((lo, hi))
+    return result
+
+
+def _capture_ranges(global_args):
+    capture = {proto: [] for proto in _SHARD_PROTOCOLS}
+    for arg in global_args:
+        for proto in _SHARD_PROTOCOLS:
+            if arg.startswith(f"--wf-{proto}="):
+                capture[proto] = parse_port_ranges(arg.split('=', 1)[1])
+    return capture
+
+
+def _section_ports(section, capture):
+    """
+    Порты секции по протоколам в пределах захвата или None, если секция без
+    --filter-tcp/--filter-udp (такая секция подходит любому пакету).
+    Если задан только один из фильтров, другой протокол секция не принимает.
+    """
+    filters = {}
+    for arg in section.args:
+        for proto in _SHARD_PROTOCOLS:
+            if arg.startswith(f"--filter-{proto}="):
+                filters[proto] = parse_port_ranges(arg.split('=', 1)[1])
+    if not filters:
+        return None
+    return {proto: _intersect_ranges(filters.get(proto, []), capture[proto]) for proto in _SHARD_PROTOCOLS}
+
+
+class _DisjointSet:
+    def __init__(self, size):
+        self.parent = list(range(size))
+
+    def find(self, x):
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            self.parent[max(ra, rb)] = min(ra, rb)
+
+
+def shard_plan(plan, shard_count):
+    """
+    Делит план на не более чем shard_count планов с непересекающимися
+    --wf-tcp/--wf-udp, чтобы каждый пакет попадал ровно в один winws.
+
+    Секции, чьи порты пересекаются (или которые пишут в один --hostlist-auto),
+    должны остаться в одном процессе - иначе изменится выбор первой подходящей
+    секции. Они объединяются в компоненты (union-find по отрезкам портов),
+    компоненты раскладываются по шардам жадно по числу секций. Секции без
+    фильтра портов копируются во все шарды в исходном порядке, а порты захвата,
+    не занятые ни одной компонентой, отдаются самому легкому шарду.
+    Если разделить нельзя (в том числе при неразборчивом фильтре портов), возвращается [plan].
+    """
+    if shard_count <= 1 or len(plan.sections) < 2:
+        return [plan]
+    try:
+        capture = _capture_ranges(plan.global_args)
+        ports = [_section_ports(section, capture) for section in plan.sections]
+    except ValueError as e:
+        # Без точных портов секция выглядела бы пустой, и ее пакеты никто бы не обработал
+        logger.debug(f"Sharding skipped: {e}")
+        return [plan]
+    universal = [i for i, p in enumerate(ports) if p is None]
+    if any(any(a.startswith('--hostlist-auto=') for a in plan.sections[i].args) for i in universal):
+        # Общий файл автосписка нельзя дописывать из нескольких процессов
+        logger.debug("Sharding skipped: a catch-all section uses --hostlist-auto")
+        return [plan]
+
+    dsu = _DisjointSet(len(plan.sections))
+    for proto in _SHARD_PROTOCOLS:
+        spans = sorted((lo, hi, i) for i, p in enumerate(ports) if p for lo, hi in p[proto])
+        current_end, current = -1, None
+        for lo, hi, i in spans:
+            if current is not None and lo <= current_end:
+                dsu.union(current, i)
+                current_end = max(current_end, hi)
+            else:
+                current, current_end = i, hi
+    autohostlist_owner = {}
+    for i, section in enumerate(plan.sections):
+        for arg in section.args:
+            if arg.startswith('--hostlist-auto='):
+                path = os.path.normcase(arg.split('=', 1)[1].strip('"'))
+                if path in autohostlist_owner:
+                    dsu.union(autohostlist_owner[path], i)
+                autohostlist_owner.setdefault(path, i)
+
+    components = {}
+    for i, p in enumerate(ports):
+        if p is None:
+            continue
+        if not any(p[proto] for proto in _SHARD_PROTOCOLS):
+            # Порты секции вне захвата: пакеты до нее не дойдут, но секцию не теряем
+            components.setdefault(-1, []).append(i)
+            continue
+        components.setdefault(dsu.find(i), []).append(i)
+    orphans = components.pop(-1, [])
+    if len(components) < 2:
+        return [plan]
+
+    shard_count = min(shard_count, len(components))
+    shards = [{"members": [], "load": 0} for _ in range(shard_count)]
+    # LPT: самые тяжелые компоненты первыми, каждая - в наименее загруженный шард
+    for members in sorted(components.values(), key=lambda m: (-len(m), m[0])):
+        target = min(shards, key=lambda s: s["load"])
+        target["members"].extend(members)
+        target["load"] += len(members)
+    shards[0]["members"].extend(orphans)
+
+    if universal:
+        used = {proto: _merge_ranges([r for p in ports if p for r in p[proto]]) for proto in _SHARD_PROTOCOLS}
+        lightest = min(shards, key=lambda s: s["load"])
+        lightest["residual"] = {proto: _subtract_ranges(capture[proto], used[proto]) for proto in _SHARD_PROTOCOLS}
+
+    other_global = [a for a in plan.global_args if not a.startswith(('--wf-tcp=', '--wf-udp='))]
+    plans = []
+    for shard in shards:
+        members = set(shard["members"]) | set(universal)
+        sections = [plan.sections[i] for i in range(len(plan.sections)) if i in members]
+        wf_args = []
+        for proto in _SHARD_PROTOCOLS:
+            ranges = [r for i in shard["members"] if ports[i] for r in ports[i][proto]]
+            ranges += shard.get("residual", {}).get(proto, [])
+            ranges = _merge_ranges(ranges)
+            if ranges:
+                wf_args.append(f"--wf-{proto}={format_port_ranges(ranges)}")
+        if not wf_args:
+            continue
+        plans.append(LaunchPlan(wf_args + other_global, sections, len(sections)))
+    logger.debug(f"Sharded plan into {len(plans)} instances: {[len(p.sections) for p in plans]} sections")
+    return plans if len(plans) > 1 else [plan]
+
+
+# --- Сходство профилей по аргументам обхода ---
+
+# Аргументы, которые выбирают трафик секции (а не способ обхода)
+_FILTER_ARG_PREFIXES = ('--filter-', '--hostlist', '--ipset', '--wf-')
+
+
+def _feature_value(arg):
+    key, sep, value = arg.partition('=')
+    if sep and ('/' in value or '\\' in value):
+        # Пути к файлам (fake-пакеты и т.п.) сравниваются по имени файла
+        value = os.path.basename(_fwd(value.strip('"')))
+    return f"{key}={value}" if sep else key
+
+
+def profile_features(profile, protocol=None):
+    """
+    Набор признаков профиля для сравнения: каждое действие обхода (--dpi-desync...,
+    --ip-id и т.п.) в паре с фильтром своей секции, например
+    '--filter-tcp=80,443|--dpi-desync=fake'. Списки и исключения не учитываются.
+    protocol ("tcp"/"udp") оставляет только секции, которые могут обработать этот трафик.
+    """
+    features = set()
+    for section in split_sections(split_args(profile["args"])):
+        l4 = {a.split('=', 1)[0][len('--filter-'):] for a in section if a.startswith(('--filter-tcp=', '--filter-udp='))}
+        if protocol and l4 and protocol not in l4:
+            continue
+        filters = sorted(_feature_value(a) for a in section if a.startswith('--filter-'))
+        scope = " ".join(filters) or "*"
+        for arg in section:
+            if not arg.startswith(_FILTER_ARG_PREFIXES):
+                features.add(f"{scope}|{_feature_value(arg)}")
+    return frozenset(features)
+
+
+def profile_similarity(a, b):
+    """Коэффициент Жаккара наборов признаков двух профилей (1.0 - одинаковый обход)."""
+    fa = a if isinstance(a, frozenset) else profile_features(a)
+    fb = b if isinstance(b, frozenset) else profile_features(b)
+    if not fa and not fb:
+        return 1.0
+    return len(fa & fb) / len(fa | fb)
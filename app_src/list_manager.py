@@ -1,5 +1,6 @@
 import os
 import tkinter as tk
+from list_store import list_store
 
 class ListManager:
     """Класс для управления списками доменов."""
@@ -20,13 +21,10 @@ class ListManager:
         """Возвращает список имен файлов (включая кастомный список)."""
         files = []
         
-        # 1. Ищем стандартные txt в папке lists
-        if os.path.exists(self.lists_dir):
-            for filename in os.listdir(self.lists_dir):
-                if filename.endswith('.txt') and filename != 'ipset-all.txt':
-                    files.append(filename)
-        
-        files.sort()
+        # 1. Ищем стандартные txt в папке lists (содержимое папки кэшируется до ее изменения)
+        for filename in list_store.list_dir(self.lists_dir):
+            if filename != 'ipset-all.txt':
+                files.append(filename)
         
         # 2. Добавляем кастомный список, если он задан и существует
         if self.custom_list_path and os.path.exists(self.custom_list_path):
@@ -50,12 +48,7 @@ class ListManager:
     def get_available_ipsets(self):
         """Возвращает список доступных файлов ipset."""
         ipsets_dir = os.path.join(self.app_dir, 'ipsets')
-        files = ["OFF"]
-        if os.path.exists(ipsets_dir):
-            for filename in os.listdir(ipsets_dir):
-                if filename.endswith('.txt'):
-                    files.append(filename)
-        return files
+        return ["OFF"] + list_store.list_dir(ipsets_dir)
 
     def get_mapping(self):
         """Возвращает текущую карту профилей."""
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Общий кэш разобранных файлов списков (hostlist, ipset, exclude).
+
+Файл перечитывается только если изменились его mtime или размер,
+содержимое папок - только если изменился mtime папки. Все модули,
+которые читают списки, берут данные отсюда.
+
+Запись: новые записи дописываются в конец файла, а полная перезапись
+(временный файл + fsync + rename) выполняется только когда нужно удалить
+строки. Дубликаты, накопившиеся от дописывания, убирает ListCompactor
+в фоне.
+"""
+import os
+import hashlib
+import threading
+import logging
+
+from file_utils import atomic_write_text, append_lines
+
+logger = logging.getLogger("process_manager.list_store")
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class _CachedFile:
+    def __init__(self, stamp, data):
+        self.stamp = stamp
+        self.digest = hashlib.sha256(data).hexdigest()
+        text = data.decode('utf-8', errors='ignore')
+        # Строки без пробелов по краям, пустых строк и комментариев - в исходном порядке
+        self.lines = tuple(
+            line for line in (raw.strip() for raw in text.splitlines())
+            if line and not line.startswith('#')
+        )
+        self._entries = None
+        self.derived = {}
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = frozenset(line.lower() for line in self.lines)
+        return self._entries
+
+
+class ListStore:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._files = {}
+        self._dirs = {}
+        # Все записи в файлы списков идут последовательно
+        self._write_lock = threading.Lock()
+
+    def _get(self, path):
+        key = os.path.normcase(os.path.abspath(path))
+        stamp = _stamp(key)
+        if stamp is None:
+            with self._lock:
+                self._files.pop(key, None)
+            raise FileNotFoundError(path)
+        with self._lock:
+            cached = self._files.get(key)
+            if cached and cached.stamp == stamp:
+                return cached
+        with open(key, 'rb') as f:
+            data = f.read()
+        cached = _CachedFile(stamp, data)
+        with self._lock:
+            self._files[key] = cached
+        logger.debug(f"Loaded list {path}: {len(cached.lines)} entries")
+        return cached
+
+    def get_lines(self, path):
+        """Значимые строки файла в исходном порядке (OSError, если файла нет)."""
+        return self._get(path).lines
+
+    def get_entries(self, path):
+        """Множество нормализованных (нижний регистр) записей файла."""
+        return self._get(path).entries
+
+    def has_entries(self, path):
+        """True, если файл существует и содержит хотя бы одну запись."""
+        try:
+            return bool(self._get(path).lines)
+        except OSError:
+            return False
+
+    def get_digest(self, path):
+        """SHA-256 содержимого файла или пустая строка, если файла нет."""
+        try:
+            return self._get(path).digest
+        except OSError:
+            return ""
+
+    def get_derived(self, path, key, builder):
+        """
+        Кэширует builder(lines) для файла - например, разобранный ipset.
+        Пересчитывается вместе с перечитыванием файла.
+        """
+        cached = self._get(path)
+        with self._lock:
+            if key in cached.derived:
+                return cached.derived[key]
+        value = builder(cached.lines)
+        with self._lock:
+            cached.derived[key] = value
+        return value
+
+    def list_dir(self, dirname, suffix='.txt'):
+        """Отсортированные имена файлов с суффиксом; папка перечитывается при изменении mtime."""
+        key = (os.path.normcase(os.path.abspath(dirname)), suffix)
+        stamp = _stamp(key[0])
+        if stamp is None:
+            return []
+        with self._lock:
+            cached = self._dirs.get(key)
+            if cached and cached[0] == stamp:
+                return list(cached[1])
+        names = sorted(name for name in os.listdir(key[0]) if name.endswith(suffix))
+        with self._lock:
+            self._dirs[key] = (stamp, names)
+        return list(names)
+
+    def append_entries(self, path, entries):
+        """Быстрый путь: дописывает записи в конец файла без перезаписи. Возвращает их число."""
+        with self._write_lock:
+            count = append_lines(path, entries)
+        self.invalidate(path)
+        return count
+
+    def rewrite_entries(self, path, keep=None, extra=()):
+        """
+        Атомарно переписывает файл. Комментарии и пустые строки остаются на своих местах,
+        из записей остаются первые вхождения (keep=None - все, иначе только входящие в keep),
+        extra дописываются в конец. Возвращает (записано записей, удалено строк).
+        """
+        keep_set = None if keep is None else {entry.strip().lower() for entry in keep}
+        with self._write_lock:
+            try:
+                with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+                    raw_lines = f.read().splitlines()
+            except FileNotFoundError:
+                raw_lines = []
+            out, seen, dropped = [], set(), 0
+            for raw in raw_lines:
+                line = raw.strip()
+                if not line or line.startswith('#'):
+                    out.append(raw)
+                    continue
+                norm = line.lower()
+                if norm in seen or (keep_set is not None and norm not in keep_set):
+                    dropped += 1
+                    continue
+                seen.add(norm)
+                out.append(line)
+            for entry in extra:
+                norm = entry.strip().lower()
+                if norm and norm not in seen:
+                    seen.add(norm)
+                    out.append(entry.strip())
+            atomic_write_text(path, "".join(line + "\n" for line in out))
+        self.invalidate(path)
+        logger.debug(f"Rewrote list {path}: {len(seen)} entries, dropped {dropped}")
+        return len(seen), dropped
+
+    def invalidate(self, path=None):
+        """Сбрасывает кэш файла (или весь кэш, если путь не указан)."""
+        with self._lock:
+            if path is None:
+                self._files.clear()
+                self._dirs.clear()
+            else:
+                self._files.pop(os.path.normcase(os.path.abspath(path)), None)
+
+
+class ListCompactor:
+    """
+    Фоновая компактизация дописываемых списков: через delay секунд после
+    последнего дописывания удаляет повторяющиеся записи (одна перезапись
+    на пачку дописываний).
+    """
+
+    def __init__(self, store, delay=30.0):
+        self.store = store
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._timers = {}
+
+    def schedule(self, path):
+        with self._lock:
+            timer = self._timers.pop(path, None)
+            if timer:
+                timer.cancel()
+            timer = threading.Timer(self.delay, self._run, args=(path,))
+            timer.daemon = True
+            self._timers[path] = timer
+            timer.start()
+
+    def _run(self, path):
+        with self._lock:
+            self._timers.pop(path, None)
+        try:
+            self.compact(path)
+        except Exception as e:
+            logger.warning(f"Background compaction of {path} failed: {e}")
+
+    def compact(self, path):
+        """Удаляет дубликаты, если они есть. Возвращает число удаленных строк."""
+        lines = self.store.get_lines(path)
+        if len(lines) == len(self.store.get_entries(path)):
+            return 0
+        _, dropped = self.store.rewrite_entries(path)
+        logger.info(f"Compacted {path}: removed {dropped} duplicate entries")
+        return dropped
+
+
+# Общие экземпляры для всего приложения
+list_store = ListStore()
+list_compactor = ListCompactor(list_store)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Кольцевой буфер записей лога.
+
+Хранит не больше capacity последних записей: при переполнении самые старые
+вытесняются. Для каждого типа записи ("main", "domain", "status", ...) ведется
+свой индекс, поэтому перерисовка окна с фильтром перебирает только нужные
+типы, а не весь буфер.
+"""
+import collections
+import heapq
+
+DEFAULT_LOG_CAPACITY = 20000
+MIN_LOG_CAPACITY = 1000
+
+
+class LogBuffer:
+    def __init__(self, capacity=DEFAULT_LOG_CAPACITY):
+        self.capacity = max(MIN_LOG_CAPACITY, int(capacity))
+        # (seq, запись) в порядке поступления
+        self._entries = collections.deque()
+        # тип -> deque (seq, запись); порядок внутри типа тот же, что и в общем буфере
+        self._by_type = {}
+        self._seq = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return (entry for _, entry in self._entries)
+
+    def extend(self, entries):
+        """
+        Добавляет записи в конец. Возвращает список вытесненных записей
+        (самые старые, в порядке поступления) - по нему окно удаляет
+        строки сверху.
+        """
+        for entry in entries:
+            self._seq += 1
+            item = (self._seq, entry)
+            self._entries.append(item)
+            self._by_type.setdefault(entry["type"], collections.deque()).append(item)
+        return self._evict()
+
+    def set_capacity(self, capacity):
+        """Меняет емкость; при уменьшении возвращает вытесненные записи."""
+        self.capacity = max(MIN_LOG_CAPACITY, int(capacity))
+        return self._evict()
+
+    def clear(self):
+        self._entries.clear()
+        self._by_type.clear()
+
+    def entries(self, types=None):
+        """Записи в порядке поступления; types - множество типов для фильтра."""
+        if types is None:
+            return list(self)
+        queues = [self._by_type[t] for t in types if self._by_type.get(t)]
+        if len(queues) == 1:
+            return [entry for _, entry in queues[0]]
+        return [entry for _, entry in heapq.merge(*queues, key=lambda item: item[0])]
+
+    def counts(self):
+        return {log_type: len(queue) for log_type, queue in self._by_type.items() if queue}
+
+    def _evict(self):
+        evicted = []
+        while len(self._entries) > self.capacity:
+            item = self._entries.popleft()
+            # Вытесняемая запись - самая старая и в своем индексе
+            self._by_type[item[1]["type"]].popleft()
+            evicted.append(item[1])
+        self.evicted += len(evicted)
+        return evicted
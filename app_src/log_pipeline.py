@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Пакетная доставка логов в GUI.
+
+Любой поток кладет записи через submit()/submit_process_line(), а UI-поток
+раз в interval_ms забирает все накопленное и передает в deliver() одним
+пакетом - одно обновление окна на пакет вместо одного на строку.
+
+Сообщения приложения не теряются никогда. Строки stdout winws идут
+в ограниченную очередь: если UI не успевает, самые старые строки
+отбрасываются (читатель stdout не блокируется, иначе встанет winws),
+а число потерь выводится отдельной записью и в stats().
+"""
+import collections
+import threading
+import logging
+
+logger = logging.getLogger("process_manager.log_pipeline")
+
+
+class LogPipeline:
+    def __init__(self, root, deliver, make_entry, interval_ms=100, max_batch=2000, max_pending_lines=5000):
+        self.root = root
+        self.deliver = deliver
+        # make_entry(текст, тип) -> запись лога; нужна для сообщения о потерях
+        self.make_entry = make_entry
+        self.interval_ms = interval_ms
+        self.max_batch = max_batch
+        self.max_pending_lines = max_pending_lines
+
+        self._lock = threading.Lock()
+        self._messages = collections.deque()
+        self._lines = collections.deque()
+        self._dropped_since_report = 0
+        self._seq = 0
+        self._running = False
+
+        self.submitted = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.batches = 0
+        self.max_pending = 0
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.root.after(self.interval_ms, self._drain)
+
+    def stop(self):
+        self._running = False
+
+    def submit(self, entry):
+        """Сообщение приложения: доставляется всегда."""
+        with self._lock:
+            self._seq += 1
+            self._messages.append((self._seq, entry))
+            self.submitted += 1
+
+    def submit_process_line(self, entry):
+        """
+        Строка вывода процесса. Возвращает False, если очередь была полна
+        и ради нее отброшена самая старая строка.
+        """
+        with self._lock:
+            self.submitted += 1
+            self._seq += 1
+            self._lines.append((self._seq, entry))
+            if len(self._lines) > self.max_pending_lines:
+                self._lines.popleft()
+                self.dropped += 1
+                self._dropped_since_report += 1
+                return False
+            return True
+
+    def pending(self):
+        with self._lock:
+            return len(self._messages) + len(self._lines)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "submitted": self.submitted,
+                "delivered": self.delivered,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "pending": len(self._messages) + len(self._lines),
+                "max_pending": self.max_pending,
+            }
+
+    def _take_batch(self):
+        with self._lock:
+            pending = len(self._messages) + len(self._lines)
+            self.max_pending = max(self.max_pending, pending)
+            batch = []
+            messages, lines = self._messages, self._lines
+            # Сливаем две очереди по порядковому номеру, чтобы сохранить порядок записей
+            while (messages or lines) and len(batch) < self.max_batch:
+                if not lines or (messages and messages[0][0] < lines[0][0]):
+                    batch.append(messages.popleft()[1])
+                else:
+                    batch.append(lines.popleft()[1])
+            dropped = self._dropped_since_report
+            self._dropped_since_report = 0
+        return batch, dropped
+
+    def _drain(self):
+        if not self._running:
+            return
+        try:
+            batch, dropped = self._take_batch()
+            if dropped:
+                batch.append(self.make_entry(f"Лог не успевает за процессом: пропущено {dropped} строк вывода winws", "status"))
+            if batch:
+                self.deliver(batch)
+                self.delivered += len(batch)
+                self.batches += 1
+        except Exception as e:
+            logger.warning(f"Log batch delivery failed: {e}")
+        finally:
+            if self._running:
+                self.root.after(self.interval_ms, self._drain)
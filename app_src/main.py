@@ -3,13 +3,13 @@ from tkinter import ttk, messagebox, filedialog, simpledialog
 import os
 import sys
 import threading
-import queue
 import subprocess
 import traceback
 import logging
 import time
 import datetime
 import ctypes
+import sqlite3
 import requests
 import webbrowser
 
@@ -70,6 +70,16 @@ try:
     from ui_manager import UIManager
     from domain_manager import DomainManager
     from batch_gen import get_update_bat_content
+    import ipset_index
+    import launch_plan
+    from log_pipeline import LogPipeline
+    from log_buffer import DEFAULT_LOG_CAPACITY
+    from winws_parser import WinwsOutputParser, NOISE_KINDS
+    from hit_stats import HitStats
+    from test_history import TestHistory, network_key
+    import probe_engine
+    from list_store import list_store
+    from resource_monitor import resource_sampler, DEFAULT_POLICIES
 except Exception as e:
     print(traceback.format_exc(), file=sys.stderr)
     sys.exit(1)
@@ -87,7 +97,12 @@ class App:
         
         self.root = root
         self.active_processes = {}
-        self.log_queue = queue.Queue()
+        # Отпечаток плана, с которым запущен процесс (для решения о перезапуске)
+        self.running_fingerprint = None
+        self.supervisor = None
+        # Парсеры вывода winws текущего запуска (по одному на шард)
+        self.winws_parsers = []
+        self.log_pipeline = LogPipeline(root, self._append_logs, self._make_log_entry)
         
         self.app_dir = APP_SOURCE_DIR
         self.profiles = PROFILES
@@ -97,6 +112,22 @@ class App:
         self.ui_manager = UIManager(self)
         self.domain_manager = DomainManager(self)
         self.settings_manager = settings_manager
+        # Попадания доменов по данным --debug (для чистки неиспользуемых записей)
+        self.hit_stats = HitStats(os.path.join(self.app_dir, "hit_stats.json"))
+        self.hit_stats.start_autosave()
+        # Результаты тестов профилей по сетям (порядок в быстром поиске, отчет)
+        history_path = os.path.join(self.app_dir, "test_history.sqlite3")
+        try:
+            self.test_history = TestHistory(history_path)
+        except sqlite3.Error as e:
+            # Испорченная или заблокированная база не должна мешать запуску: тесты работают без истории
+            self.test_history = None
+            self.log_message(f"История тестов недоступна ({history_path}): {e}", "error")
+        # Метрики ресурсов winws и самого GUI; политики задаются в настройках
+        self.resource_policies = DEFAULT_POLICIES
+        resource_sampler.configure(policies=self.resource_policies, log_callback=self.log_message)
+        resource_sampler.watch("gui", os.getpid())
+        resource_sampler.start()
         
         os.makedirs("roo_tests", exist_ok=True)
         self.status_logger = logging.getLogger("status_indicators")
@@ -112,7 +143,7 @@ class App:
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
         
         power_handler.setup_power_handler(self)
-        self.run_in_thread(self.log_queue_monitor)
+        self.log_pipeline.start()
         self.create_update_script()
         self.check_admin_status_log()
         
@@ -144,7 +175,7 @@ class App:
     def create_widgets(self):
         self.ui_manager.create_widgets()
 
-    def log_message(self, message, log_type="main"):
+    def _make_log_entry(self, message, log_type="main"):
         timestamp = datetime.datetime.now().strftime("%H:%M:%S")
         prefix = ""
         if log_type == "domain": prefix = "[ДОМЕНЫ] "
@@ -153,26 +184,37 @@ class App:
         elif log_type == "success": prefix = "[УСПЕХ] "
         
         formatted_message = f"[{timestamp}] {prefix}{message}"
-        log_entry = {"text": formatted_message, "type": log_type, "timestamp": timestamp}
-        self.root.after(0, lambda: self._append_log(log_entry))
+        return {"text": formatted_message, "type": log_type, "timestamp": timestamp}
+
+    def log_message(self, message, log_type="main"):
+        # Запись уходит в пакетный конвейер, окно обновляется раз в 100 мс
+        self.log_pipeline.submit(self._make_log_entry(message, log_type))
+
+    def log_process_line(self, line, prefix="winws", log_type="main"):
+        """Строка stdout процесса: при перегрузке UI старые строки отбрасываются."""
+        self.log_pipeline.submit_process_line(self._make_log_entry(f"[{prefix}] {line}", log_type))
+
+    def _on_winws_output(self, parser, line):
+        # Построчный поток --debug только считается, в окно логов идут остальные события
+        event = parser.feed(line)
+        if parser.track_hits and parser in self.winws_parsers:
+            self.hit_stats.observe()
+            if event.kind == "match":
+                self.hit_stats.record(parser.section_lists(event.profile), event.data)
+        if event.kind in NOISE_KINDS:
+            return
+        self.log_process_line(line, prefix=parser.label, log_type="error" if event.kind == "error" else "main")
 
-    def _append_log(self, log_entry):
-        self.ui_manager.all_logs.append(log_entry)
-        self.ui_manager.update_log_display()
+    def _append_logs(self, batch):
+        self.ui_manager.append_logs(batch)
 
     def run_in_thread(self, target_func, *args):
         thread = threading.Thread(target=target_func, args=args, daemon=True)
         thread.start()
 
-    def run_all_configured(self):
-        if self.active_processes:
-            if not messagebox.askyesno("Перезапуск", "Процесс уже запущен. Перезапустить?"):
-                return
-            self.stop_process()
-            time.sleep(1)
-
-        self.log_message("=== ЗАПУСК ЕДИНОГО ПРОЦЕССА ===", "status")
-        
+    def _collect_configs(self, log_errors=True):
+        """Возвращает (configs, имена списков) для всех списков с назначенным профилем."""
+        log = self.log_message if log_errors else (lambda *a, **k: None)
         prof_mapping = self.list_manager.get_mapping()
         ipset_mapping = self.list_manager.get_ipset_mapping()
         available_lists = self.list_manager.get_available_files()
@@ -188,12 +230,12 @@ class App:
                 
             profile_obj = next((p for p in self.profiles if p['name'] == profile_name), None)
             if not profile_obj:
-                self.log_message(f"Ошибка: Профиль '{profile_name}' не найден для {list_identifier}!", "error")
+                log(f"Ошибка: Профиль '{profile_name}' не найден для {list_identifier}!", "error")
                 continue
             
             full_list_path = self.list_manager.get_full_path(list_identifier)
             if not full_list_path or not os.path.exists(full_list_path):
-                self.log_message(f"Файл не найден: {full_list_path}", "error")
+                log(f"Файл не найден: {full_list_path}", "error")
                 continue
             
             ipset_setting = ipset_mapping.get(list_identifier, "OFF")
@@ -203,10 +245,84 @@ class App:
                 if os.path.exists(potential_path):
                     ipset_path = potential_path
                 else:
-                    self.log_message(f"Предупреждение: IPSet файл '{ipset_setting}' не найден для списка {list_identifier}", "error")
+                    log(f"Предупреждение: IPSet файл '{ipset_setting}' не найден для списка {list_identifier}", "error")
 
             configs_to_run.append((full_list_path, profile_obj, ipset_path))
             active_list_names.append(list_identifier)
+        return configs_to_run, active_list_names
+
+    def check_pending_changes(self, game_filter_enabled, debug):
+        """
+        Сравнивает отпечаток запущенного плана с планом по текущим настройкам и
+        содержимому файлов. Возвращает None, если сравнивать не с чем, иначе
+        список устаревших списков (пустой - перезапуск не нужен).
+        Вызывается из фонового потока: флаги из Tk-переменных читает вызывающий в UI-потоке.
+        """
+        if not self.active_processes or self.running_fingerprint is None:
+            return None
+        configs, names = self._collect_configs(log_errors=False)
+        fingerprint = process_manager.launch_plan_fingerprint(configs, self.app_dir, game_filter_enabled, debug=debug)
+        added, removed = launch_plan.compare_fingerprints(self.running_fingerprint, fingerprint)
+        if not added and not removed:
+            return []
+        name_by_path = {os.path.normcase(path): name for (path, _, _), name in zip(configs, names)}
+        name_by_path.update({os.path.normcase(self.list_manager.get_full_path(name)): name
+                             for data in self.active_processes.values() for name in data['lists']})
+        stale = []
+        for path in launch_plan.changed_lists(added, removed):
+            name = name_by_path.get(os.path.normcase(path), os.path.basename(path))
+            if name not in stale:
+                stale.append(name)
+        # Изменились только глобальные аргументы (например, игровой фильтр)
+        return stale or ["(глобальные параметры)"]
+
+    def on_config_changed(self):
+        """Вызывается после изменения профиля/ipset списка: помечает устаревшие списки без перезапуска."""
+        if self.active_processes:
+            self.run_in_thread(self._report_pending_changes, self.game_filter_var.get(), self._winws_debug_enabled())
+
+    def _report_pending_changes(self, game_filter_enabled, debug):
+        try:
+            stale = self.check_pending_changes(game_filter_enabled, debug)
+        except Exception as e:
+            self.log_message(f"Не удалось сравнить план запуска: {e}", "error")
+            return
+        if stale is None:
+            return
+        self.root.after(0, lambda: self._show_stale_lists(stale))
+        if stale:
+            self.log_message(f"Изменены: {', '.join(stale)}. Перезапустите процесс, чтобы применить.", "status")
+        else:
+            self.log_message("Итоговые списки и аргументы не изменились, перезапуск не нужен.", "status")
+
+    def _show_stale_lists(self, stale):
+        # Сначала возвращаем запущенным спискам обычный статус, затем помечаем устаревшие
+        self._show_running_lists()
+        self.ui_manager.mark_lists_stale(stale)
+
+    def _show_running_lists(self):
+        """Статус списков в таблице: при шардировании список может обслуживаться несколькими PID."""
+        pids_by_list = {}
+        for pid, data in self.active_processes.items():
+            for lname in data['lists']:
+                pids_by_list.setdefault(lname, []).append(str(pid))
+        for lname, pids in pids_by_list.items():
+            self.ui_manager.update_process_status_in_table(lname, True, ", ".join(pids))
+
+    def run_all_configured(self, confirm=True):
+        hot = False
+        if self.active_processes:
+            if confirm and not messagebox.askyesno("Перезапуск", "Процесс уже запущен. Перезапустить?"):
+                return
+            if self.hot_restart_var.get() and self.supervisor and self.supervisor.process:
+                # Старый процесс продолжает работать, пока новый не будет готов
+                hot = True
+            else:
+                self.stop_process()
+
+        self.log_message("=== ЗАПУСК ЕДИНОГО ПРОЦЕССА ===", "status")
+        
+        configs_to_run, active_list_names = self._collect_configs()
 
         if not configs_to_run:
             self.log_message("Нет активных конфигураций для запуска.", "status")
@@ -214,81 +330,265 @@ class App:
 
         try:
             game_filter_enabled = self.game_filter_var.get()
-            process = process_manager.start_combined_process(
-                configs_to_run, self.app_dir, game_filter_enabled, 
-                self.log_message
+            plan = process_manager.build_launch_plan(configs_to_run, self.app_dir, game_filter_enabled, self.log_message,
+                                                     debug=self._winws_debug_enabled())
+            self.running_fingerprint = plan.fingerprint()
+            # Перезапуски после падений идут с этим же планом - его файлы не должны уйти при очистке кэша
+            process_manager.pin_effective_files(plan, keep_current=hot)
+            parser = WinwsOutputParser(plan)
+            parser.track_hits = self.hit_stats_var.get()
+            if parser.track_hits:
+                self.hit_stats.set_plan(plan)
+            else:
+                self.hit_stats.clear_plan()
+            run_context = self._run_context(plan)
+            launch = lambda launch_plan_: process_manager.start_combined_process(
+                configs_to_run, self.app_dir, game_filter_enabled,
+                self.log_message, plan=launch_plan_
             )
-            
-            if process:
-                pid = process.pid
-                self.active_processes[pid] = {
-                    'proc': process,
-                    'lists': active_list_names
-                }
-                
-                self.log_message(f"Процесс запущен (PID: {pid}). Активные списки: {len(active_list_names)}", "success")
-                self.ui_manager.update_buttons_state(True)
-                
-                threading.Thread(target=self.read_process_output, args=(process, "winws"), daemon=True).start()
-                threading.Thread(target=self.wait_for_process_exit, args=(pid,), daemon=True).start()
-                
-                for lname in active_list_names:
-                    self.ui_manager.update_process_status_in_table(lname, True, pid)
-                    
+            shard_plans = launch_plan.shard_plan(plan, self._shard_count())
+            if len(shard_plans) > 1:
+                # Несколько winws с непересекающимися --wf-tcp/--wf-udp, у каждого свой супервизор
+                name_by_path = {path: name for (path, _, _), name in zip(configs_to_run, active_list_names)}
+                shard_lists = [[name_by_path[p] for p in dict.fromkeys(lp for sec in sp.sections for lp in sec.lists) if p in name_by_path]
+                               for sp in shard_plans]
+                parsers = []
+                for index, shard in enumerate(shard_plans):
+                    shard_parser = WinwsOutputParser(shard)
+                    shard_parser.track_hits = parser.track_hits
+                    shard_parser.label = f"winws#{index + 1}"
+                    parsers.append(shard_parser)
+                    self.log_message(f"Шард {index + 1}: {' '.join(shard.global_args[:2])}, секций {len(shard.sections)}", "status")
+                supervisor = process_manager.ShardedSupervisor(
+                    shard_plans, launch,
+                    on_output=lambda index, line: self._on_winws_output(parsers[index], line),
+                    on_state=lambda index, state, proc: self.root.after(0, lambda: self._on_supervisor_state(
+                        supervisor, state, proc, shard_lists[index], run_context, shard=index)),
+                    log_callback=self.log_message
+                )
+            else:
+                parsers = [parser]
+                # Супервизор сам запускает winws, ждет готовности и перезапускает его после падений
+                supervisor = process_manager.WinwsSupervisor(
+                    launcher=lambda: launch(plan),
+                    on_output=lambda line: self._on_winws_output(parser, line),
+                    on_state=lambda state, proc: self.root.after(0, lambda: self._on_supervisor_state(supervisor, state, proc, active_list_names, run_context)),
+                    log_callback=self.log_message
+                )
+            old_supervisor = self.supervisor
+            self.supervisor = supervisor
+            self.winws_parsers = parsers
+            if hot:
+                self.log_message("Горячий перезапуск: старый процесс работает до готовности нового...", "status")
+                self.run_in_thread(self._hot_swap, old_supervisor, supervisor, list(self.active_processes.keys()), plan)
+            else:
+                supervisor.start()
+
         except Exception as e:
             self.log_message(f"Ошибка запуска: {e}", "error")
 
-    def read_process_output(self, process, prefix):
+    def _winws_debug_enabled(self):
+        # Учет попаданий доменов работает только на построчном выводе --debug
+        return self.winws_debug_var.get() or self.hit_stats_var.get()
+
+    def _prune_targets(self):
+        """Списки из lists/, по которым ведется учет попаданий."""
+        return [self.list_manager.get_full_path(name) for name in self.list_manager.get_available_files()]
+
+    def _prune_days(self):
         try:
-            for line in iter(process.stdout.readline, ''):
-                if line:
-                    self.log_queue.put(f"[{prefix}] {line.strip()}")
-        except: pass
+            return max(1, int(self.prune_days_var.get()))
+        except (tk.TclError, ValueError):
+            return 30
 
-    def wait_for_process_exit(self, pid):
-        if pid in self.active_processes:
-            proc = self.active_processes[pid]['proc']
-            try: proc.wait()
-            except: pass
-            self.root.after(0, lambda: self._cleanup_process(pid))
+    def hit_stats_report(self):
+        self.run_in_thread(self._hit_stats_prune, self._prune_days(), False)
+
+    def hit_stats_prune(self):
+        days = self._prune_days()
+        if not messagebox.askyesno("Чистка списков", f"Удалить из списков домены без попаданий за {days} дн.?\n"
+                                   "Списки, по которым учет велся меньше этого срока, не изменятся."):
+            return
+        self.run_in_thread(self._hit_stats_prune, days, True)
+
+    def _hit_stats_prune(self, days, apply):
+        try:
+            self.hit_stats.flush()
+            st = self.hit_stats.stats()
+            self.log_message(f"Учет попаданий: {st['domains']} доменов с попаданиями в {st['lists']} списках, "
+                             f"за сессию учтено {st['recorded']} пакетов, без привязки к записи {st['unattributed']}", "status")
+            changed = False
+            for path in self._prune_targets():
+                if apply:
+                    removed, report = self.hit_stats.prune_apply(path, days)
+                else:
+                    removed, report = 0, self.hit_stats.prune_report(path, days)
+                if not report["tracked_days"]:
+                    continue
+                unused = report["unused"]
+                line = (f"{report['list']}: записей {report['entries']}, без попаданий за {days} дн.: {len(unused)} "
+                        f"(учет велся {report['tracked_days']} дн.)")
+                if not report["ready"]:
+                    line += " - мало данных, список не трогаем"
+                elif apply:
+                    line += f" - удалено {removed}"
+                    changed = changed or removed > 0
+                elif unused:
+                    line += f", например: {', '.join(unused[:5])}"
+                self.log_message(line, "status")
+            if changed:
+                self.root.after(0, self.on_config_changed)
+        except Exception as e:
+            self.log_message(f"Ошибка статистики попаданий: {e}", "error")
+
+    def _run_context(self, plan):
+        """Описание запуска для экспорта метрик: секции, профили и размеры списков."""
+        lists = {}
+        for section in plan.sections:
+            for path in section.lists:
+                try:
+                    lists[os.path.basename(path)] = len(list_store.get_entries(path))
+                except Exception:
+                    lists[os.path.basename(path)] = None
+        return {
+            "sections": len(plan.sections),
+            "profiles": sorted({section.profile_name for section in plan.sections}),
+            "lists": lists,
+            "debug": "--debug=1" in plan.global_args,
+        }
+
+    def _shard_count(self):
+        try:
+            return max(1, int(self.shard_count_var.get()))
+        except (tk.TclError, ValueError):
+            return 1
+
+    def _on_supervisor_state(self, supervisor, state, process, active_list_names, run_context=None, shard=None):
+        if supervisor is not self.supervisor:
+            # Событие от уже остановленного супервизора (например, после перезапуска)
+            return
+        # У шарда свой супервизор внутри группы: перезапуск и остановка политиками - только его
+        member = supervisor.supervisors[shard] if shard is not None else supervisor
+        target = "winws" if shard is None else f"winws#{shard + 1}"
+        label = "Процесс" if shard is None else f"Шард {shard + 1}"
+        if state == "starting":
+            # Предыдущий процесс этого супервизора (после restart) уже завершен
+            for old_pid, data in list(self.active_processes.items()):
+                if data['proc'].poll() is not None:
+                    self._cleanup_process(old_pid)
+            pid = process.pid
+            resource_sampler.watch(target, pid, context=run_context, actions={
+                "restart": member.restart,
+                "kill": lambda: member.stop(),
+            })
+            self.active_processes[pid] = {
+                'proc': process,
+                'lists': active_list_names,
+                'shard': shard
+            }
+            restarts = member.stats()["restarts"]
+            if restarts:
+                self.log_message(f"{label} перезапущен (PID: {pid}, перезапусков: {restarts})", "success")
+            else:
+                self.log_message(f"{label} запущен (PID: {pid}). Активные списки: {len(active_list_names)}", "success")
+            self.ui_manager.update_buttons_state(True)
+            self._show_running_lists()
+        elif state == "ready":
+            self.log_message(f"winws готов к работе{'' if shard is None else f' (шард {shard + 1})'} "
+                             f"(захват начат через {member.last_ready_seconds} с)", "success")
+        elif state == "backoff":
+            if process:
+                self._cleanup_process(process.pid)
+        else:
+            # stopped / crash_loop / failed - процесс (шард) больше не будет перезапущен
+            for pid, data in list(self.active_processes.items()):
+                if shard is None or data.get('shard') == shard:
+                    self._cleanup_process(pid)
+            resource_sampler.unwatch(target)
+            if not self.active_processes:
+                self.running_fingerprint = None
+                self.hit_stats.clear_plan()
+                self.run_in_thread(self.hit_stats.flush)
+
+    def _hot_swap(self, old_supervisor, new_supervisor, old_pids, plan):
+        try:
+            process_manager.hot_restart(old_supervisor, new_supervisor, self.log_message)
+        except Exception as e:
+            self.log_message(f"Ошибка горячего перезапуска: {e}", "error")
+        # Старый процесс остановлен - его файлы списков больше не нужны
+        process_manager.pin_effective_files(plan)
+        # События старого супервизора игнорируются - убираем его процессы из таблицы сами
+        self.root.after(0, lambda: [self._cleanup_process(pid) for pid in old_pids])
 
     def _cleanup_process(self, pid):
         if pid in self.active_processes:
             data = self.active_processes[pid]
             active_lists = data['lists']
             del self.active_processes[pid]
+            # При горячем перезапуске (или в другом шарде) те же списки обслуживает другой процесс
+            still_running = {lname for d in self.active_processes.values() for lname in d['lists']}
             for lname in active_lists:
+                if lname in still_running:
+                    continue
                 self.ui_manager.update_process_status_in_table(lname, False, None)
+            self._show_running_lists()
             self.log_message(f"Процесс остановлен (PID: {pid})", "status")
             if not self.active_processes:
                 self.ui_manager.update_buttons_state(False)
 
-    def log_queue_monitor(self):
-        while True:
-            try:
-                msg = self.log_queue.get()
-                self.log_message(msg, "main")
-            except:
-                time.sleep(0.1)
-
     def stop_process(self):
         self.log_message("Остановка...", "status")
-        pids = list(self.active_processes.keys())
-        for pid in pids:
-            if pid in self.active_processes:
-                proc = self.active_processes[pid]['proc']
-                process_manager.kill_process(proc)
-        process_manager.stop_all_processes(self.log_message)
+        if self.supervisor:
+            # Только отключаем автоперезапуск - процесс остановится вместе с остальными
+            self.supervisor.stop(kill=False)
+            self.supervisor = None
+        # Событие "stopped" от отключенного супервизора уже не обрабатывается - учет снимаем здесь
+        self.hit_stats.clear_plan()
+        self.run_in_thread(self.hit_stats.flush)
+        # Все наши PID и оставшиеся winws останавливаются параллельно, без фиксированных пауз
+        process_manager.stop_all_processes(self.log_message, extra_pids=list(self.active_processes.keys()))
         self.active_processes.clear()
+        self.running_fingerprint = None
+        process_manager.pin_effective_files()
         self.ui_manager.refresh_lists_table()
         self.ui_manager.update_buttons_state(False)
 
     def check_status(self, log_header=True):
         try:
             settings_manager.check_status(self.app_dir, self.log_message, log_header)
+            lp = self.log_pipeline.stats()
+            self.log_message(f"Лог: доставлено {lp['delivered']} записей пакетами ({lp['batches']}), "
+                             f"пропущено {lp['dropped']}, макс. очередь {lp['max_pending']}", "status")
+            if self.supervisor:
+                st = self.supervisor.stats()
+                self.log_message(f"Супервизор: {st['state']}, PID {st['pid']}, аптайм {st['uptime']} с "
+                                 f"(всего {st['total_uptime']} с), перезапусков {st['restarts']}, падений {st['crashes']}", "status")
+            for target, sample in sorted(resource_sampler.latest_by_target().items()):
+                if target == "gui" or target in self._active_process_targets():
+                    self.log_message(f"Ресурсы {target} (PID {sample.pid}): CPU {sample.cpu_percent}%, RSS {sample.rss_mb} МБ, "
+                                     f"дескрипторов {sample.handles}, потоков {sample.threads}", "status")
         except Exception as e:
             self._handle_ui_error(e)
 
+    def _active_process_targets(self):
+        """Имена winws в метриках ресурсов для текущих процессов."""
+        return {"winws" if data.get('shard') is None else f"winws#{data['shard'] + 1}"
+                for data in self.active_processes.values()}
+
+    def export_resource_samples(self):
+        filename = filedialog.asksaveasfilename(
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("JSON", "*.json")],
+            initialfile=f"resources_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        )
+        if not filename:
+            return
+        try:
+            count = resource_sampler.export(filename)
+            self.log_message(f"Метрики ресурсов сохранены: {count} замеров -> {filename}", "success")
+        except Exception as e:
+            self.log_message(f"Не удалось сохранить метрики ресурсов: {e}", "error")
+
     def create_update_script(self):
         try:
             base_dir = os.path.dirname(self.app_dir)
@@ -356,6 +656,34 @@ class App:
             self.log_message(f"Ошибка: {e}", "error")
             messagebox.showerror("Ошибка", f"Не удалось обновить ipset:\n{e}")
 
+    def slim_ipset(self):
+        """Создает сжатую копию ipset с ограничением на число записей и лишних адресов"""
+        ipsets_dir = os.path.join(self.app_dir, 'ipsets')
+        path = filedialog.askopenfilename(
+            title="Выберите IPSet для сжатия",
+            initialdir=ipsets_dir,
+            filetypes=[("Text files", "*.txt"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+        target = simpledialog.askinteger("Сжатие IPSet", "Целевое число записей (0 - без ограничения):", minvalue=0, initialvalue=2000)
+        if target is None:
+            return
+        budget = simpledialog.askinteger("Сжатие IPSet", "Максимум лишних адресов (0 - без ограничения):", minvalue=0, initialvalue=1000000)
+        if budget is None:
+            return
+        self.run_in_thread(self._do_slim_ipset, path, target or None, budget or None)
+
+    def _do_slim_ipset(self, path, target, budget):
+        try:
+            output_path, report = ipset_index.slim_ipset_file(path, target_entries=target, max_extra_addresses=budget)
+            for line in report:
+                self.log_message(line, "status")
+            self.log_message(f"Сжатый IPSet сохранен: {output_path}", "success")
+            self.root.after(0, self.ui_manager.refresh_lists_table)
+        except Exception as e:
+            self.log_message(f"Ошибка сжатия IPSet: {e}", "error")
+
     def update_hosts_file(self):
         """Скачивает hosts файл и открывает его для ознакомления"""
         if not messagebox.askyesno("Обновление Hosts", "Будет загружен файл hosts с GitHub и открыт для просмотра.\nВы можете вручную добавить нужные записи в системный hosts файл.\n\nПродолжить?"):
@@ -408,6 +736,8 @@ class App:
     def on_closing(self):
         try:
             self.save_app_settings()
+            self.hit_stats.stop_autosave()
+            resource_sampler.stop()
             # ПРИНУДИТЕЛЬНАЯ ОСТАНОВКА БЕЗ ВОПРОСОВ, чтобы не висел процесс
             if self.active_processes:
                 self.stop_process()
@@ -431,6 +761,16 @@ class App:
     def save_app_settings(self):
         settings_data = {
             "game_filter": self.game_filter_var.get(),
+            "hot_restart": self.hot_restart_var.get(),
+            "winws_debug": self.winws_debug_var.get(),
+            "hit_stats": self.hit_stats_var.get(),
+            "prune_days": self.prune_days_var.get(),
+            "shard_count": self._shard_count(),
+            "probe_sample": self._probe_sample(),
+            "adaptive_test": self.adaptive_test_var.get(),
+            "adaptive_stop_after": self._stop_after(),
+            "resource_policies": [dict(p) for p in self.resource_policies],
+            "log_capacity": self._apply_log_capacity(),
             "list_profile_map": self.list_manager.get_mapping(),
             "list_ipset_map": self.list_manager.get_ipset_mapping(),
             "custom_list_path": self.list_manager.get_custom_list_path()
@@ -438,9 +778,33 @@ class App:
         settings_manager.save_app_settings(settings_data, self.app_dir)
         self.log_message("Настройки сохранены.", "success")
 
+    def _apply_log_capacity(self):
+        """Применяет размер буфера логов из настроек и возвращает итоговое значение."""
+        try:
+            capacity = int(self.log_capacity_var.get())
+        except (tk.TclError, ValueError):
+            capacity = DEFAULT_LOG_CAPACITY
+        if capacity != self.ui_manager.log_buffer.capacity:
+            self.ui_manager.set_log_capacity(capacity)
+        capacity = self.ui_manager.log_buffer.capacity
+        self.log_capacity_var.set(capacity)
+        return capacity
+
     def load_app_settings(self):
         settings = settings_manager.load_app_settings(self.app_dir)
         self.game_filter_var.set(settings.get("game_filter", False))
+        self.hot_restart_var.set(settings.get("hot_restart", True))
+        self.winws_debug_var.set(settings.get("winws_debug", False))
+        self.hit_stats_var.set(settings.get("hit_stats", False))
+        self.prune_days_var.set(settings.get("prune_days", 30))
+        self.shard_count_var.set(settings.get("shard_count", 1))
+        self.probe_sample_var.set(settings.get("probe_sample", 0))
+        self.adaptive_test_var.set(settings.get("adaptive_test", True))
+        self.stop_after_var.set(settings.get("adaptive_stop_after", 1))
+        self.resource_policies = settings.get("resource_policies", DEFAULT_POLICIES)
+        resource_sampler.configure(policies=self.resource_policies)
+        self.log_capacity_var.set(settings.get("log_capacity", DEFAULT_LOG_CAPACITY))
+        self._apply_log_capacity()
         self.list_manager.set_mappings(
             settings.get("list_profile_map", {}),
             settings.get("list_ipset_map", {})
@@ -480,15 +844,46 @@ class App:
     def show_site_test_url_menu(self, event):
         self.site_test_url_menu.tk_popup(event.x_root, event.y_root)
 
+    def _probe_sample(self):
+        try:
+            return max(0, int(self.probe_sample_var.get()))
+        except (tk.TclError, ValueError):
+            return 0
+
+    def _stop_after(self):
+        try:
+            return max(1, int(self.stop_after_var.get()))
+        except (tk.TclError, ValueError):
+            return 1
+
     def run_site_test(self):
-        domain = self.site_test_url.get()
+        targets = self.site_test_url.get()
         custom_list = self.list_manager.get_custom_list_path()
-        self.run_in_thread(testing_utils.run_site_test, domain, self.profiles, self.app_dir, self.game_filter_var.get(), self.log_message, custom_list)
+        self.run_in_thread(testing_utils.run_site_test, targets, self.profiles, self.app_dir, self.game_filter_var.get(), self.log_message,
+                           custom_list, self._probe_sample(), self.test_history, self.adaptive_test_var.get(), self._stop_after())
 
     def run_discord_test(self):
         def ask(name): return messagebox.askyesno("Тест", f"Работает ли Discord с профилем {name}?")
         custom_list = self.list_manager.get_custom_list_path()
-        self.run_in_thread(testing_utils.run_discord_test, self.profiles, self.app_dir, self.game_filter_var.get(), self.log_message, ask, custom_list)
+        self.run_in_thread(testing_utils.run_discord_test, self.profiles, self.app_dir, self.game_filter_var.get(), self.log_message, ask, custom_list,
+                           self.test_history)
+
+    def show_test_history(self):
+        """Лучшие профили из истории для адресов из поля теста сайтов."""
+        targets = [e.host for e in probe_engine.parse_endpoints(self.site_test_url.get())]
+        if not targets:
+            messagebox.showinfo("История тестов", "Укажите адрес в поле теста сайтов.")
+            return
+        if self.test_history is None:
+            messagebox.showinfo("История тестов", "База истории тестов не открылась при запуске, подробности в логе.")
+            return
+        try:
+            lines = self.test_history.report_lines(targets, days=30, network=network_key())
+            lines += self.test_history.report_lines(targets, days=30)
+        except Exception as e:
+            self._handle_ui_error(e)
+            return
+        self.log_message("\n".join(lines))
 
 if __name__ == "__main__":
     if not process_manager.is_admin():
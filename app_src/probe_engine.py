@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Параллельная проверка доступности набора адресов.
+
+Каждая проба - TCP-соединение, TLS-рукопожатие с SNI (для https) и запрос
+HEAD до строки статуса ответа. Блокировка по DPI обычно проявляется именно
+на этих шагах (сброс или тишина после ClientHello, подмена сертификата),
+а тело страницы для решения не нужно. Исход пробы классифицируется по этапу,
+на котором она сорвалась (см. OUTCOMES). Пробы идут в пуле потоков, поэтому
+проверка N адресов занимает примерно время самой медленной из них.
+"""
+import re
+import ssl
+import time
+import errno
+import random
+import socket
+import logging
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from list_store import list_store
+
+logger = logging.getLogger("process_manager.probe_engine")
+
+DEFAULT_TIMEOUT = 3.0
+MAX_WORKERS = 16
+
+Endpoint = collections.namedtuple("Endpoint", "host port tls path")
+# latency - время до первого байта ответа (TTFB), handshake - до установленного соединения (TCP + TLS),
+# outcome - класс исхода (OUTCOMES), phases - {"dns", "connect", "tls", "ttfb": секунды} пройденных этапов,
+# status - HTTP-код ответа
+ProbeResult = collections.namedtuple("ProbeResult", "endpoint ok latency error handshake outcome phases status",
+                                     defaults=(None, None, None, None))
+
+OUTCOMES = {
+    "ok": "успех",
+    "dns": "имя не разрешается (DNS)",
+    "network": "нет сети или маршрута",
+    "connect_timeout": "нет ответа на TCP-соединение",
+    "tcp_reset": "TCP-соединение сброшено",
+    "tls_timeout": "нет ответа на TLS ClientHello",
+    "tls_reset": "TLS-рукопожатие сброшено",
+    "tls_alert": "ошибка TLS (alert)",
+    "tls_cert": "чужой сертификат (подмена)",
+    "http_timeout": "нет ответа на HTTP-запрос",
+    "http_reset": "соединение сброшено после запроса",
+    "http_error": "сервер ответил HTTP-ошибкой",
+}
+# Исходы, при которых запрос дошел до сервера (ok=True). Ответ с кодом >= 400
+# (например, 403/405 от CDN на HEAD) значит, что TCP, TLS и запрос прошли DPI -
+# а это все, на что влияет профиль обхода.
+REACHED_OUTCOMES = frozenset(("ok", "http_error"))
+# Неудачи после установленного TCP-соединения: их вызывает DPI по SNI/Host, и профиль обхода может помочь.
+# DNS, отсутствие сети и блокировка IP (соединение не устанавливается) обходом пакетов не лечатся.
+DPI_OUTCOMES = frozenset(("tls_timeout", "tls_reset", "tls_alert", "tls_cert", "http_timeout", "http_reset"))
+# Неудачи, при которых проверять следующие профили бессмысленно: сломана сама сеть
+ENVIRONMENT_OUTCOMES = frozenset(("dns", "network"))
+
+_STATUS_RE = re.compile(rb'^HTTP/\d(?:\.\d)? (\d{3})')
+_UNREACHABLE_ERRNOS = {errno.ENETUNREACH, errno.EHOSTUNREACH, 10051, 10065}
+
+
+def parse_endpoint(text):
+    """'example.com', 'example.com:8443', 'http://example.com/path' -> Endpoint (None, если разобрать нельзя)."""
+    text = text.strip()
+    if not text:
+        return None
+    if '://' not in text:
+        text = 'https://' + text
+    try:
+        parts = urlsplit(text)
+        port = parts.port
+    except ValueError:
+        return None
+    if not parts.hostname or parts.scheme not in ('http', 'https'):
+        return None
+    tls = parts.scheme == 'https'
+    return Endpoint(parts.hostname, port or (443 if tls else 80), tls, parts.path or '/')
+
+
+def parse_endpoints(text):
+    """Адреса через пробел, запятую или точку с запятой; дубликаты отбрасываются."""
+    endpoints = []
+    for item in text.replace(',', ' ').replace(';', ' ').split():
+        endpoint = parse_endpoint(item)
+        if endpoint and endpoint not in endpoints:
+            endpoints.append(endpoint)
+    return endpoints
+
+
+def sample_endpoints(list_path, count, seed=None):
+    """Случайные count доменов из hostlist (без масок и IP) в виде https-адресов."""
+    if count <= 0:
+        return []
+    try:
+        lines = list_store.get_lines(list_path)
+    except OSError:
+        return []
+    domains = [line.strip().lower().strip('.') for line in lines]
+    domains = [d for d in domains if '.' in d and '*' not in d and not d.replace('.', '').isdigit()]
+    domains = sorted(set(domains))
+    rnd = random.Random(seed)
+    return [Endpoint(d, 443, True, '/') for d in rnd.sample(domains, min(count, len(domains)))]
+
+
+def endpoint_label(endpoint):
+    default_port = 443 if endpoint.tls else 80
+    port = "" if endpoint.port == default_port else f":{endpoint.port}"
+    return f"{'https' if endpoint.tls else 'http'}://{endpoint.host}{port}"
+
+
+def _short_error(e):
+    if isinstance(e, socket.timeout):
+        return "Timeout"
+    text = str(e) or type(e).__name__
+    return text if len(text) <= 100 else text[:100] + "..."
+
+
+def classify_error(phase, e):
+    """Класс неудачи по этапу пробы (dns/connect/tls/http) и исключению."""
+    if phase == "dns":
+        return "dns"
+    if isinstance(e, OSError) and e.errno in _UNREACHABLE_ERRNOS:
+        return "network"
+    timeout = isinstance(e, socket.timeout)
+    reset = isinstance(e, (ConnectionError, ssl.SSLEOFError, ssl.SSLZeroReturnError))
+    if phase == "connect":
+        return "connect_timeout" if timeout else "tcp_reset"
+    if phase == "tls":
+        if timeout:
+            return "tls_timeout"
+        if isinstance(e, ssl.SSLCertVerificationError):
+            return "tls_cert"
+        return "tls_reset" if reset else "tls_alert"
+    return "http_timeout" if timeout else "http_reset"
+
+
+def _resolve(host, port, timeout):
+    """
+    getaddrinfo с ограничением по времени. Сам вызов прервать нельзя, поэтому он идет
+    в фоновом потоке, а проба перестает ждать по дедлайну: при "черной дыре" DNS
+    системный резолвер отвечает через десятки секунд.
+    """
+    result = {}
+
+    def resolve():
+        try:
+            result["addresses"] = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except OSError as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=resolve, name="probe-resolve", daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        raise socket.timeout("DNS timed out")
+    if "error" in result:
+        raise result["error"]
+    return result["addresses"]
+
+
+def _connect(host, port, remaining, phases):
+    """Разрешение имени и TCP-соединение с замером этапов; перебирает адреса, как socket.create_connection."""
+    phase_started = time.perf_counter()
+    addresses = _resolve(host, port, remaining())
+    phases["dns"] = time.perf_counter() - phase_started
+    phase_started = time.perf_counter()
+    error = None
+    for family, socktype, proto, _, address in addresses:
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.settimeout(remaining())
+            sock.connect(address)
+            phases["connect"] = time.perf_counter() - phase_started
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error or OSError("getaddrinfo вернул пустой список")
+
+
+def probe(endpoint, timeout=DEFAULT_TIMEOUT, ssl_context=None):
+    """
+    Одна проба: имя, соединение, TLS (если нужно) и HEAD до строки статуса ответа.
+    В результате - класс исхода (OUTCOMES) и длительность каждого пройденного этапа.
+    """
+    started = time.perf_counter()
+    deadline = started + timeout
+
+    def remaining():
+        left = deadline - time.perf_counter()
+        if left <= 0:
+            raise socket.timeout("timed out")
+        return left
+
+    sock = None
+    handshake = None
+    phases = {}
+    phase = "dns"
+    try:
+        try:
+            sock = _connect(endpoint.host, endpoint.port, remaining, phases)
+        except OSError:
+            # Пока имя не разрешено (в том числе по таймауту резолвера), этап остается "dns"
+            if "dns" in phases:
+                phase = "connect"
+            raise
+        if endpoint.tls:
+            phase = "tls"
+            context = ssl_context or ssl.create_default_context()
+            phase_started = time.perf_counter()
+            sock.settimeout(remaining())
+            sock = context.wrap_socket(sock, server_hostname=endpoint.host)
+            phases["tls"] = time.perf_counter() - phase_started
+        handshake = time.perf_counter() - started
+        phase = "http"
+        phase_started = time.perf_counter()
+        request = (f"HEAD {endpoint.path} HTTP/1.1\r\nHost: {endpoint.host}\r\n"
+                   f"User-Agent: Mozilla/5.0\r\nConnection: close\r\n\r\n")
+        sock.settimeout(remaining())
+        sock.sendall(request.encode('ascii', 'ignore'))
+        head = b""
+        while b"\r\n" not in head and len(head) < 256:
+            sock.settimeout(remaining())
+            chunk = sock.recv(256)
+            if not chunk:
+                break
+            head += chunk
+        if not head:
+            raise ConnectionError("соединение закрыто без ответа")
+        phases["ttfb"] = time.perf_counter() - phase_started
+        latency = time.perf_counter() - started
+        match = _STATUS_RE.match(head)
+        status = int(match.group(1)) if match else None
+        if status is not None and status >= 400:
+            # Запрос прошел DPI - проба успешна, но код сохраняется в исходе (см. REACHED_OUTCOMES)
+            return ProbeResult(endpoint, True, latency, f"HTTP {status}", handshake, "http_error", phases, status)
+        return ProbeResult(endpoint, True, latency, None, handshake, "ok", phases, status)
+    except Exception as e:
+        return ProbeResult(endpoint, False, time.perf_counter() - started, _short_error(e), handshake,
+                           classify_error(phase, e), phases)
+    finally:
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+
+def percentile(values, q):
+    """Процентиль q (0..100) с линейной интерполяцией; None для пустого набора."""
+    if not values:
+        return None
+    values = sorted(values)
+    pos = (len(values) - 1) * q / 100.0
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+def summarize(results):
+    """Сводка по пробам одного профиля: доля успешных и процентили задержки успешных проб."""
+    latencies = [r.latency for r in results if r.ok]
+    return {
+        "outcomes": collections.Counter(r.outcome for r in results),
+        "http_errors": sum(1 for r in results if r.outcome == "http_error"),
+        "total": len(results),
+        "ok": len(latencies),
+        "ratio": len(latencies) / len(results) if results else 0.0,
+        "p50": percentile(latencies, 50),
+        "p90": percentile(latencies, 90),
+        "max": max(latencies) if latencies else None,
+    }
+
+
+class ProbeEngine:
+    """Пул потоков для проб; один экземпляр на весь тест, чтобы не создавать потоки на каждый профиль."""
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_workers=MAX_WORKERS):
+        self.timeout = timeout
+        self.max_workers = max_workers
+        # Контекст TLS потокобезопасен и загружает корневые сертификаты один раз
+        self._ssl_context = ssl.create_default_context()
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def run(self, endpoints):
+        """Проверяет все адреса параллельно; результаты в порядке endpoints."""
+        if not endpoints:
+            return []
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="probe")
+        futures = [self._executor.submit(probe, endpoint, self.timeout, self._ssl_context) for endpoint in endpoints]
+        return [future.result() for future in futures]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -7,9 +7,19 @@ import logging
 import ctypes
 import psutil
 import re
+import hashlib
+
+import launch_plan
+import ipset_index
+from file_utils import atomic_write_text
+from list_store import list_store
+from process_table import process_table
 
 WINWS_EXE = "winws.exe"
 ZAPRET_SERVICE_NAME = "ZapretDPIBypass"
+# Сколько эффективных файлов хранить в cache/effective сверх нужных текущему плану:
+# недавние наборы списков (другие профили, прежние версии списков) не пересчитываются
+EFFECTIVE_CACHE_LIMIT = 16
 
 logger = logging.getLogger("process_manager")
 if not logger.handlers:
@@ -36,15 +46,6 @@ def is_admin():
         logger.error(f"Error checking admin rights: {e}")
         return False
 
-def _clean_profile_args(args_str):
-    """
-    Удаляет глобальные аргументы захвата (--wf-...), 
-    чтобы они не конфликтовали при склейке через --new.
-    """
-    cleaned = re.sub(r'--wf-tcp=[^ ]+', '', args_str)
-    cleaned = re.sub(r'--wf-udp=[^ ]+', '', cleaned)
-    return cleaned.strip()
-
 def _ensure_file_exists(filepath, default_content="# Auto-generated list\n"):
     """Создает файл с дефолтным содержимым, если он не существует."""
     if not os.path.exists(filepath):
@@ -90,7 +91,207 @@ def _resolve_ipset_path(requested_path, base_dir):
     _ensure_file_exists(final_path, "# Placeholder IPSet\n0.0.0.0/32\n")
     return final_path
 
-def start_process(profile, base_dir, game_filter_enabled, log_callback, custom_list_path=None, is_service=False):
+def _arg_value(arg):
+    return arg.split('=', 1)[1].strip('"')
+
+def _file_digest(path):
+    """SHA-256 содержимого файла (пустая строка, если файл не читается)."""
+    return list_store.get_digest(path)
+
+def _read_hostlist(path):
+    """Читает hostlist в множество доменов (нижний регистр, без комментариев)."""
+    try:
+        return set(list_store.get_entries(path))
+    except OSError as e:
+        logger.warning(f"Failed to read hostlist {path}: {e}")
+        return set()
+
+def _is_domain_covered(domain, domains):
+    """True, если домен или любой его родитель есть в множестве (правило поддоменов winws)."""
+    parts = domain.split('.')
+    return any('.'.join(parts[i:]) in domains for i in range(len(parts)))
+
+def _effective_hostlist(include_paths, exclude_paths):
+    """
+    Возвращает (домены, keep_excludes): include минус все, что покрыто исключениями.
+    keep_excludes=True, если исключение вырезает поддомен из оставшегося родителя
+    (например, include example.com, exclude a.example.com) - тогда аргументы
+    --hostlist-exclude нужно оставить, файлом это не выразить.
+    """
+    include = set()
+    for path in include_paths:
+        include |= _read_hostlist(path)
+    exclude = set()
+    for path in exclude_paths:
+        exclude |= _read_hostlist(path)
+    effective = {d for d in include if not _is_domain_covered(d, exclude)}
+    keep_excludes = any(_is_domain_covered(x.split('.', 1)[1], effective) for x in exclude if '.' in x)
+    return sorted(effective), keep_excludes
+
+def _effective_ipset(include_paths, exclude_paths):
+    """Возвращает CIDR-строки include минус exclude (точное вычитание интервалов)."""
+    v4, v6 = [], []
+    for path in include_paths:
+        interval_set = ipset_index.load_ipset_file(path)
+        v4.extend(interval_set.intervals(4))
+        v6.extend(interval_set.intervals(6))
+    ex4, ex6 = [], []
+    for path in exclude_paths:
+        interval_set = ipset_index.load_ipset_file(path)
+        ex4.extend(interval_set.intervals(4))
+        ex6.extend(interval_set.intervals(6))
+    return ipset_index.IntervalSet(v4, v6).subtract(ipset_index.IntervalSet(ex4, ex6)).to_cidrs()
+
+def _cache_key(path):
+    return os.path.normcase(os.path.abspath(path))
+
+# Файлы списков планов, с которыми работают запущенные winws: супервизор перезапускает
+# процесс с уже собранным планом, поэтому очистка кэша эти файлы не удаляет
+_pinned_effective_files = frozenset()
+
+def pin_effective_files(*plans, keep_current=False):
+    """
+    Закрепляет файлы списков запущенных планов (вызов без планов снимает закрепление).
+    keep_current=True оставляет закрепленными и прежние - при горячем перезапуске
+    старый процесс работает, пока новый не готов.
+    """
+    global _pinned_effective_files
+    paths = {_cache_key(_arg_value(arg)) for plan in plans for section in plan.sections
+             for arg in section.args if arg.startswith(launch_plan.FINGERPRINT_FILE_ARGS)}
+    _pinned_effective_files = frozenset(paths | _pinned_effective_files if keep_current else paths)
+
+def _cached_effective_file(cache_dir, kind, include_paths, exclude_paths, pending=None):
+    """
+    Возвращает (путь, число записей, keep_excludes) для эффективного файла.
+    Имя файла - хэш содержимого всех входов, так что неизменные списки
+    не пересчитываются между запусками.
+    pending - проверка без записи: файла, которого нет в кэше, не создается,
+    а хэш его будущего содержимого кладется в pending[_cache_key(путь)].
+    """
+    digest = hashlib.sha256()
+    digest.update(kind.encode())
+    for role, paths in (("in", include_paths), ("ex", exclude_paths)):
+        for path in sorted(set(paths)):
+            digest.update(f"{role}:{_file_digest(path)}\n".encode())
+    cache_path = os.path.join(cache_dir, f"{kind}-{digest.hexdigest()[:20]}.txt")
+
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                meta = dict(item.split('=', 1) for item in f.readline().lstrip('# ').split())
+            if pending is None:
+                # Время изменения - отметка последнего использования для очистки кэша
+                os.utime(cache_path)
+            return cache_path, int(meta['entries']), meta['keep_excludes'] == '1'
+        except Exception as e:
+            logger.warning(f"Broken effective cache file {cache_path}, rebuilding: {e}")
+
+    if kind == "hostlist":
+        entries, keep_excludes = _effective_hostlist(include_paths, exclude_paths)
+    else:
+        entries, keep_excludes = _effective_ipset(include_paths, exclude_paths), False
+    text = f"# entries={len(entries)} keep_excludes={int(keep_excludes)}\n" + "".join(e + "\n" for e in entries)
+    if pending is not None:
+        pending[_cache_key(cache_path)] = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        return cache_path, len(entries), keep_excludes
+    atomic_write_text(cache_path, text)
+    logger.debug(f"Built effective {kind} {cache_path}: {len(entries)} entries")
+    return cache_path, len(entries), keep_excludes
+
+def apply_effective_sets(plan, base_dir, log_callback=None, pending=None):
+    """
+    Предварительно вычитает исключения из включаемых списков каждой секции:
+    --ipset/--ipset-exclude превращаются в один --ipset на кэшированный файл,
+    --hostlist/--hostlist-exclude - в один --hostlist (исключения остаются,
+    только если их нельзя выразить файлом). Секции с пустым итогом выбрасываются.
+    pending - проверка без записи (см. _cached_effective_file), кэш не чистится.
+    """
+    cache_dir = os.path.join(base_dir, 'cache', 'effective')
+    sections = []
+    used = set()
+    dropped = 0
+    for section in plan.sections:
+        hostlists = [_arg_value(a) for a in section.args if a.startswith('--hostlist=')]
+        hostlist_excludes = [_arg_value(a) for a in section.args if a.startswith('--hostlist-exclude=')]
+        ipsets = [_arg_value(a) for a in section.args if a.startswith('--ipset=')]
+        ipset_excludes = [_arg_value(a) for a in section.args if a.startswith('--ipset-exclude=')]
+        args = list(section.args)
+        try:
+            if ipsets:
+                path, count, _ = _cached_effective_file(cache_dir, "ipset", ipsets, ipset_excludes, pending)
+                used.add(path)
+                if count == 0:
+                    dropped += 1
+                    logger.debug(f"Dropped section with empty effective ipset: {section}")
+                    continue
+                args = _replace_list_args(args, ('--ipset=', '--ipset-exclude='), f"--ipset={path.replace(os.sep, '/')}")
+
+            if hostlists:
+                path, count, keep_excludes = _cached_effective_file(cache_dir, "hostlist", hostlists, hostlist_excludes, pending)
+                used.add(path)
+                if count == 0:
+                    dropped += 1
+                    logger.debug(f"Dropped section with empty effective hostlist: {section}")
+                    continue
+                # В секции с ipset исключения по имени работают и для IP-трафика - их не трогаем
+                prefixes = ('--hostlist=',) if (keep_excludes or ipsets) else ('--hostlist=', '--hostlist-exclude=')
+                args = _replace_list_args(args, prefixes, f"--hostlist={path.replace(os.sep, '/')}")
+        except Exception as e:
+            logger.warning(f"Failed to build effective sets for {section}, keeping original args: {e}")
+            args = list(section.args)
+
+        section.args = args
+        sections.append(section)
+
+    plan.sections = sections
+    if pending is None:
+        _prune_effective_cache(cache_dir, used)
+    if dropped and log_callback:
+        log_callback(f"Пропущено {dropped} секций с пустым итоговым списком")
+    return plan
+
+def _prune_effective_cache(cache_dir, used):
+    """
+    Удаляет старые эффективные файлы: остаются файлы текущего плана, запущенных
+    планов (pin_effective_files) и EFFECTIVE_CACHE_LIMIT последних использованных.
+    """
+    try:
+        names = [name for name in os.listdir(cache_dir) if name.endswith('.txt')]
+    except OSError:
+        return
+    used = {_cache_key(path) for path in used} | _pinned_effective_files
+    candidates = []
+    for name in names:
+        path = os.path.join(cache_dir, name)
+        if _cache_key(path) in used:
+            continue
+        try:
+            candidates.append((os.path.getmtime(path), path))
+        except OSError:
+            continue
+    candidates.sort(reverse=True)
+    for _, path in candidates[EFFECTIVE_CACHE_LIMIT:]:
+        try:
+            os.remove(path)
+            logger.debug(f"Removed stale effective cache file {path}")
+        except OSError as e:
+            # Файл может быть еще открыт работающим winws - удалим в следующий раз
+            logger.debug(f"Failed to remove effective cache file {path}: {e}")
+
+def _replace_list_args(args, prefixes, replacement):
+    """Убирает все аргументы с указанными префиксами и ставит replacement на место первого."""
+    result = []
+    inserted = False
+    for arg in args:
+        if arg.startswith(prefixes):
+            if not inserted:
+                result.append(replacement)
+                inserted = True
+            continue
+        result.append(arg)
+    return result
+
+def start_process(profile, base_dir, game_filter_enabled, log_callback, custom_list_path=None, is_service=False, capture_output=False):
     logger.debug(f"Starting process with profile: {profile.get('name', 'unnamed')}")
     bin_dir = os.path.join(base_dir, 'bin').replace('\\', '/')
     executable_path = os.path.join(bin_dir, WINWS_EXE).replace('\\', '/')
@@ -140,15 +341,20 @@ def start_process(profile, base_dir, game_filter_enabled, log_callback, custom_l
         startupinfo = subprocess.STARTUPINFO()
         startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
         
+        # capture_output: stdout нужен для ожидания готовности (wait_process_ready)
         process = subprocess.Popen(
             command,
             cwd=bin_dir,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
+            stdout=subprocess.PIPE if capture_output else subprocess.DEVNULL,
+            stderr=subprocess.STDOUT if capture_output else subprocess.DEVNULL,
+            text=capture_output,
+            encoding='utf-8' if capture_output else None,
+            errors='ignore' if capture_output else None,
             startupinfo=startupinfo,
             creationflags=subprocess.CREATE_NO_WINDOW
         )
         logger.info(f"Process started successfully with PID: {process.pid}")
+        process_table.invalidate()
         return process
     except Exception as e:
         error_msg = f"Ошибка запуска процесса тестирования: {e}"
@@ -156,12 +362,55 @@ def start_process(profile, base_dir, game_filter_enabled, log_callback, custom_l
         logger.error(error_msg, exc_info=True)
         return None
 
-def start_combined_process(configs, base_dir, game_filter_enabled, log_callback):
+def build_launch_plan(configs, base_dir, game_filter_enabled, log_callback=None, debug=False, pending=None):
+    """
+    Компилирует итоговый план запуска: склейка профилей, дедупликация секций
+    и предварительно вычтенные исключения. Процесс не запускается.
+    debug=True включает построчный вывод winws о пакетах (для счетчиков секций).
+    pending - проверка без записи: файлы не создаются (см. launch_plan_fingerprint).
+    """
+    # Пути к пользовательским спискам (как в BAT файле)
+    user_hostlist_exclude = os.path.join(base_dir, 'exclude', 'list-exclude-user.txt').replace('\\', '/')
+    user_ipset_exclude = os.path.join(base_dir, 'exclude', 'ipset-exclude-user.txt').replace('\\', '/')
+    logger.debug(f"User hostlist exclude: {user_hostlist_exclude}")
+    logger.debug(f"User ipset exclude: {user_ipset_exclude}")
+    
+    # Создаем файлы, если их нет, чтобы winws не ругался
+    if pending is None:
+        logger.info(f"Ensuring user hostlist exclude file exists: {user_hostlist_exclude}")
+        _ensure_file_exists(user_hostlist_exclude, "# User exclude domains\ndomain.example.abc\n")
+        logger.info(f"Ensuring user ipset exclude file exists: {user_ipset_exclude}")
+        _ensure_file_exists(user_ipset_exclude, "# User exclude IPs\n203.0.113.113/32\n")
+
+    # Компилируем план: списки с одним профилем/ipset склеиваются, дубли секций выбрасываются
+    plan = launch_plan.compile_launch_plan(
+        configs, base_dir, game_filter_enabled,
+        user_hostlist_exclude, user_ipset_exclude,
+        resolve_ipset_path=lambda path: _resolve_ipset_path(path, base_dir)
+    )
+    if debug:
+        plan.global_args.append("--debug=1")
+    # Вычитаем исключения из включаемых списков заранее, чтобы winws не делал это на каждый пакет
+    return apply_effective_sets(plan, base_dir, log_callback, pending)
+
+def launch_plan_fingerprint(configs, base_dir, game_filter_enabled, debug=False):
+    """
+    Отпечаток плана по текущим настройкам для сравнения с запущенным (LaunchPlan.fingerprint)
+    без побочных эффектов: эффективные файлы и заготовки исключений не создаются, кэш не чистится.
+    """
+    pending = {}
+    plan = build_launch_plan(configs, base_dir, game_filter_enabled, debug=debug, pending=pending)
+
+    def file_digest(path):
+        key = _cache_key(path)
+        return pending[key] if key in pending else list_store.get_digest(path)
+
+    return plan.fingerprint(file_digest)
+
+def start_combined_process(configs, base_dir, game_filter_enabled, log_callback, plan=None):
     logger.debug(f"Starting combined process with {len(configs)} configs")
     bin_dir = os.path.join(base_dir, 'bin').replace('\\', '/')
     executable_path = os.path.join(bin_dir, WINWS_EXE).replace('\\', '/')
-    lists_dir = os.path.join(base_dir, 'lists').replace('\\', '/')
-    exclude_dir = os.path.join(base_dir, 'exclude').replace('\\', '/')
     
     logger.debug(f"Checking executable path: {executable_path}")
     if not os.path.exists(executable_path):
@@ -170,104 +419,14 @@ def start_combined_process(configs, base_dir, game_filter_enabled, log_callback)
         logger.error(error_msg)
         return None
 
-    game_ports = ",1024-65535" if game_filter_enabled else ""
-    logger.debug(f"Game filter enabled: {game_filter_enabled}, ports: {game_ports}")
-    
-    global_args = [
-        f"--wf-tcp=80,443,2053,2083,2087,2096,8443{game_ports}",
-        f"--wf-udp=443,19294-19344,50000-50100{game_ports}",
-        "--ctrack-disable=1"
-    ]
-    logger.debug(f"Global args: {global_args}")
-    
-    final_args = list(global_args)
-    
-    # Пути к пользовательским спискам (как в BAT файле)
-    user_hostlist_exclude = os.path.join(base_dir, 'exclude', 'list-exclude-user.txt').replace('\\', '/')
-    user_ipset_exclude = os.path.join(base_dir, 'exclude', 'ipset-exclude-user.txt').replace('\\', '/')
-    logger.debug(f"User hostlist exclude: {user_hostlist_exclude}")
-    logger.debug(f"User ipset exclude: {user_ipset_exclude}")
-    
-    # Создаем файлы, если их нет, чтобы winws не ругался
-    logger.info(f"Ensuring user hostlist exclude file exists: {user_hostlist_exclude}")
-    _ensure_file_exists(user_hostlist_exclude, "# User exclude domains\ndomain.example.abc\n")
-    logger.info(f"Ensuring user ipset exclude file exists: {user_ipset_exclude}")
-    _ensure_file_exists(user_ipset_exclude, "# User exclude IPs\n203.0.113.113/32\n")
-
-    for i, (list_path, profile, ipset_path) in enumerate(configs):
-        logger.debug(f"Processing config {i}: list_path={list_path}, profile={profile.get('name', 'unnamed')}, ipset_path={ipset_path}")
-        if i > 0:
-            final_args.append("--new")
-            logger.debug("Added --new argument for combined process")
-            
-        raw_args = profile["args"].format(
-            LISTS_DIR=lists_dir,
-            BIN_DIR=bin_dir,
-            EXCLUDE_DIR=exclude_dir,
-            GAME_FILTER="1024-65535" if game_filter_enabled else "12"
-        )
-        logger.debug(f"Raw args for config {i}: {raw_args}")
-        
-        cleaned_args = _clean_profile_args(raw_args)
-        logger.debug(f"Cleaned args for config {i}: {cleaned_args}")
-        
-        try:
-            args_list = shlex.split(cleaned_args)
-            logger.debug(f"Args after shlex.split for config {i}: {args_list}")
-        except Exception as e:
-            logger.warning(f"Failed to shlex.split args for config {i}, falling back to simple split: {e}")
-            args_list = cleaned_args.split()
-            logger.debug(f"Args after simple split for config {i}: {args_list}")
-            
-        processed_args = []
-        
-        for arg in args_list:
-            # 1. Обработка hostlist (замена путей)
-            if arg.startswith('--hostlist=') or arg.startswith('--hostlist-auto='):
-                 if 'list-general.txt' in arg or 'custom_list.txt' in arg:
-                     prefix = arg.split('=')[0]
-                     clean_list_path = list_path.replace('\\', '/')
-                     processed_args.append(f'{prefix}={clean_list_path}')
-                     logger.debug(f"Replaced hostlist path: {prefix}={clean_list_path}")
-                 else:
-                     processed_args.append(arg)
-             
-            # 2. Инъекция пользовательских исключений доменов (HOSTLIST EXCLUDE)
-            # В BAT: --hostlist-exclude="list-exclude.txt" --hostlist-exclude="list-exclude-user.txt"
-            elif arg.startswith('--hostlist-exclude='):
-                processed_args.append(arg) # Основной
-                processed_args.append(f'--hostlist-exclude={user_hostlist_exclude}') # Пользовательский
-                logger.debug(f"Added hostlist exclude: {arg} and --hostlist-exclude={user_hostlist_exclude}")
-
-            # 3. Инъекция пользовательских исключений IP (IPSET EXCLUDE)
-            # В BAT: --ipset-exclude="ipset-exclude.txt" --ipset-exclude="ipset-exclude-user.txt"
-            elif arg.startswith('--ipset-exclude='):
-                processed_args.append(arg) # Основной
-                processed_args.append(f'--ipset-exclude={user_ipset_exclude}') # Пользовательский
-                logger.debug(f"Added ipset exclude: {arg} and --ipset-exclude={user_ipset_exclude}")
-            
-            # 4. Обработка IPSet (ГЛАВНОЕ ИСПРАВЛЕНИЕ БАГА)
-            elif arg.startswith('--ipset='):
-                if ipset_path and ipset_path != "OFF":
-                    # Если выбран в UI
-                    clean_ipset_path = ipset_path.replace('\\', '/')
-                    processed_args.append(f'--ipset={clean_ipset_path}')
-                    logger.debug(f"Using UI-provided ipset path: --ipset={clean_ipset_path}")
-                else:
-                    # Берем из профиля и ИСПРАВЛЯЕМ ПУТЬ
-                    raw_path = arg.split('=', 1)[1].strip('"')
-                    logger.debug(f"Raw ipset path from profile: {raw_path}")
-                    # Находим реальный путь (или создаем заглушку)
-                    valid_path = _resolve_ipset_path(raw_path, base_dir).replace('\\', '/')
-                    # ПЕРЕДАЕМ ИСПРАВЛЕННЫЙ ПУТЬ
-                    processed_args.append(f'--ipset={valid_path}')
-                    logger.debug(f"Resolved ipset path: --ipset={valid_path}")
-            
-            else:
-                processed_args.append(arg)
-        
-        final_args.extend(processed_args)
-        logger.debug(f"Processed args for config {i}: {processed_args}")
+    if plan is None:
+        plan = build_launch_plan(configs, base_dir, game_filter_enabled, log_callback)
+    plan_lines = plan.describe()
+    for line in plan_lines:
+        logger.debug(line)
+    log_callback(plan_lines[0])
+
+    final_args = plan.to_args()
 
     final_command = [executable_path] + final_args
     logger.info(f"Final command for combined process: {' '.join(final_command)}")
@@ -280,6 +439,12 @@ def start_combined_process(configs, base_dir, game_filter_enabled, log_callback)
         logger.debug(f"Wrote command to {log_file_path}")
     except Exception as e:
         logger.warning(f"Failed to write command to file: {e}")
+    plan_file_path = os.path.join(base_dir, "..", "roo_tests", "last_launch_plan.txt")
+    try:
+        with open(plan_file_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(plan_lines) + "\n")
+    except Exception as e:
+        logger.warning(f"Failed to write launch plan to file: {e}")
     
     if not is_admin():
         error_msg = "ОШИБКА: Требуются права администратора"
@@ -302,8 +467,7 @@ def start_combined_process(configs, base_dir, game_filter_enabled, log_callback)
             errors='ignore'
         )
         logger.info(f"Combined process started successfully with PID: {process.pid}")
-        
-        threading.Thread(target=monitor_memory_usage, args=(process, log_callback), daemon=True).start()
+        process_table.invalidate()
         return process
     except Exception as e:
         error_msg = f"КРИТИЧЕСКАЯ ОШИБКА ЗАПУСКА: {e}"
@@ -311,32 +475,6 @@ def start_combined_process(configs, base_dir, game_filter_enabled, log_callback)
         logger.error(error_msg, exc_info=True)
         return None
 
-def monitor_memory_usage(process, log_callback):
-    logger.debug("Starting memory usage monitoring")
-    try:
-        max_memory_mb = 1024
-        while process and process.poll() is None:
-            try:
-                p = psutil.Process(process.pid)
-                memory_mb = p.memory_info().rss / 1024 / 1024
-                logger.debug(f"Process {process.pid} memory usage: {memory_mb:.2f} MB")
-                if memory_mb > max_memory_mb:
-                    warning_msg = f"Process {process.pid} exceeded memory limit ({memory_mb:.2f} MB > {max_memory_mb} MB), terminating"
-                    log_callback(warning_msg)
-                    logger.warning(warning_msg)
-                    kill_process(process)
-                    break
-            except psutil.NoSuchProcess:
-                logger.debug(f"Process {process.pid} no longer exists")
-                break
-            except Exception as e:
-                logger.warning(f"Error monitoring memory usage: {e}")
-                break
-            time.sleep(5)
-    except Exception as e:
-        logger.error(f"Unexpected error in memory monitoring: {e}", exc_info=True)
-    logger.debug("Memory usage monitoring stopped")
-
 def kill_process(process):
     if not process:
         logger.debug("kill_process called with None process")
@@ -357,72 +495,471 @@ def kill_process(process):
             logger.debug(f"Process {process.pid} already exited with code {process.poll()}")
     except Exception as e:
         logger.error(f"Error killing process {process.pid}: {e}", exc_info=True)
+    process_table.invalidate()
 
-def stop_all_processes(log_callback=None):
-    logger.info("Stopping all winws processes")
-    terminated_count = 0
-    killed_count = 0
-    
-    # First attempt graceful termination
-    for proc in psutil.process_iter(['pid', 'name']):
+# Строка, которую winws печатает, когда фильтр WinDivert установлен и трафик уже обрабатывается
+WINWS_READY_PATTERN = re.compile(r'windivert initialized|capture is started', re.IGNORECASE)
+
+def wait_process_ready(process, timeout, ready_pattern=WINWS_READY_PATTERN, on_output=None):
+    """
+    Ждет строку готовности winws в stdout процесса (запущенного с stdout=PIPE).
+    Поток чтения продолжает вычитывать вывод и после готовности, чтобы winws
+    не заблокировался на записи в заполненный pipe.
+    Возвращает секунды до готовности или None (таймаут или процесс завершился).
+    """
+    ready = threading.Event()
+    started = time.monotonic()
+
+    def reader():
         try:
-            if proc.info['name'] and proc.info['name'].lower() == WINWS_EXE.lower():
-                pid = proc.info['pid']
-                logger.debug(f"Attempting to terminate process {pid}")
-                proc.terminate()
-                terminated_count += 1
-                if log_callback:
-                    log_callback(f"Terminating process {pid}")
-        except psutil.NoSuchProcess:
-            # pid might not be defined here, but we don't need it
-            logger.debug("Process already terminated")
-            continue
+            for line in iter(process.stdout.readline, ''):
+                line = line.rstrip()
+                if not line:
+                    continue
+                if not ready.is_set() and ready_pattern.search(line):
+                    ready.set()
+                if on_output:
+                    on_output(line)
         except Exception as e:
-            logger.warning(f"Error terminating process: {e}")
-    
-    if terminated_count > 0:
-        logger.info(f"Sent termination signal to {terminated_count} processes")
-        if log_callback:
-            log_callback(f"Sent termination signal to {terminated_count} processes")
-    
-    # Wait for graceful shutdown
-    time.sleep(1)
-    
-    # Force kill any remaining processes
-    for proc in psutil.process_iter(['pid', 'name']):
+            logger.debug(f"Output reader for {process.pid} stopped: {e}")
+
+    threading.Thread(target=reader, daemon=True).start()
+    deadline = started + timeout
+    while not ready.wait(0.05):
+        if process.poll() is not None or time.monotonic() >= deadline:
+            return None
+    return time.monotonic() - started
+
+class WinwsSupervisor:
+    """
+    Владеет жизненным циклом процесса winws: запуск через launcher, ожидание
+    готовности по stdout, перезапуск с экспоненциальной задержкой после падения
+    и остановка при crash loop (слишком много падений за короткое время).
+
+    launcher - функция без аргументов, возвращающая Popen-подобный объект
+    (pid, stdout в текстовом режиме, poll(), wait()) или None при ошибке запуска.
+    Благодаря этому супервизор можно проверять на фейковом скрипте вместо winws.
+    on_output(line) получает строки stdout, on_state(state, process) - смену состояний:
+    starting, ready, backoff, stopped, crash_loop, failed.
+    """
+
+    def __init__(self, launcher, on_output=None, on_state=None, log_callback=None,
+                 ready_pattern=WINWS_READY_PATTERN, ready_timeout=15.0,
+                 backoff_initial=1.0, backoff_max=60.0,
+                 crash_window=120.0, crash_limit=5, stable_after=60.0):
+        self.launcher = launcher
+        self.on_output = on_output
+        self.on_state = on_state
+        self.log_callback = log_callback
+        self.ready_pattern = ready_pattern
+        self.ready_timeout = ready_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.crash_window = crash_window
+        self.crash_limit = crash_limit
+        # Процесс, проживший дольше stable_after, сбрасывает задержку перезапуска
+        self.stable_after = stable_after
+
+        self.state = "stopped"
+        self.process = None
+        self.starts = 0
+        self.crashes = 0
+        self.last_exit_code = None
+        self.last_ready_seconds = None
+        self._started_at = None
+        self._total_uptime = 0.0
+        self._crash_times = []
+        self._restart_requested = False
+        self._ready_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._ready_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0, kill=True):
+        """
+        Останавливает процесс без перезапуска. kill=False только отключает
+        перезапуск - процесс останавливает вызывающий (например, вместе с остальными).
+        """
+        self._stop_event.set()
+        if not kill:
+            return
+        with self._lock:
+            process = self.process
+        kill_process(process)
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def restart(self):
+        """Перезапускает текущий процесс сразу, без задержки и без учета как падения."""
+        with self._lock:
+            process = self.process
+        if process is None or process.poll() is not None:
+            # Процесса нет (ожидание перед перезапуском) - флаг не ставим, иначе следующее
+            # настоящее падение будет принято за запрошенный перезапуск
+            return
+        self._restart_requested = True
+        self._ready_event.clear()
+        kill_process(process)
+
+    def is_running(self):
+        """True, пока жив поток супервизора (после failed/crash_loop/stopped - False)."""
+        return bool(self._thread and self._thread.is_alive())
+
+    def wait_ready(self, timeout=None):
+        """Ждет готовности текущего процесса. True, если winws сообщил о начале захвата."""
+        return self._ready_event.wait(timeout)
+
+    def is_ready(self):
+        return self._ready_event.is_set()
+
+    def uptime(self):
+        """Сколько секунд живет текущий процесс (0, если не запущен)."""
+        started = self._started_at
+        return time.monotonic() - started if started else 0.0
+
+    def stats(self):
+        process = self.process
+        return {
+            "state": self.state,
+            "pid": process.pid if process else None,
+            "starts": self.starts,
+            "restarts": max(self.starts - 1, 0),
+            "crashes": self.crashes,
+            "uptime": round(self.uptime(), 1),
+            "total_uptime": round(self._total_uptime + self.uptime(), 1),
+            "last_exit_code": self.last_exit_code,
+            "last_ready_seconds": self.last_ready_seconds,
+        }
+
+    def _log(self, message):
+        logger.info(message)
+        if self.log_callback:
+            self.log_callback(message)
+
+    def _set_state(self, state, process=None):
+        self.state = state
+        logger.debug(f"Supervisor state: {state} (pid={process.pid if process else None})")
+        if self.on_state:
+            try:
+                self.on_state(state, process)
+            except Exception as e:
+                logger.warning(f"Supervisor on_state callback failed: {e}")
+
+    def _read_output(self, process, launched_at):
         try:
-            if proc.info['name'] and proc.info['name'].lower() == WINWS_EXE.lower():
-                pid = proc.info['pid']
-                logger.debug(f"Process {pid} still running, killing forcefully")
-                proc.kill()
-                killed_count += 1
-                if log_callback:
-                    log_callback(f"Force killing process {pid}")
-        except psutil.NoSuchProcess:
-            # pid might not be defined here, but we don't need it
-            logger.debug("Process already terminated")
-            continue
+            for line in iter(process.stdout.readline, ''):
+                line = line.rstrip()
+                if not line:
+                    continue
+                if not self._ready_event.is_set() and self.ready_pattern.search(line):
+                    self.last_ready_seconds = round(time.monotonic() - launched_at, 3)
+                    self._ready_event.set()
+                    self._set_state("ready", process)
+                if self.on_output:
+                    self.on_output(line)
         except Exception as e:
-            logger.warning(f"Error killing process: {e}")
-    
-    if killed_count > 0:
-        logger.info(f"Force killed {killed_count} processes")
+            logger.debug(f"Output reader for {process.pid} stopped: {e}")
+
+    def _run(self):
+        backoff = self.backoff_initial
+        while not self._stop_event.is_set():
+            self._ready_event.clear()
+            launched_at = time.monotonic()
+            try:
+                process = self.launcher()
+            except Exception as e:
+                logger.error(f"Supervisor launcher failed: {e}", exc_info=True)
+                process = None
+
+            if process is None:
+                if self.starts == 0:
+                    # Первый запуск не удался (нет прав, нет exe) - повторять бессмысленно
+                    self._set_state("failed")
+                    return
+                exit_code, uptime = None, 0.0
+            else:
+                with self._lock:
+                    self.process = process
+                self.starts += 1
+                self._started_at = launched_at
+                self._set_state("starting", process)
+
+                reader = None
+                if getattr(process, 'stdout', None) is not None:
+                    reader = threading.Thread(target=self._read_output, args=(process, launched_at), daemon=True)
+                    reader.start()
+                deadline = launched_at + self.ready_timeout
+                while not self._ready_event.wait(0.1) and process.poll() is None:
+                    if time.monotonic() >= deadline:
+                        logger.warning(f"winws {process.pid} did not report readiness in {self.ready_timeout}s")
+                        break
+
+                exit_code = process.wait()
+                if reader:
+                    reader.join(2)
+                uptime = time.monotonic() - launched_at
+                self._total_uptime += uptime
+                self._started_at = None
+                self.last_exit_code = exit_code
+                with self._lock:
+                    self.process = None
+
+            if self._stop_event.is_set():
+                break
+            if self._restart_requested:
+                self._restart_requested = False
+                continue
+
+            self.crashes += 1
+            now = time.monotonic()
+            self._crash_times = [t for t in self._crash_times if now - t < self.crash_window] + [now]
+            if len(self._crash_times) >= self.crash_limit:
+                self._log(f"winws падает слишком часто ({len(self._crash_times)} раз за {int(self.crash_window)} с). Автоперезапуск остановлен.")
+                self._set_state("crash_loop", process)
+                return
+
+            if uptime >= self.stable_after:
+                backoff = self.backoff_initial
+            self._log(f"winws завершился (код {exit_code}, проработал {uptime:.0f} с). Перезапуск через {backoff:.1f} с...")
+            self._set_state("backoff", process)
+            if self._stop_event.wait(backoff):
+                break
+            backoff = min(backoff * 2, self.backoff_max)
+
+        self._set_state("stopped")
+
+class ShardedSupervisor:
+    """
+    Несколько экземпляров winws с непересекающимися фильтрами (см. launch_plan.shard_plan),
+    у каждого свой WinwsSupervisor. Снаружи ведет себя как один супервизор
+    (start/stop/restart/wait_ready/stats), поэтому подходит для hot_restart.
+
+    launch(plan) - функция запуска одного шарда (Popen-подобный объект или None);
+    ее можно подменить фейковым процессом. on_output(shard, line) и
+    on_state(shard, state, process) получают номер шарда.
+    """
+
+    def __init__(self, plans, launch, on_output=None, on_state=None, log_callback=None, **supervisor_kwargs):
+        self.plans = list(plans)
+        self.supervisors = []
+        for index, plan in enumerate(self.plans):
+            self.supervisors.append(WinwsSupervisor(
+                launcher=lambda plan=plan: launch(plan),
+                on_output=(lambda line, index=index: on_output(index, line)) if on_output else None,
+                on_state=(lambda state, process, index=index: on_state(index, state, process)) if on_state else None,
+                log_callback=log_callback,
+                **supervisor_kwargs
+            ))
+
+    @property
+    def process(self):
+        """Любой живой процесс группы (None, если не запущено ни одного)."""
+        for supervisor in self.supervisors:
+            if supervisor.process:
+                return supervisor.process
+        return None
+
+    @property
+    def last_ready_seconds(self):
+        values = [s.last_ready_seconds for s in self.supervisors if s.last_ready_seconds is not None]
+        return max(values) if values else None
+
+    def start(self):
+        for supervisor in self.supervisors:
+            supervisor.start()
+
+    def stop(self, timeout=5.0, kill=True):
+        # Сначала отключаем перезапуск у всех, затем останавливаем процессы параллельно
+        for supervisor in self.supervisors:
+            supervisor.stop(kill=False)
+        if not kill:
+            return
+        threads = [threading.Thread(target=s.stop, args=(timeout, True), daemon=True) for s in self.supervisors]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout + 1)
+
+    def restart(self):
+        for supervisor in self.supervisors:
+            supervisor.restart()
+
+    def is_running(self):
+        return all(s.is_running() for s in self.supervisors)
+
+    def wait_ready(self, timeout=None):
+        """True, если все шарды сообщили о готовности за timeout секунд."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for supervisor in self.supervisors:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not supervisor.wait_ready(remaining):
+                return False
+        return True
+
+    def is_ready(self):
+        return all(s.is_ready() for s in self.supervisors)
+
+    def stats(self):
+        shards = [s.stats() for s in self.supervisors]
+        states = {st["state"] for st in shards}
+        return {
+            "state": states.pop() if len(states) == 1 else "/".join(st["state"] for st in shards),
+            "pid": ", ".join(str(st["pid"]) for st in shards if st["pid"]),
+            "starts": sum(st["starts"] for st in shards),
+            "restarts": sum(st["restarts"] for st in shards),
+            "crashes": sum(st["crashes"] for st in shards),
+            "uptime": min(st["uptime"] for st in shards),
+            "total_uptime": round(sum(st["total_uptime"] for st in shards), 1),
+            "last_exit_code": None,
+            "last_ready_seconds": self.last_ready_seconds,
+            "shards": shards,
+        }
+
+
+def hot_restart(old_supervisor, new_supervisor, log_callback=None, ready_timeout=10.0):
+    """
+    Make-before-break: запускает новый экземпляр, ждет его готовности и только
+    потом останавливает старый (по PID, а не все winws по имени). Если новый
+    не стал готов за ready_timeout - откат на "остановить, потом запустить".
+    Возвращает dict с замерами: mode, ready, gap (сек без обхода), overlap.
+    """
+    def log(message):
+        logger.info(message)
         if log_callback:
-            log_callback(f"Force killed {killed_count} processes")
-    
-    total_processes = terminated_count + killed_count
-    if total_processes > 0:
-        logger.info(f"Finished stopping {total_processes} winws processes")
+            log_callback(message)
+
+    t0 = time.monotonic()
+    new_supervisor.start()
+    if new_supervisor.wait_ready(ready_timeout):
+        t_ready = time.monotonic()
+        old_supervisor.stop()
+        t_old_gone = time.monotonic()
+        result = {"mode": "hot", "ready": round(t_ready - t0, 3), "gap": 0.0,
+                  "overlap": round(t_old_gone - t_ready, 3)}
+        log(f"Горячий перезапуск: новый процесс готов через {result['ready']:.2f} с, "
+            f"разрыв 0 с (оба работали {result['overlap']:.2f} с)")
+        return result
+
+    # Новый экземпляр не поднялся рядом со старым - обычный перезапуск
+    log(f"Новый процесс не сообщил о готовности за {ready_timeout:.0f} с, перезапуск с остановкой...")
+    old_supervisor.stop()
+    t_down = time.monotonic()
+    if new_supervisor.is_running():
+        new_supervisor.restart()
     else:
+        # Первый запуск не удался, поток супервизора уже завершился (failed) - запускаем заново
+        new_supervisor.start()
+    ready = new_supervisor.wait_ready(ready_timeout)
+    t_up = time.monotonic()
+    result = {"mode": "cold", "ready": round(t_up - t_down, 3) if ready else None,
+              "gap": round(t_up - t_down, 3), "overlap": 0.0}
+    if ready:
+        log(f"Перезапуск с остановкой: разрыв обхода {result['gap']:.2f} с")
+    else:
+        log(f"Перезапуск с остановкой: процесс не сообщил о готовности за {ready_timeout:.0f} с")
+    return result
+
+def shutdown_processes(pids, timeout=3.0, include_children=True):
+    """
+    Останавливает процессы параллельно: terminate всем сразу, общее ожидание
+    psutil.wait_procs с дедлайном, kill оставшимся. Возвращает отчет
+    [(pid, имя, секунд до выхода, "terminated"/"killed"/"alive")].
+    """
+    snapshot = process_table.snapshot(max_age=0.5) if include_children else None
+    targets = {}
+    for pid in pids:
+        related = [pid] + (snapshot.children_of(pid, recursive=True) if snapshot else [])
+        for target_pid in related:
+            if target_pid in targets:
+                continue
+            try:
+                targets[target_pid] = psutil.Process(target_pid)
+            except psutil.NoSuchProcess:
+                continue
+    if not targets:
+        return []
+
+    names = {}
+    for pid, proc in targets.items():
+        try:
+            names[pid] = proc.name()
+        except psutil.Error:
+            names[pid] = "?"
+
+    t0 = time.monotonic()
+    exited = {}
+
+    def on_exit(proc):
+        exited[proc.pid] = time.monotonic() - t0
+
+    for proc in targets.values():
+        try:
+            proc.terminate()
+        except psutil.NoSuchProcess:
+            exited[proc.pid] = 0.0
+        except psutil.Error as e:
+            logger.warning(f"Error terminating process {proc.pid}: {e}")
+    # Короткие циклы ожидания вместо одного длинного: время выхода каждого PID точнее ~50 мс
+    alive = [p for p in targets.values() if p.pid not in exited]
+    deadline = t0 + timeout
+    while alive and time.monotonic() < deadline:
+        _, alive = psutil.wait_procs(alive, timeout=0.05, callback=on_exit)
+    terminated = set(exited)
+
+    for proc in alive:
+        logger.debug(f"Process {proc.pid} still running after {timeout}s, killing forcefully")
+        try:
+            proc.kill()
+        except psutil.NoSuchProcess:
+            pass
+        except psutil.Error as e:
+            logger.warning(f"Error killing process {proc.pid}: {e}")
+    if alive:
+        psutil.wait_procs(alive, timeout=2, callback=on_exit)
+    process_table.invalidate()
+
+    report = []
+    for pid in targets:
+        if pid in terminated:
+            report.append((pid, names[pid], exited[pid], "terminated"))
+        elif pid in exited:
+            report.append((pid, names[pid], exited[pid], "killed"))
+        else:
+            report.append((pid, names[pid], None, "alive"))
+    for pid, name, seconds, how in report:
+        logger.info(f"Process {pid} ({name}): {how}" + (f" in {seconds * 1000:.0f} ms" if seconds is not None else ""))
+    return report
+
+def stop_all_processes(log_callback=None, extra_pids=(), timeout=3.0):
+    """Останавливает все winws (и переданные extra_pids) одной параллельной остановкой."""
+    logger.info("Stopping all winws processes")
+    pids = list(dict.fromkeys(list(extra_pids) + process_table.pids_by_name(WINWS_EXE, max_age=0.5)))
+    if not pids:
         logger.debug("No winws processes found to stop")
+        return []
+
+    t0 = time.monotonic()
+    report = shutdown_processes(pids, timeout)
+    elapsed_ms = (time.monotonic() - t0) * 1000
+    details = ", ".join(
+        f"{pid} {how}" + (f" {seconds * 1000:.0f} ms" if seconds is not None else "")
+        for pid, _, seconds, how in report
+    )
+    logger.info(f"Finished stopping {len(report)} processes in {elapsed_ms:.0f} ms: {details}")
+    if log_callback and report:
+        log_callback(f"Stopped {len(report)} processes in {elapsed_ms:.0f} ms ({details})")
+    return report
 
 def is_process_running():
-    for proc in psutil.process_iter(['pid', 'name']):
-        try:
-            if proc.info['name'] and proc.info['name'].lower() == WINWS_EXE.lower():
-                return True
-        except: pass
-    return False
+    return bool(process_table.pids_by_name(WINWS_EXE))
 
 def is_service_running():
     try:
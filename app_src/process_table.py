@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Общий снимок таблицы процессов.
+
+Полный обход psutil.process_iter выполняется не чаще, чем раз в ttl секунд,
+и только когда кто-то запросил данные; все потребители (остановка winws,
+IP Grabber, очистка браузеров) работают с одним снимком и его индексами
+имя -> PID и родитель -> дети.
+"""
+import time
+import threading
+import logging
+
+import psutil
+
+logger = logging.getLogger("process_manager.process_table")
+
+
+class ProcessSnapshot:
+    """Неизменяемый снимок: {pid: (имя, ppid)} и индексы по имени и родителю."""
+
+    def __init__(self, entries, taken_at):
+        self.taken_at = taken_at
+        self.entries = entries
+        self._by_name = {}
+        self._children = {}
+        for pid, (name, ppid) in entries.items():
+            if name:
+                self._by_name.setdefault(name.lower(), []).append(pid)
+            if ppid is not None:
+                self._children.setdefault(ppid, []).append(pid)
+
+    def age(self):
+        return time.monotonic() - self.taken_at
+
+    def __len__(self):
+        return len(self.entries)
+
+    def name_of(self, pid):
+        entry = self.entries.get(pid)
+        return entry[0] if entry else None
+
+    def pids_by_name(self, name):
+        return list(self._by_name.get(name.lower(), ()))
+
+    def names(self):
+        """{имя: первый PID} в порядке обхода - для списков выбора процесса."""
+        return {name: pids[0] for name, pids in self._by_name.items()}
+
+    def children_of(self, pid, recursive=False):
+        result = list(self._children.get(pid, ()))
+        if recursive:
+            i = 0
+            while i < len(result):
+                result.extend(self._children.get(result[i], ()))
+                i += 1
+        return result
+
+    def items(self):
+        """(pid, имя, ppid) для всех процессов снимка."""
+        return [(pid, name, ppid) for pid, (name, ppid) in self.entries.items()]
+
+
+class ProcessTable:
+    def __init__(self, ttl=2.0):
+        self.ttl = ttl
+        self.scans = 0
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def snapshot(self, max_age=None):
+        """
+        Возвращает снимок не старше max_age (по умолчанию ttl). Если снимок устарел,
+        выполняется один обход; параллельные вызовы ждут его и получают тот же снимок.
+        """
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            snap = self._snapshot
+            if snap is not None and snap.age() <= max_age:
+                return snap
+            snap = self._scan()
+            self._snapshot = snap
+            return snap
+
+    def invalidate(self):
+        """Сбрасывает снимок (например, после запуска или остановки процессов)."""
+        with self._lock:
+            self._snapshot = None
+
+    def pids_by_name(self, name, max_age=None):
+        return self.snapshot(max_age).pids_by_name(name)
+
+    def _scan(self):
+        t0 = time.monotonic()
+        entries = {}
+        for proc in psutil.process_iter(['pid', 'name', 'ppid']):
+            try:
+                info = proc.info
+                entries[info['pid']] = (info.get('name') or "", info.get('ppid'))
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                continue
+        self.scans += 1
+        snap = ProcessSnapshot(entries, time.monotonic())
+        logger.debug(f"Process table scan #{self.scans}: {len(entries)} processes in {(snap.taken_at - t0) * 1000:.1f} ms")
+        return snap
+
+
+# Общий экземпляр для всего приложения
+process_table = ProcessTable()
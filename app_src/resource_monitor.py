@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+Сбор метрик ресурсов winws и самого GUI.
+
+Один поток раз в interval секунд снимает CPU%, RSS, число дескрипторов
+и потоков, счетчики ввода-вывода для каждого наблюдаемого процесса и кладет
+их в кольцевой буфер фиксированного размера. Политики (warn / restart / kill)
+проверяются на каждом замере. Каждый запуск winws получает номер поколения
+и контекст (секции, профили, размеры списков), которые попадают в экспорт:
+так всплески CPU можно сопоставить с конфигурацией.
+"""
+import csv
+import json
+import time
+import threading
+import collections
+import logging
+
+import psutil
+
+logger = logging.getLogger("process_manager.resource_monitor")
+
+Sample = collections.namedtuple(
+    "Sample",
+    "ts target pid generation cpu_percent rss_mb handles threads read_bytes write_bytes"
+)
+
+METRICS = ("cpu_percent", "rss_mb", "handles", "threads", "read_bytes", "write_bytes")
+ACTIONS = ("warn", "restart", "kill")
+
+DEFAULT_POLICIES = [
+    # Прежнее поведение monitor_memory_usage: winws больше 1 ГБ не оставляем работать
+    {"target": "winws", "metric": "rss_mb", "limit": 1024, "action": "restart"},
+    {"target": "winws", "metric": "cpu_percent", "limit": 50, "sustain": 6, "action": "warn"},
+]
+
+
+class ResourcePolicy:
+    """Срабатывает, когда метрика выше limit sustain замеров подряд; затем пауза cooldown секунд."""
+
+    def __init__(self, target, metric, limit, action="warn", sustain=1, cooldown=300.0):
+        if metric not in METRICS:
+            raise ValueError(f"Неизвестная метрика: {metric}")
+        if action not in ACTIONS:
+            raise ValueError(f"Неизвестное действие: {action}")
+        self.target = target
+        self.metric = metric
+        self.limit = float(limit)
+        self.action = action
+        self.sustain = max(1, int(sustain))
+        self.cooldown = float(cooldown)
+        # Счетчики по каждому процессу отдельно (шарды winws срабатывают независимо)
+        self._streak = {}
+        self._last_fired = {}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["target"], data["metric"], data["limit"], data.get("action", "warn"),
+                   data.get("sustain", 1), data.get("cooldown", 300.0))
+
+    def check(self, sample):
+        """True, если по этому замеру нужно выполнить действие."""
+        # Политика для "winws" относится и к шардам "winws#1", "winws#2"...
+        if sample.target != self.target and not sample.target.startswith(self.target + "#"):
+            return False
+        value = getattr(sample, self.metric)
+        if value is None or value <= self.limit:
+            self._streak[sample.target] = 0
+            return False
+        streak = self._streak[sample.target] = self._streak.get(sample.target, 0) + 1
+        if streak < self.sustain:
+            return False
+        last_fired = self._last_fired.get(sample.target)
+        if last_fired is not None and sample.ts - last_fired < self.cooldown:
+            return False
+        self._last_fired[sample.target] = sample.ts
+        self._streak[sample.target] = 0
+        return True
+
+    def describe(self, sample):
+        return f"{self.target}: {self.metric} = {getattr(sample, self.metric):.1f} > {self.limit:g}"
+
+
+class _Watched:
+    def __init__(self, pid, generation, actions):
+        self.pid = pid
+        self.generation = generation
+        self.actions = actions or {}
+        self.proc = psutil.Process(pid)
+        # Первый вызов cpu_percent всегда 0 - запускаем отсчет сразу
+        self.proc.cpu_percent(None)
+
+
+class ResourceSampler:
+    def __init__(self, interval=5.0, capacity=720):
+        self.interval = interval
+        self.samples = collections.deque(maxlen=capacity)
+        self.policies = []
+        self.log_callback = None
+        self._watched = {}
+        self._contexts = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def configure(self, policies=None, log_callback=None, interval=None, capacity=None):
+        """Задает политики (список dict), коллбек лога, период и размер буфера."""
+        if policies is not None:
+            parsed = []
+            for data in policies:
+                try:
+                    parsed.append(ResourcePolicy.from_dict(data))
+                except (KeyError, ValueError, TypeError) as e:
+                    logger.warning(f"Ignoring invalid resource policy {data!r}: {e}")
+            self.policies = parsed
+        if log_callback is not None:
+            self.log_callback = log_callback
+        if interval is not None:
+            self.interval = interval
+        if capacity is not None and capacity != self.samples.maxlen:
+            with self._lock:
+                self.samples = collections.deque(self.samples, maxlen=capacity)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def watch(self, target, pid, actions=None, context=None):
+        """
+        Начинает наблюдение за процессом под именем target (winws, gui).
+        actions - {"restart": fn, "kill": fn} для политик. Возвращает номер поколения.
+        """
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+            if context is not None:
+                self._contexts[generation] = dict(context, target=target, pid=pid, started=time.time())
+                while len(self._contexts) > 100:
+                    del self._contexts[min(self._contexts)]
+            try:
+                self._watched[target] = _Watched(pid, generation, actions)
+            except psutil.Error as e:
+                logger.debug(f"Cannot watch {target} pid {pid}: {e}")
+        return generation
+
+    def unwatch(self, target, pid=None):
+        """Прекращает наблюдение (если pid указан - только за этим процессом)."""
+        with self._lock:
+            watched = self._watched.get(target)
+            if watched and (pid is None or watched.pid == pid):
+                del self._watched[target]
+
+    def latest_by_target(self):
+        """{target: последний замер} для всех процессов в буфере."""
+        latest = {}
+        with self._lock:
+            for sample in self.samples:
+                latest[sample.target] = sample
+        return latest
+
+    def latest(self, target):
+        with self._lock:
+            for sample in reversed(self.samples):
+                if sample.target == target:
+                    return sample
+        return None
+
+    def sample_once(self):
+        """Один замер всех наблюдаемых процессов (вызывается потоком сбора)."""
+        now = time.time()
+        with self._lock:
+            watched = list(self._watched.items())
+        taken = []
+        for target, item in watched:
+            sample = self._sample(target, item, now)
+            if sample is None:
+                self.unwatch(target, item.pid)
+                continue
+            taken.append((sample, item))
+        with self._lock:
+            self.samples.extend(sample for sample, _ in taken)
+        for sample, item in taken:
+            self._apply_policies(sample, item)
+        return [sample for sample, _ in taken]
+
+    def _sample(self, target, item, now):
+        proc = item.proc
+        try:
+            with proc.oneshot():
+                cpu = proc.cpu_percent(None)
+                rss_mb = proc.memory_info().rss / 1024 / 1024
+                threads = proc.num_threads()
+                if hasattr(proc, "num_handles"):
+                    handles = proc.num_handles()
+                elif hasattr(proc, "num_fds"):
+                    handles = proc.num_fds()
+                else:
+                    handles = None
+                try:
+                    io = proc.io_counters()
+                    read_bytes, write_bytes = io.read_bytes, io.write_bytes
+                except (psutil.AccessDenied, AttributeError, NotImplementedError):
+                    read_bytes = write_bytes = None
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            return None
+        except psutil.AccessDenied as e:
+            logger.debug(f"Access denied sampling {target} ({item.pid}): {e}")
+            return None
+        return Sample(round(now, 3), target, item.pid, item.generation, round(cpu, 1),
+                      round(rss_mb, 1), handles, threads, read_bytes, write_bytes)
+
+    def _apply_policies(self, sample, item):
+        for policy in self.policies:
+            if not policy.check(sample):
+                continue
+            action = policy.action
+            message = f"Ресурсы: {policy.describe(sample)}"
+            handler = item.actions.get(action)
+            if action != "warn" and handler is None:
+                logger.warning(f"No '{action}' handler for {sample.target}, only warning")
+                action = "warn"
+            if action == "warn":
+                self._log(f"{message} - предупреждение", "status")
+                continue
+            self._log(f"{message} - {'перезапуск' if action == 'restart' else 'остановка'} процесса", "error")
+            try:
+                handler()
+            except Exception as e:
+                logger.error(f"Resource policy action {action} failed: {e}", exc_info=True)
+
+    def _log(self, message, log_type):
+        logger.warning(message)
+        if self.log_callback:
+            self.log_callback(message, log_type)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.sample_once()
+            except Exception as e:
+                logger.warning(f"Resource sampling failed: {e}")
+
+    def export(self, path):
+        """Сохраняет буфер замеров в CSV или JSON (по расширению). Возвращает число замеров."""
+        with self._lock:
+            samples = list(self.samples)
+            contexts = {g: c for g, c in self._contexts.items() if any(s.generation == g for s in samples)}
+        if path.lower().endswith(".csv"):
+            with open(path, "w", encoding="utf-8", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(Sample._fields)
+                writer.writerows(samples)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({
+                    "interval": self.interval,
+                    "runs": contexts,
+                    "samples": [s._asdict() for s in samples],
+                }, f, ensure_ascii=False, indent=1)
+        return len(samples)
+
+
+# Общий экземпляр для всего приложения
+resource_sampler = ResourceSampler()
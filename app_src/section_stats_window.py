@@ -0,0 +1,112 @@
+import tkinter as tk
+from tkinter import ttk, messagebox, filedialog
+import datetime
+from winws_parser import export_parsers
+
+COLUMNS = (
+    ("section", "#", 40),
+    ("profile", "Профиль", 180),
+    ("lists", "Списки", 180),
+    ("hosts", "Доменов", 70),
+    ("ips", "IP/подсетей", 80),
+    ("matches", "Пакетов", 70),
+    ("actions", "Действий", 70),
+    ("last_host", "Последний домен", 160),
+    ("last_seen", "Время", 70),
+)
+
+
+class SectionStatsWindow(tk.Toplevel):
+    """Счетчики секций winws текущего запуска (всех шардов), обновляются раз в секунду."""
+
+    def __init__(self, parent, get_parsers, refresh_ms=1000):
+        super().__init__(parent)
+        # Парсеры меняются при каждом перезапуске, поэтому берем их через функцию
+        self.get_parsers = get_parsers
+        self.refresh_ms = refresh_ms
+
+        self.title("Статистика секций winws")
+        self.geometry("950x400")
+
+        self.create_widgets()
+        self.refresh()
+
+    def create_widgets(self):
+        top_frame = ttk.Frame(self)
+        top_frame.pack(fill=tk.X, padx=10, pady=5)
+
+        self.lbl_summary = ttk.Label(top_frame, text="", foreground="gray")
+        self.lbl_summary.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        ttk.Button(top_frame, text="Экспорт...", command=self.export).pack(side=tk.RIGHT, padx=5)
+
+        tree_frame = ttk.Frame(self)
+        tree_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+
+        self.tree = ttk.Treeview(tree_frame, columns=[c[0] for c in COLUMNS], show="headings")
+        for key, title, width in COLUMNS:
+            self.tree.heading(key, text=title)
+            self.tree.column(key, width=width, anchor=tk.W)
+
+        scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscrollcommand=scrollbar.set)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        ttk.Label(self, text="Пакеты и действия считаются только при включенном отладочном выводе winws (Настройки).",
+                  foreground="gray").pack(anchor=tk.W, padx=10, pady=(0, 5))
+
+    def refresh(self):
+        if not self.winfo_exists():
+            return
+        parsers = self.get_parsers()
+        if not parsers:
+            self.lbl_summary.config(text="Нет данных: winws еще не запускался")
+            self.tree.delete(*self.tree.get_children())
+        else:
+            summaries = [parser.summary() for parser in parsers]
+            first = summaries[0]
+            self.lbl_summary.config(
+                text=f"winws {first['version'] or '?'}, экземпляров: {len(parsers)}, "
+                     f"профилей: {sum(s['profiles'] or 0 for s in summaries) or '?'}, "
+                     f"строк вывода: {sum(s['lines'] for s in summaries)}, "
+                     f"ошибок: {sum(s['kinds'].get('error', 0) for s in summaries)}, "
+                     f"аптайм: {first['uptime']} с"
+            )
+            existing = set(self.tree.get_children())
+            for shard, parser in enumerate(parsers, 1):
+                for row in parser.snapshot():
+                    # При шардировании номер секции показывается как "шард.секция"
+                    number = row["section"] if len(parsers) == 1 else f"{shard}.{row['section']}"
+                    iid = str(number)
+                    values = [number] + ["" if row[key] is None else row[key] for key, _, _ in COLUMNS[1:]]
+                    if iid in existing:
+                        self.tree.item(iid, values=values)
+                        existing.discard(iid)
+                    else:
+                        self.tree.insert("", tk.END, iid=iid, values=values)
+            if existing:
+                self.tree.delete(*existing)
+        self.after(self.refresh_ms, self.refresh)
+
+    def export(self):
+        parsers = self.get_parsers()
+        if not parsers:
+            messagebox.showinfo("Экспорт", "Нет данных: winws еще не запускался.", parent=self)
+            return
+        filename = filedialog.asksaveasfilename(
+            parent=self,
+            defaultextension=".json",
+            filetypes=[("JSON", "*.json"), ("CSV", "*.csv")],
+            initialfile=f"winws_sections_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+        )
+        if not filename:
+            return
+        try:
+            count = export_parsers(parsers, filename)
+            messagebox.showinfo("Экспорт", f"Сохранено секций: {count}", parent=self)
+        except Exception as e:
+            messagebox.showerror("Ошибка", f"Не удалось сохранить статистику:\n{e}", parent=self)
+
+
+def show_section_stats(parent, get_parsers):
+    return SectionStatsWindow(parent, get_parsers)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+История результатов тестов профилей (SQLite).
+
+Каждая проба теста сайтов (и каждый ответ в тесте Discord) - одна строка:
+время, сеть, цель, профиль и хэш его аргументов, исход, класс ошибки,
+время рукопожатия и до первого байта. Профиль определяется хэшем аргументов:
+после правки аргументов старые результаты к нему не относятся.
+
+Сеть - подсеть локального адреса, через который идет маршрут по умолчанию.
+Быстрый поиск проверяет первыми профили, которые уже работали в этой сети
+для этих доменов; отчет показывает лучшие профили по цели за N дней.
+"""
+import time
+import socket
+import sqlite3
+import hashlib
+import collections
+import threading
+import ipaddress
+import logging
+
+from probe_engine import percentile, OUTCOMES
+
+logger = logging.getLogger("process_manager.test_history")
+
+SCHEMA_VERSION = 1
+# Вес результатов из других сетей: блокировки у провайдеров похожи, но не одинаковы
+OTHER_NETWORK_WEIGHT = 0.25
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    network TEXT NOT NULL,
+    test TEXT NOT NULL,
+    target TEXT NOT NULL,
+    profile TEXT NOT NULL,
+    profile_hash TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    failure TEXT,
+    handshake_ms REAL,
+    ttfb_ms REAL
+);
+CREATE INDEX IF NOT EXISTS results_target_ts ON results (target, ts);
+CREATE INDEX IF NOT EXISTS results_target_profile ON results (target, profile_hash, network);
+"""
+
+
+def network_key():
+    """Подсеть /24 (для IPv6 - /64) адреса маршрута по умолчанию; 'unknown', если сети нет."""
+    for family, target in ((socket.AF_INET, ("192.0.2.1", 80)), (socket.AF_INET6, ("2001:db8::1", 80))):
+        try:
+            # connect() для UDP только выбирает маршрут, пакеты не отправляются
+            with socket.socket(family, socket.SOCK_DGRAM) as sock:
+                sock.connect(target)
+                address = sock.getsockname()[0]
+        except OSError:
+            continue
+        prefix = 24 if family == socket.AF_INET else 64
+        return str(ipaddress.ip_network(f"{address}/{prefix}", strict=False))
+    return "unknown"
+
+
+def profile_hash(profile):
+    """Короткий хэш строки аргументов профиля."""
+    return hashlib.sha256(profile["args"].encode('utf-8')).hexdigest()[:16]
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+class TestHistory:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Запись идет из потока теста, отчеты - из UI: одно соединение под блокировкой
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        try:
+            self._db.executescript(_SCHEMA)
+            self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        except sqlite3.Error:
+            self._db.close()
+            raise
+
+    def record_probes(self, network, profile, results):
+        """Сохраняет результаты проб (probe_engine.ProbeResult) одного профиля."""
+        ts = time.time()
+        digest = profile_hash(profile)
+        rows = [(ts, network, "site", r.endpoint.host, profile["name"], digest, int(r.ok), None if r.outcome == "ok" else r.outcome,
+                 _ms(r.handshake), _ms(r.latency) if r.ok else None) for r in results]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT INTO results (ts, network, test, target, profile, profile_hash, ok, failure, handshake_ms, ttfb_ms)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def record(self, network, test, target, profile, ok, failure=None):
+        """Один результат без замеров задержки (например, ответ пользователя в тесте Discord)."""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT INTO results (ts, network, test, target, profile, profile_hash, ok, failure)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), network, test, target, profile["name"], profile_hash(profile), int(ok), failure))
+
+    def scores(self, network, targets, profiles):
+        """
+        Оценка вероятности успеха каждого профиля на целях: (успехи + 1) / (проверки + 2),
+        результаты других сетей с весом OTHER_NETWORK_WEIGHT. Без истории - 0.5.
+        Возвращает {имя профиля: оценка}.
+        """
+        by_hash = {profile_hash(p): p["name"] for p in profiles}
+        tries = {p["name"]: 0.0 for p in profiles}
+        successes = dict(tries)
+        if targets:
+            marks = ",".join("?" * len(targets))
+            with self._lock:
+                rows = self._db.execute(
+                    f"SELECT profile_hash, network = ?, COUNT(*), SUM(ok) FROM results"
+                    f" WHERE target IN ({marks}) GROUP BY profile_hash, network = ?",
+                    [network, *targets, network]).fetchall()
+            for digest, same_network, count, ok in rows:
+                name = by_hash.get(digest)
+                if name is not None:
+                    weight = 1.0 if same_network else OTHER_NETWORK_WEIGHT
+                    tries[name] += count * weight
+                    successes[name] += ok * weight
+        return {name: (successes[name] + 1) / (tries[name] + 2) for name in tries}
+
+    def best_profiles(self, target, days=30, network=None, limit=5):
+        """
+        Лучшие профили для цели за последние days дней (в сети network или во всех):
+        список dict с profile, tests, ok, ratio, handshake_p50, ttfb_p50, ttfb_p90 (мс), last,
+        failure - самый частый класс неудачи (probe_engine.OUTCOMES).
+        """
+        query = "SELECT profile, profile_hash, ok, failure, handshake_ms, ttfb_ms, ts FROM results WHERE target = ? AND ts >= ?"
+        params = [target, time.time() - days * 86400]
+        if network:
+            query += " AND network = ?"
+            params.append(network)
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        groups = {}
+        for name, digest, ok, failure, handshake, ttfb, ts in rows:
+            group = groups.setdefault(digest, {"profile": name, "tests": 0, "ok": 0, "handshake": [], "ttfb": [], "last": ts,
+                                               "failures": collections.Counter()})
+            group["profile"] = name
+            group["tests"] += 1
+            group["ok"] += ok
+            group["last"] = max(group["last"], ts)
+            if failure:
+                group["failures"][failure] += 1
+            if ok and handshake is not None:
+                group["handshake"].append(handshake)
+            if ok and ttfb is not None:
+                group["ttfb"].append(ttfb)
+        best = []
+        for group in groups.values():
+            best.append({
+                "profile": group["profile"],
+                "tests": group["tests"],
+                "ok": group["ok"],
+                "ratio": group["ok"] / group["tests"],
+                "handshake_p50": percentile(group["handshake"], 50),
+                "ttfb_p50": percentile(group["ttfb"], 50),
+                "ttfb_p90": percentile(group["ttfb"], 90),
+                "last": group["last"],
+                "failure": group["failures"].most_common(1)[0][0] if group["failures"] else None,
+            })
+        best.sort(key=lambda b: (-b["ratio"], -b["tests"], b["ttfb_p50"] if b["ttfb_p50"] is not None else float('inf')))
+        return best[:limit]
+
+    def report_lines(self, targets, days=30, network=None, limit=5):
+        """Текст отчета по лучшим профилям для каждой цели."""
+        lines = [f"История тестов за {days} дн." + (f" (сеть {network})" if network else " (все сети)")]
+        for target in targets:
+            best = self.best_profiles(target, days, network, limit)
+            lines.append(f"  {target}:")
+            if not best:
+                lines.append("    нет данных")
+                continue
+            for item in best:
+                ttfb = f"{item['ttfb_p50']:.0f}/{item['ttfb_p90']:.0f} мс" if item["ttfb_p50"] is not None else "-"
+                handshake = f"{item['handshake_p50']:.0f} мс" if item["handshake_p50"] is not None else "-"
+                lines.append(f"    {item['profile']:<30} : успех {item['ok']}/{item['tests']} ({item['ratio'] * 100:.0f}%),"
+                             f" рукопожатие {handshake}, ответ p50/p90 {ttfb},"
+                             f" последний {time.strftime('%d.%m %H:%M', time.localtime(item['last']))}"
+                             + (f", чаще всего: {OUTCOMES.get(item['failure'], item['failure'])}" if item["failure"] else ""))
+        return lines
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,85 +1,255 @@
-import urllib.request
 import time
 import subprocess
 import process_manager
+import probe_engine
+import launch_plan
+from test_history import network_key
 from executor import is_custom_list_valid
 import os
-import socket
 import traceback
 
+# Сколько ждать строки готовности winws, прежде чем проверять сайт "вслепую"
+READY_TIMEOUT = 8.0
+# Быстрый поиск пропускает профили, обход которых для TCP почти совпадает с уже неудачным
+SIMILARITY_SKIP = 0.9
+
 def check_connection(url, log_callback):
-    """Проверяет доступность URL."""
-    if not url.startswith('http'):
-        url = 'https://' + url
-    try:
-        log_callback(f"  -> Пробую соединиться с {url}...")
-        req = urllib.request.Request(url, headers={'User-Agent': 'Mozilla/5.0'})
-        urllib.request.urlopen(req, timeout=3).close()
-        return True
-    except socket.timeout:
-        log_callback("  -> Соединение не удалось: Timeout")
-        return False
-    except Exception as e:
-        err_str = str(e)
-        if len(err_str) > 100: err_str = err_str[:100] + "..."
-        log_callback(f"  -> Соединение не удалось: {err_str}")
+    """Проверяет доступность одного URL."""
+    endpoint = probe_engine.parse_endpoint(url)
+    if endpoint is None:
+        log_callback(f"  -> Некорректный адрес: {url}")
         return False
+    log_callback(f"  -> Пробую соединиться с {probe_engine.endpoint_label(endpoint)}...")
+    result = probe_engine.probe(endpoint)
+    if not result.ok:
+        log_callback(f"  -> Соединение не удалось: {_describe_failure(result)}")
+    return result.ok
+
+def _describe_failure(result):
+    phases = ", ".join(f"{name} {seconds * 1000:.0f} мс" for name, seconds in (result.phases or {}).items())
+    text = f"{probe_engine.OUTCOMES.get(result.outcome, result.outcome)} ({result.error})"
+    return f"{text} [{phases}]" if phases else text
+
+def probe_endpoints(engine, endpoints, log_callback):
+    """Параллельно проверяет адреса, пишет в лог неудачные и возвращает (результаты, сводка)."""
+    results = engine.run(endpoints)
+    summary = probe_engine.summarize(results)
+    for result in results:
+        if not result.ok:
+            log_callback(f"  -> {probe_engine.endpoint_label(result.endpoint)}: {_describe_failure(result)}")
+    failures = ", ".join(f"{outcome} x{count}" for outcome, count in summary["outcomes"].most_common()
+                         if outcome not in probe_engine.REACHED_OUTCOMES)
+    log_callback(f"  -> Доступно {summary['ok']}/{summary['total']}"
+                 + (f", задержка p50 {summary['p50'] * 1000:.0f} мс, p90 {summary['p90'] * 1000:.0f} мс" if summary['ok'] else "")
+                 + (f"; неудачи: {failures}" if failures else "")
+                 + (f"; ответов с HTTP-ошибкой: {summary['http_errors']} (запрос прошел DPI, считается успехом)" if summary['http_errors'] else ""))
+    return results, summary
+
+def _split_baseline(baseline, log_callback):
+    """
+    Делит адреса по результату проверки без обхода. Тестировать профили имеет смысл
+    только для адресов, сорвавшихся после установки TCP-соединения (DPI_OUTCOMES):
+    DNS и блокировку IP профиль обхода не исправит.
+    Возвращает список адресов для теста.
+    """
+    reasons = {}
+    testable = []
+    for result in baseline:
+        if result.outcome == "http_error":
+            reasons.setdefault("отвечают без обхода HTTP-ошибкой сервера - это не блокировка DPI", []).append(result.endpoint.host)
+        elif result.ok:
+            reasons.setdefault("доступны без обхода", []).append(result.endpoint.host)
+        elif result.outcome in probe_engine.DPI_OUTCOMES:
+            testable.append(result.endpoint)
+        elif result.outcome in probe_engine.ENVIRONMENT_OUTCOMES:
+            reasons.setdefault("DNS или сеть не работают - обход не поможет (попробуйте обновить hosts-файл)", []).append(result.endpoint.host)
+        else:
+            reasons.setdefault("блокировка по IP (TCP-соединение не устанавливается) - обход не поможет", []).append(result.endpoint.host)
+    for reason, hosts in reasons.items():
+        log_callback(f"  Не участвуют в тесте, {reason}: {', '.join(hosts)}")
+    return testable
+
+def _environment_broken(results):
+    """True, если все пробы сорвались из-за DNS или сети: следующие профили проверять бессмысленно."""
+    return bool(results) and all(r.outcome in probe_engine.ENVIRONMENT_OUTCOMES for r in results)
+
+def _probe_status(summary):
+    if summary["ok"] == summary["total"]:
+        return "УСПЕХ"
+    if summary["ok"]:
+        return f"Частично {summary['ok']}/{summary['total']}"
+    return "Неудача"
+
+def _start_and_wait_ready(profile, base_dir, game_filter_enabled, log_callback, list_to_use):
+    """
+    Запускает тестовый winws и ждет его готовности по stdout вместо фиксированной паузы.
+    Возвращает (process, timings, ошибка); timings - словарь spawn/ready в секундах.
+    """
+    timings = {}
+    t0 = time.perf_counter()
+    process = process_manager.start_process(profile, base_dir, game_filter_enabled, log_callback, list_to_use, False,
+                                            capture_output=True)
+    timings["spawn"] = time.perf_counter() - t0
+    if not process:
+        return None, timings, "ОШИБКА ЗАПУСКА"
+    t0 = time.perf_counter()
+    ready = process_manager.wait_process_ready(process, READY_TIMEOUT)
+    timings["ready"] = time.perf_counter() - t0
+    if ready is None:
+        if process.poll() is not None:
+            return process, timings, f"ПРОЦЕСС ЗАВЕРШИЛСЯ (код {process.returncode})"
+        # Нет строки готовности (другая версия winws?) - проверяем как есть
+        log_callback(f"  -> winws не сообщил о готовности за {READY_TIMEOUT:.0f} с, проверяю без подтверждения")
+    return process, timings, None
+
+def _stop_test_process(process, timings):
+    # Тестовый процесс и возможные остатки winws останавливаются вместе, ожидание - до их выхода
+    t0 = time.perf_counter()
+    process_manager.stop_all_processes(lambda msg: None, extra_pids=[process.pid] if process else [])
+    timings["teardown"] = time.perf_counter() - t0
+
+def _log_probe_report(summaries, log_callback):
+    log_callback(f"  {'Профиль':<30} : доступно | p50, мс | p90, мс")
+    for name, summary in summaries.items():
+        p50 = f"{summary['p50'] * 1000:7.0f}" if summary["p50"] is not None else "      -"
+        p90 = f"{summary['p90'] * 1000:7.0f}" if summary["p90"] is not None else "      -"
+        log_callback(f"  {name:<30} : {summary['ratio'] * 100:6.0f}% | {p50} | {p90}")
+
+def _log_timings_report(results, timings, log_callback):
+    log_callback(f"  {'Профиль':<30} : {'Результат':<14} | запуск | готов | проверка | останов | всего (с)")
+    for name, status in results.items():
+        t = timings.get(name, {})
+        parts = [t.get(key) for key in ("spawn", "ready", "probe", "teardown")]
+        total = sum(v for v in parts if v is not None)
+        cells = " | ".join(f"{v:6.2f}" if v is not None else "     -" for v in parts)
+        log_callback(f"  {name:<30} : {status:<14} | {cells} | {total:6.2f}")
+    grand = sum(v for t in timings.values() for v in t.values())
+    log_callback(f"  Всего на переключение и проверки: {grand:.1f} с")
+
+def order_profiles(profiles, history, network, domains):
+    """Профили по убыванию оценки успеха из истории; при равенстве - в исходном порядке."""
+    if history is None:
+        return list(profiles)
+    scores = history.scores(network, domains, profiles)
+    return sorted(profiles, key=lambda p: -scores[p['name']])
+
+def _similar_failed(features, failed):
+    """(имя, сходство) неудачного профиля, почти совпадающего по обходу, или None."""
+    for name, other in failed:
+        similarity = launch_plan.profile_similarity(features, other)
+        if similarity >= SIMILARITY_SKIP:
+            return name, similarity
+    return None
 
-def run_site_test(domain, profiles, base_dir, game_filter_enabled, log_callback, custom_list_path=None):
-    """Запускает автоматический тест доступности сайта по всем профилям."""
+def run_site_test(targets, profiles, base_dir, game_filter_enabled, log_callback, custom_list_path=None, sample_count=0,
+                  history=None, adaptive=False, stop_after=1):
+    """
+    Запускает автоматический тест доступности сайтов по всем профилям.
+    targets - адреса через пробел или запятую; sample_count - сколько случайных
+    доменов кастомного списка проверить дополнительно. Все адреса проверяются параллельно.
+    history - TestHistory для записи результатов; adaptive - быстрый поиск: профили
+    по истории успехов, пропуск почти одинаковых с неудачными, остановка после
+    stop_after полностью успешных профилей.
+    """
+    engine = probe_engine.ProbeEngine()
     try:
         log_callback("\n" + "="*40)
-        log_callback(f"--- Автоматический тест по сайту: {domain} ---")
+        log_callback(f"--- Автоматический тест по сайтам: {targets} ---")
+        
+        list_to_use = None
+        if custom_list_path and is_custom_list_valid(custom_list_path):
+            list_to_use = custom_list_path
+        
+        endpoints = probe_engine.parse_endpoints(targets)
+        if list_to_use and sample_count:
+            known = {endpoint.host for endpoint in endpoints}
+            endpoints += [e for e in probe_engine.sample_endpoints(list_to_use, sample_count) if e.host not in known]
+        if not endpoints:
+            log_callback("[!] Не задано ни одного адреса для проверки.")
+            log_callback("="*40 + "\n")
+            return
         
         process_manager.stop_all_processes(log_callback)
         
-        log_callback("\nШаг 1: Проверка доступности сайта БЕЗ обхода...")
-        if check_connection(domain, log_callback):
-            log_callback("\n[!] Сайт доступен без обхода. Тестирование не имеет смысла.")
+        log_callback(f"\nШаг 1: Проверка доступности {len(endpoints)} адресов БЕЗ обхода...")
+        baseline, _ = probe_endpoints(engine, endpoints, log_callback)
+        endpoints = _split_baseline(baseline, log_callback)
+        if not endpoints:
+            log_callback("\n[!] Нет адресов, заблокированных по DPI. Тестирование профилей не имеет смысла.")
             log_callback("="*40 + "\n")
             return
-        log_callback("[+] Отлично, сайт заблокирован. Начинаем тестирование профилей.\n")
+        log_callback(f"[+] Заблокировано адресов: {len(endpoints)}. Начинаем тестирование профилей.\n")
         
         results = {}
+        timings = {}
+        summaries = {}
+        network = network_key()
+        domains = [e.host for e in endpoints]
         
-        list_to_use = None
-        if custom_list_path and is_custom_list_valid(custom_list_path):
-            list_to_use = custom_list_path
+        if adaptive:
+            profiles = order_profiles(profiles, history, network, domains)
+            log_callback(f"Быстрый поиск (сеть {network}): до {stop_after} рабочих профилей, порядок по истории.\n")
+        failed = []
+        found = 0
         
         for i, profile in enumerate(profiles):
+            if adaptive:
+                features = launch_plan.profile_features(profile, "tcp")
+                similar = _similar_failed(features, failed)
+                if similar:
+                    results[profile['name']] = "Пропущен"
+                    log_callback(f"--- Пропуск {i+1}/{len(profiles)}: \"{profile['name']}\" - почти совпадает "
+                                 f"с неудачным \"{similar[0]}\" ({similar[1] * 100:.0f}%) ---")
+                    continue
             log_callback(f"--- Тест {i+1}/{len(profiles)}: \"{profile['name']}\" ---")
             
-            # Если start_process не найден, здесь возникнет ошибка, которую мы теперь поймаем
-            process = process_manager.start_process(profile, base_dir, game_filter_enabled, log_callback, list_to_use, False)
+            # Проверка начинается сразу после того, как winws сообщил о начале захвата
+            process, t, error = _start_and_wait_ready(profile, base_dir, game_filter_enabled, log_callback, list_to_use)
+            timings[profile['name']] = t
             
-            if process:
-                time.sleep(4) 
-                is_success = check_connection(domain, log_callback)
-                results[profile['name']] = "УСПЕХ" if is_success else "Неудача"
-                try:
-                    process.terminate()
-                    process.wait(timeout=2)
-                except:
-                    process.kill()
+            if error:
+                results[profile['name']] = error
             else:
-                results[profile['name']] = "ОШИБКА ЗАПУСКА"
+                t0 = time.perf_counter()
+                probe_results, summary = probe_endpoints(engine, endpoints, log_callback)
+                t["probe"] = time.perf_counter() - t0
+                summaries[profile['name']] = summary
+                results[profile['name']] = _probe_status(summary)
+                if history is not None:
+                    history.record_probes(network, profile, probe_results)
                 
             log_callback(f"  Результат: {results[profile['name']]}\n")
-            process_manager.stop_all_processes(lambda msg: None) 
-            time.sleep(1)
+            _stop_test_process(process, t)
+            
+            if not error and _environment_broken(probe_results):
+                log_callback("[!] Все проверки сорвались на DNS или сети - проблема не в профиле. Тест прерван.\n")
+                break
+            
+            if adaptive:
+                if not error and summaries[profile['name']]["ok"] == summaries[profile['name']]["total"]:
+                    found += 1
+                    if found >= stop_after:
+                        log_callback(f"Найдено рабочих профилей: {found}, остальные не проверяются.\n")
+                        break
+                elif not error and not summaries[profile['name']]["ok"]:
+                    failed.append((profile['name'], features))
             
         log_callback("="*40)
         log_callback("--- РЕЗУЛЬТАТЫ АВТОМАТИЧЕСКОГО ТЕСТА ---")
-        for name, status in results.items():
-            log_callback(f"  {name:<30} : {status}")
+        _log_timings_report(results, timings, log_callback)
+        if summaries:
+            log_callback("")
+            _log_probe_report(summaries, log_callback)
         log_callback("="*40 + "\n")
 
     except Exception as e:
         error_info = traceback.format_exc()
         log_callback(f"КРИТИЧЕСКАЯ ОШИБКА В ТЕСТЕ:\n{error_info}")
         process_manager.stop_all_processes(lambda msg: None)
+    finally:
+        engine.close()
 
-def run_discord_test(profiles, base_dir, game_filter_enabled, log_callback, ask_user_callback, custom_list_path=None):
+def run_discord_test(profiles, base_dir, game_filter_enabled, log_callback, ask_user_callback, custom_list_path=None, history=None):
     """Запускает интерактивный тест для Discord."""
     try:
         log_callback("\n" + "="*40)
@@ -92,6 +262,8 @@ def run_discord_test(profiles, base_dir, game_filter_enabled, log_callback, ask_
         process_manager.stop_all_processes(log_callback)
         
         results = {}
+        timings = {}
+        network = network_key()
         
         list_to_use = None
         if custom_list_path and is_custom_list_valid(custom_list_path):
@@ -99,27 +271,26 @@ def run_discord_test(profiles, base_dir, game_filter_enabled, log_callback, ask_
         
         for i, profile in enumerate(profiles):
             log_callback(f"--- Тест {i+1}/{len(profiles)}: \"{profile['name']}\" ---")
-            process = process_manager.start_process(profile, base_dir, game_filter_enabled, log_callback, list_to_use, False)
+            # Вопрос пользователю задается только когда winws уже обрабатывает трафик
+            process, t, error = _start_and_wait_ready(profile, base_dir, game_filter_enabled, log_callback, list_to_use)
+            timings[profile['name']] = t
             
-            if process:
+            if error:
+                results[profile['name']] = error
+            else:
+                t0 = time.perf_counter()
                 user_response = ask_user_callback(profile['name'])
+                t["probe"] = time.perf_counter() - t0
                 results[profile['name']] = "УСПЕХ" if user_response else "Неудача"
-                try:
-                    process.terminate()
-                    process.wait(timeout=2)
-                except:
-                    process.kill()
-            else:
-                results[profile['name']] = "ОШИБКА ЗАПУСКА"
+                if history is not None:
+                    history.record(network, "discord", "discord", profile, user_response)
                 
             log_callback(f"  Результат: {results[profile['name']]}\n")
-            process_manager.stop_all_processes(lambda msg: None) 
-            time.sleep(1)
+            _stop_test_process(process, t)
             
         log_callback("="*40)
         log_callback("--- РЕЗУЛЬТАТЫ ИНТЕРАКТИВНОГО ТЕСТА ---")
-        for name, status in results.items():
-            log_callback(f"  {name:<30} : {status}")
+        _log_timings_report(results, timings, log_callback)
         log_callback("="*40 + "\n")
 
     except Exception as e:
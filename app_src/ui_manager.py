@@ -7,9 +7,12 @@ import glob
 import threading
 import requests
 import json
+import collections
 import webbrowser
 from text_utils import setup_text_widget_bindings
+from log_buffer import LogBuffer, MIN_LOG_CAPACITY
 import ip_grabber
+import section_stats_window
 
 class UIManager:
     """Класс для управления пользовательским интерфейсом"""
@@ -23,7 +26,9 @@ class UIManager:
         self.list_widgets = {} 
         self.scroll_frame_inner = None
         
-        self.all_logs = []
+        # Последние записи лога (кольцевой буфер) и число строк окна на каждую показанную запись
+        self.log_buffer = LogBuffer()
+        self._shown_line_counts = collections.deque()
         self.btn_start_all = None
         self.btn_stop_all = None
         self.lbl_custom_list_path = None
@@ -146,6 +151,8 @@ class UIManager:
         ttk.Checkbutton(log_tools, text="Статус", variable=self.show_status_logs, command=self.update_log_filter).pack(side=tk.LEFT, padx=5)
         
         ttk.Button(log_tools, text="Сохранить", command=self.save_logs_to_file).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(log_tools, text="Секции winws", command=self.open_section_stats).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(log_tools, text="Ресурсы...", command=self.app.export_resource_samples).pack(side=tk.RIGHT, padx=5)
         ttk.Button(log_tools, text="Очистить", command=self.clear_all_logs).pack(side=tk.RIGHT, padx=5)
         
         # Окно логов
@@ -237,11 +244,13 @@ class UIManager:
         new_profile = combo_widget.get()
         self.app.list_manager.set_profile_for_list(list_filename, new_profile)
         self.app.save_app_settings()
+        self.app.on_config_changed()
 
     def _on_ipset_change(self, list_filename, combo_widget):
         new_ipset = combo_widget.get()
         self.app.list_manager.set_ipset_for_list(list_filename, new_ipset)
         self.app.save_app_settings()
+        self.app.on_config_changed()
 
     def update_process_status_in_table(self, list_filename, is_running, pid=None):
         widgets = self.list_widgets.get(list_filename)
@@ -253,6 +262,13 @@ class UIManager:
                 widgets["status_lbl"].config(text="Остановлен", fg="#999999")
                 widgets["pid_lbl"].config(text="-")
 
+    def mark_lists_stale(self, list_filenames):
+        """Помечает списки, изменения которых не применены в запущенном процессе."""
+        for list_filename in list_filenames:
+            widgets = self.list_widgets.get(list_filename)
+            if widgets:
+                widgets["status_lbl"].config(text="ИЗМЕНЕН", fg="#fd7e14")
+
     def update_buttons_state(self, is_running):
         """Обновляет состояние кнопок запуска/остановки"""
         # ИЗМЕНЕНИЕ: Кнопка СТОП теперь всегда доступна, чтобы можно было принудительно убить процессы
@@ -293,6 +309,37 @@ class UIManager:
         self.app.game_filter_var = tk.BooleanVar()
         self.app.game_filter_check = ttk.Checkbutton(settings_frame, text="Игровой фильтр (применять ко всем новым запускам)", variable=self.app.game_filter_var)
         self.app.game_filter_check.pack(anchor=tk.W, padx=5, pady=5)
+
+        self.app.hot_restart_var = tk.BooleanVar(value=True)
+        self.app.hot_restart_check = ttk.Checkbutton(settings_frame, text="Горячий перезапуск (новый процесс запускается до остановки старого)", variable=self.app.hot_restart_var)
+        self.app.hot_restart_check.pack(anchor=tk.W, padx=5, pady=5)
+
+        self.app.winws_debug_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(settings_frame, text="Отладочный вывод winws (счетчики пакетов по секциям, больше нагрузка)", variable=self.app.winws_debug_var).pack(anchor=tk.W, padx=5, pady=5)
+
+        shard_row = ttk.Frame(settings_frame)
+        shard_row.pack(anchor=tk.W, padx=5, pady=5)
+        ttk.Label(shard_row, text="Экземпляров winws (1 - один процесс; больше - деление по портам между ядрами):").pack(side=tk.LEFT)
+        self.app.shard_count_var = tk.IntVar(value=1)
+        ttk.Spinbox(shard_row, from_=1, to=8, width=4, textvariable=self.app.shard_count_var).pack(side=tk.LEFT, padx=5)
+
+        hits_frame = ttk.LabelFrame(settings_frame, text="Учет попаданий доменов")
+        hits_frame.pack(fill=tk.X, padx=5, pady=5)
+        self.app.hit_stats_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(hits_frame, text="Считать, какие домены списков реально используются (включает отладочный вывод winws)", variable=self.app.hit_stats_var).pack(anchor=tk.W, padx=5, pady=2)
+        prune_row = ttk.Frame(hits_frame)
+        prune_row.pack(fill=tk.X, padx=5, pady=2)
+        ttk.Label(prune_row, text="Без попаданий дней:").pack(side=tk.LEFT)
+        self.app.prune_days_var = tk.IntVar(value=30)
+        ttk.Spinbox(prune_row, from_=1, to=365, width=5, textvariable=self.app.prune_days_var).pack(side=tk.LEFT, padx=5)
+        ttk.Button(prune_row, text="🧹 Удалить неиспользуемые", command=self.app.hit_stats_prune).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(prune_row, text="📊 Отчет", command=self.app.hit_stats_report).pack(side=tk.RIGHT, padx=5)
+
+        log_capacity_frame = ttk.Frame(settings_frame)
+        log_capacity_frame.pack(anchor=tk.W, padx=5, pady=5)
+        ttk.Label(log_capacity_frame, text="Хранить в окне логов последних строк:").pack(side=tk.LEFT)
+        self.app.log_capacity_var = tk.IntVar(value=self.log_buffer.capacity)
+        ttk.Spinbox(log_capacity_frame, from_=MIN_LOG_CAPACITY, to=500000, increment=5000, width=8, textvariable=self.app.log_capacity_var).pack(side=tk.LEFT, padx=5)
         
         # Управление кастомным списком
         list_frame = ttk.LabelFrame(settings_frame, text="Кастомный список доменов")
@@ -321,6 +368,7 @@ class UIManager:
         
         ttk.Button(update_btns, text="📥 Обновить IPSet (GitHub)", command=self.app.update_ipset_list).pack(side=tk.LEFT, padx=5)
         ttk.Button(update_btns, text="📄 Скачать Hosts файл", command=self.app.update_hosts_file).pack(side=tk.LEFT, padx=5)
+        ttk.Button(update_btns, text="🗜 Сжать IPSet", command=self.app.slim_ipset).pack(side=tk.LEFT, padx=5)
         ttk.Button(update_btns, text="📂 Папка IPSet", command=self.app.open_ipset_folder).pack(side=tk.LEFT, padx=5)
         ttk.Button(update_btns, text="📂 Папка Hosts", command=self.app.open_hosts_folder).pack(side=tk.LEFT, padx=5)
         
@@ -338,7 +386,21 @@ class UIManager:
         self.app.site_test_url = tk.StringVar(value="rutracker.org")
         self.app.site_test_url_entry = ttk.Entry(site_test_sub, textvariable=self.app.site_test_url, width=30)
         self.app.site_test_url_entry.pack(side=tk.LEFT, padx=5)
+        ttk.Label(site_test_sub, text="+ доменов из списка:").pack(side=tk.LEFT, padx=(5, 0))
+        self.app.probe_sample_var = tk.IntVar(value=0)
+        ttk.Spinbox(site_test_sub, from_=0, to=50, width=4, textvariable=self.app.probe_sample_var).pack(side=tk.LEFT, padx=5)
         ttk.Button(site_test_sub, text="Начать тест", command=self.app.run_site_test).pack(side=tk.LEFT, padx=5)
+        ttk.Button(site_test_sub, text="История", command=self.app.show_test_history).pack(side=tk.LEFT, padx=5)
+        adaptive_sub = ttk.Frame(testing_frame)
+        adaptive_sub.pack(fill=tk.X, pady=(0, 5))
+        self.app.adaptive_test_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(adaptive_sub, text="Быстрый поиск: сначала профили, работавшие в этой сети; остановиться после",
+                        variable=self.app.adaptive_test_var).pack(side=tk.LEFT, padx=5)
+        self.app.stop_after_var = tk.IntVar(value=1)
+        ttk.Spinbox(adaptive_sub, from_=1, to=20, width=4, textvariable=self.app.stop_after_var).pack(side=tk.LEFT)
+        ttk.Label(adaptive_sub, text="рабочих").pack(side=tk.LEFT, padx=5)
+        ttk.Label(testing_frame, text="Можно указать несколько адресов через пробел или запятую; случайные домены берутся из кастомного списка. Все адреса проверяются одновременно.",
+                  foreground="gray", font=("Segoe UI", 8)).pack(anchor=tk.W, padx=5)
         
         self.app.site_test_url_menu = tk.Menu(self.app.root, tearoff=0)
         self.app.site_test_url_menu.add_command(label="Вставить", command=self.app.paste_site_test_url)
@@ -401,26 +463,73 @@ class UIManager:
             self.refresh_lists_table # Коллбек для обновления списка файлов в таблице
         )
 
+    def _visible_log_types(self):
+        types = set()
+        if self.show_main_logs.get():
+            types.add("main")
+        if self.show_domain_logs.get():
+            types.add("domain")
+        if self.show_status_logs.get():
+            types.update(("status", "error", "success"))
+        return types
+
+    def append_logs(self, entries):
+        """Добавляет пакет записей: в окно дописываются только новые строки."""
+        evicted = self.log_buffer.extend(entries)
+        if not self.log_window: return
+        try:
+            types = self._visible_log_types()
+            chunk = []
+            for entry in entries:
+                if entry["type"] in types:
+                    chunk.append(entry["text"] + "\n")
+                    self._shown_line_counts.append(entry["text"].count("\n") + 1)
+            # Записи, вытесненные из буфера, убираем с начала окна
+            stale_lines = 0
+            for entry in evicted:
+                if entry["type"] in types and self._shown_line_counts:
+                    stale_lines += self._shown_line_counts.popleft()
+            if not chunk and not stale_lines:
+                return
+            self.log_window.config(state='normal')
+            if chunk:
+                self.log_window.insert(tk.END, "".join(chunk))
+            if stale_lines:
+                self.log_window.delete('1.0', f'{stale_lines + 1}.0')
+            self.log_window.config(state='disabled')
+            self.log_window.see(tk.END)
+        except:
+            pass
+
+    def open_section_stats(self):
+        """Открывает окно счетчиков секций текущего процесса winws"""
+        section_stats_window.show_section_stats(self.app.root, lambda: self.app.winws_parsers)
+
     def update_log_display(self):
+        """Полная перерисовка окна по буферу (при смене фильтра)."""
         if not self.log_window: return
         try:
+            entries = self.log_buffer.entries(self._visible_log_types())
+            self._shown_line_counts = collections.deque(entry["text"].count("\n") + 1 for entry in entries)
             self.log_window.config(state='normal')
             self.log_window.delete('1.0', tk.END)
-            for log_entry in self.all_logs:
-                if (log_entry["type"] == "main" and self.show_main_logs.get()) or \
-                   (log_entry["type"] == "domain" and self.show_domain_logs.get()) or \
-                   (log_entry["type"] in ["status", "error", "success"] and self.show_status_logs.get()):
-                    self.log_window.insert(tk.END, log_entry["text"] + "\n")
+            self.log_window.insert(tk.END, "".join(entry["text"] + "\n" for entry in entries))
             self.log_window.config(state='disabled')
             self.log_window.see(tk.END)
         except:
             pass
 
+    def set_log_capacity(self, capacity):
+        """Меняет размер буфера логов; лишние старые записи убираются и из окна."""
+        self.log_buffer.set_capacity(capacity)
+        self.update_log_display()
+
     def update_log_filter(self):
         self.update_log_display()
 
     def clear_all_logs(self):
-        self.all_logs.clear()
+        self.log_buffer.clear()
+        self._shown_line_counts.clear()
         if self.log_window:
             self.log_window.config(state='normal')
             self.log_window.delete('1.0', tk.END)
@@ -435,7 +544,7 @@ class UIManager:
             )
             if filename:
                 with open(filename, 'w', encoding='utf-8') as f:
-                    for log_entry in self.all_logs:
+                    for log_entry in self.log_buffer:
                         f.write(log_entry["text"] + "\n")
                 messagebox.showinfo("Успех", f"Логи сохранены.")
         except Exception as e:
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Разбор stdout winws в типизированные события и счетчики по секциям.
+
+winws нумерует профили (секции между --new) с 1 в порядке командной строки,
+профиль 0 - пакеты, не попавшие ни в одну секцию. Номер профиля совпадает
+с номером секции в LaunchPlan, поэтому счетчики привязываются к спискам.
+
+Типы событий:
+    startup  - версия, число профилей
+    ready    - фильтр WinDivert установлен, захват начат
+    list     - загружен hostlist/ipset (путь и число записей)
+    match    - пакет попал в профиль (только с --debug)
+    desync   - действие обхода над пакетом (только с --debug)
+    packet   - прочий поток отладки по пакетам
+    error    - ошибка
+    other    - все остальное
+
+Разбор рассчитан на поток --debug: самые частые строки распознаются
+проверкой префикса, регулярные выражения применяются только к редким.
+"""
+import os
+import re
+import csv
+import json
+import time
+import threading
+import collections
+
+WinwsEvent = collections.namedtuple("WinwsEvent", "kind profile data line")
+
+# События, которые не нужно выводить в окно логов построчно
+NOISE_KINDS = frozenset(("match", "desync", "packet"))
+
+_VERSION_RE = re.compile(r'^github version (\S+)')
+_PROFILES_RE = re.compile(r'^we have (\d+) user defined desync profile')
+_LOADING_RE = re.compile(r'^Loading (hostlist|ipset) (.+?)\s*$', re.IGNORECASE)
+_LOADED_RE = re.compile(r'^Loaded (\d+) (hosts|ip/subnets) from (.+?)\s*$', re.IGNORECASE)
+_MATCH_RE = re.compile(r'^desync profile (\d+)')
+_HOSTNAME_RE = re.compile(r"hostname='([^']*)'")
+_ERROR_RE = re.compile(r"error|could not|cannot|can't|invalid|failed|bad value|not found", re.IGNORECASE)
+
+# Префиксы построчного вывода --debug, которые не требуют разбора
+_PACKET_PREFIXES = ("packet:", "IP4:", "IP6:", "TCP:", "UDP:", "ICMP:", "conntrack", "dpi desync", "reasm", "TLS", "QUIC")
+# Строки о пакетах, которые winws отправляет при обходе (fake, части split и т.п.)
+_DESYNC_PREFIXES = ("sending ",)
+
+
+def _norm_path(path):
+    return os.path.normcase(os.path.normpath(path.strip().strip('"')))
+
+
+class SectionCounters:
+    __slots__ = ("profile", "matches", "actions", "last_host", "last_seen")
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.matches = 0
+        self.actions = 0
+        self.last_host = ""
+        self.last_seen = None
+
+
+class WinwsOutputParser:
+    """
+    Потоковый разбор вывода одного процесса winws. feed() вызывается из потока
+    чтения stdout, snapshot()/export() - из UI, поэтому счетчики под блокировкой.
+    """
+
+    def __init__(self, plan=None, max_errors=50):
+        self._lock = threading.Lock()
+        self.started_at = time.time()
+        self.version = None
+        self.profile_count = None
+        self.ready = False
+        # Передавать ли совпадения профилей в статистику попаданий доменов
+        self.track_hits = False
+        # Префикс строк в окне логов (при шардировании - номер экземпляра)
+        self.label = "winws"
+        self.lines = 0
+        self.kinds = collections.Counter()
+        self.errors = collections.deque(maxlen=max_errors)
+        # путь файла -> число загруженных записей
+        self.loaded = {}
+        self._sections = {}
+        self._current = None
+        self._last_host = ""
+        # номер секции -> (профиль, списки, файлы hostlist, файлы ipset)
+        self._plan_sections = {}
+        # номер секции -> кортеж полных путей исходных списков
+        self._section_lists = {}
+        if plan is not None:
+            self.set_plan(plan)
+
+    def set_plan(self, plan):
+        """Привязывает номера профилей winws к секциям плана запуска."""
+        sections = {}
+        for i, section in enumerate(plan.sections, 1):
+            hostlists, ipsets = [], []
+            for arg in section.args:
+                if arg.startswith('--hostlist='):
+                    hostlists.append(arg.split('=', 1)[1])
+                elif arg.startswith('--ipset='):
+                    ipsets.append(arg.split('=', 1)[1])
+            sections[i] = (section.profile_name, [os.path.basename(l) for l in section.lists], hostlists, ipsets)
+        section_lists = {i: tuple(section.lists) for i, section in enumerate(plan.sections, 1)}
+        with self._lock:
+            self._plan_sections = sections
+            self._section_lists = section_lists
+
+    def section_lists(self, profile):
+        """Пути исходных списков секции с номером профиля winws (пустой кортеж для 0)."""
+        return self._section_lists.get(profile, ())
+
+    def feed(self, line):
+        """Разбирает одну строку, обновляет счетчики и возвращает событие."""
+        with self._lock:
+            self.lines += 1
+            event = self._parse(line)
+            self.kinds[event.kind] += 1
+            return event
+
+    def _section(self, profile):
+        counters = self._sections.get(profile)
+        if counters is None:
+            counters = self._sections[profile] = SectionCounters(profile)
+        return counters
+
+    def _parse(self, line):
+        # Самый частый случай в режиме --debug
+        if line.startswith("desync profile"):
+            if line.startswith("desync profile search"):
+                match = _HOSTNAME_RE.search(line)
+                self._last_host = match.group(1) if match else ""
+                return WinwsEvent("packet", None, None, line)
+            match = _MATCH_RE.match(line)
+            if match:
+                profile = int(match.group(1))
+                counters = self._section(profile)
+                counters.matches += 1
+                counters.last_seen = time.time()
+                if self._last_host:
+                    counters.last_host = self._last_host
+                self._current = counters
+                return WinwsEvent("match", profile, self._last_host, line)
+        if line.startswith(_DESYNC_PREFIXES):
+            current = self._current
+            if current is not None:
+                current.actions += 1
+            return WinwsEvent("desync", current.profile if current else None, None, line)
+        if line.startswith(_PACKET_PREFIXES):
+            return WinwsEvent("packet", None, None, line)
+
+        if "windivert initialized" in line or "capture is started" in line:
+            self.ready = True
+            return WinwsEvent("ready", None, None, line)
+        match = _LOADED_RE.match(line)
+        if match:
+            path = match.group(3)
+            count = int(match.group(1))
+            self.loaded[_norm_path(path)] = count
+            kind = "ipset" if match.group(2).lower().startswith("ip") else "hostlist"
+            return WinwsEvent("list", None, {"kind": kind, "path": path, "count": count}, line)
+        if _LOADING_RE.match(line):
+            return WinwsEvent("list", None, None, line)
+        match = _VERSION_RE.match(line)
+        if match:
+            self.version = match.group(1)
+            return WinwsEvent("startup", None, {"version": self.version}, line)
+        match = _PROFILES_RE.match(line)
+        if match:
+            self.profile_count = int(match.group(1))
+            return WinwsEvent("startup", None, {"profiles": self.profile_count}, line)
+        if _ERROR_RE.search(line):
+            self.errors.append((time.strftime("%H:%M:%S"), line))
+            return WinwsEvent("error", None, None, line)
+        return WinwsEvent("other", None, None, line)
+
+    def _loaded_count(self, paths):
+        counts = [self.loaded.get(_norm_path(p)) for p in paths]
+        counts = [c for c in counts if c is not None]
+        return sum(counts) if counts else None
+
+    def snapshot(self):
+        """Строки для таблицы секций: по строке на секцию плана и на профиль 0."""
+        with self._lock:
+            rows = []
+            numbers = sorted(set(self._plan_sections) | set(self._sections) | {0})
+            for number in numbers:
+                counters = self._sections.get(number)
+                profile_name, lists, hostlists, ipsets = self._plan_sections.get(
+                    number, ("(без секции)" if number == 0 else "?", [], [], []))
+                rows.append({
+                    "section": number,
+                    "profile": profile_name,
+                    "lists": ", ".join(lists),
+                    "hosts": self._loaded_count(hostlists),
+                    "ips": self._loaded_count(ipsets),
+                    "matches": counters.matches if counters else 0,
+                    "actions": counters.actions if counters else 0,
+                    "last_host": counters.last_host if counters else "",
+                    "last_seen": time.strftime("%H:%M:%S", time.localtime(counters.last_seen)) if counters and counters.last_seen else "",
+                })
+            return rows
+
+    def summary(self):
+        with self._lock:
+            return {
+                "version": self.version,
+                "profiles": self.profile_count,
+                "ready": self.ready,
+                "lines": self.lines,
+                "kinds": dict(self.kinds),
+                "errors": list(self.errors),
+                "uptime": round(time.time() - self.started_at, 1),
+            }
+
+    def export(self, path):
+        """Сохраняет счетчики в JSON или CSV (по расширению файла)."""
+        return export_parsers([self], path)
+
+
+def export_parsers(parsers, path):
+    """
+    Счетчики нескольких экземпляров winws (шардов) в один JSON или CSV.
+    Возвращает число сохраненных строк секций.
+    """
+    rows = [dict(row, shard=parser.label) for parser in parsers for row in parser.snapshot()]
+    if path.lower().endswith(".csv"):
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["shard"] + [k for k in rows[0] if k != "shard"])
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "instances": [dict(parser.summary(), label=parser.label) for parser in parsers],
+                "sections": rows,
+            }, f, ensure_ascii=False, indent=2)
+    return len(rows)
@@ -0,0 +1,352 @@
+import os
+import sys
+import time
+import argparse
+
+# Модули приложения импортируются по плоским именам (как в main.py)
+APP_SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app_src")
+sys.path.insert(0, APP_SOURCE_DIR)
+
+
+def bench_launch_plan(args):
+    """Считает секции и байты аргументов winws для 1/5/20 списков на одном профиле."""
+    import launch_plan
+    from profiles import PROFILES
+
+    profile = next(p for p in PROFILES if p['name'] == "1.9.1 - General (ALT11)")
+    print(f"Профиль: {profile['name']}")
+    print(f"{'списков':>8} | {'секций (старо)':>15} | {'секций (план)':>14} | {'байт (старо)':>13} | {'байт (план)':>12} | {'мс':>6}")
+    for count in args.lists:
+        configs = [(f"C:/lists/list-{i}.txt", profile, None) for i in range(count)]
+        common = (configs, APP_SOURCE_DIR, False, "exclude/list-exclude-user.txt", "exclude/ipset-exclude-user.txt")
+        naive = launch_plan.compile_launch_plan(*common, optimize=False).stats()
+        t0 = time.perf_counter()
+        plan = launch_plan.compile_launch_plan(*common).stats()
+        elapsed = (time.perf_counter() - t0) * 1000
+        print(f"{count:>8} | {naive['sections']:>15} | {plan['sections']:>14} | {naive['arg_bytes']:>13} | {plan['arg_bytes']:>12} | {elapsed:>6.2f}")
+
+
+def bench_ipset_index(args):
+    """Сборка индекса из N случайных префиксов и M точечных проверок (одиночных и пакетом)."""
+    import random
+    import ipset_index
+
+    rnd = random.Random(42)
+    lines = []
+    for _ in range(args.prefixes):
+        prefix = rnd.choice((16, 20, 22, 24, 24, 24, 32))
+        addr = rnd.getrandbits(32) & ~((1 << (32 - prefix)) - 1)
+        lines.append(f"{addr >> 24}.{(addr >> 16) & 255}.{(addr >> 8) & 255}.{addr & 255}/{prefix}")
+    ips = [f"{rnd.randrange(1, 224)}.{rnd.randrange(256)}.{rnd.randrange(256)}.{rnd.randrange(256)}" for _ in range(args.lookups)]
+
+    t0 = time.perf_counter()
+    index = ipset_index.IPSetIndex({"bench": ipset_index.IntervalSet.from_lines(lines)})
+    t_build = time.perf_counter() - t0
+    print(f"Префиксов: {args.prefixes}, интервалов после слияния: {index.union.interval_count()}, сборка: {t_build:.2f} с")
+
+    sample = ips[:min(len(ips), 100000)]
+    t0 = time.perf_counter()
+    single_hits = sum(1 for ip in sample if index.contains(ip))
+    t_single = time.perf_counter() - t0
+    print(f"contains() x{len(sample)}: {t_single:.2f} с ({t_single / len(sample) * 1e6:.2f} мкс/адрес), попаданий: {single_hits}")
+
+    t0 = time.perf_counter()
+    hits = sum(index.contains_many(ips))
+    t_batch = time.perf_counter() - t0
+    print(f"contains_many() x{len(ips)}: {t_batch:.2f} с ({t_batch / len(ips) * 1e6:.2f} мкс/адрес), попаданий: {hits}")
+
+
+def bench_domain_trie(args):
+    """Вставка, проверка покрытия и свертка синтетического списка доменов."""
+    import random
+    import psutil
+    from domain_trie import DomainTrie
+
+    rnd = random.Random(42)
+    tlds = ("com", "net", "org", "ru", "io")
+    sites = [f"site{i}.{rnd.choice(tlds)}" for i in range(max(args.domains // 20, 1))]
+    domains = []
+    for _ in range(args.domains):
+        site = rnd.choice(sites)
+        depth = rnd.choice((0, 1, 1, 2, 2, 3))
+        labels = [f"n{rnd.randrange(1000)}" for _ in range(depth)]
+        domains.append(".".join(labels + [site]))
+    probes = [d if rnd.random() < 0.5 else f"x{rnd.randrange(10**6)}.{rnd.choice(sites)}" for d in rnd.sample(domains, min(len(domains), 200000))]
+
+    rss_before = psutil.Process().memory_info().rss
+    t0 = time.perf_counter()
+    trie = DomainTrie(domains)
+    t_insert = time.perf_counter() - t0
+    rss_after = psutil.Process().memory_info().rss
+    print(f"Доменов: {len(domains)}, уникальных: {len(set(domains))}, в дереве после свертки: {len(trie)}")
+    print(f"insert: {t_insert:.2f} с ({t_insert / len(domains) * 1e6:.2f} мкс/домен), память: +{(rss_after - rss_before) / 1024 / 1024:.1f} МБ")
+
+    t0 = time.perf_counter()
+    hits = sum(1 for d in probes if trie.covers(d))
+    t_covers = time.perf_counter() - t0
+    print(f"covers x{len(probes)}: {t_covers:.2f} с ({t_covers / len(probes) * 1e6:.2f} мкс/проверка), покрыто: {hits}")
+
+    t0 = time.perf_counter()
+    minimal = trie.minimize()
+    print(f"minimize: {time.perf_counter() - t0:.2f} с, записей: {len(minimal)}")
+
+
+def _legacy_extract_domain(url):
+    """Прежняя реализация (urlparse + re на каждый URL) - для сравнения."""
+    import re
+    from urllib.parse import urlparse
+    if not url.startswith(('http://', 'https://', '//')) and '://' not in url:
+        url = 'http://' + url
+    domain = urlparse(url).netloc.lower()
+    if not domain:
+        match = re.search(r'([a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}', url)
+        if not match:
+            return None
+        domain = match.group(0).lower()
+    domain = domain.split(':')[0]
+    if domain.startswith('www.'):
+        domain = domain[4:]
+    if re.match(r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$', domain) or '.' not in domain or len(domain) < 4:
+        return None
+    return domain if re.match(r'^[a-z0-9\-\.]+$', domain) else None
+
+
+def _legacy_extract_text(text, patterns):
+    import re
+    domains = set()
+    for pattern in patterns:
+        for match in re.findall(pattern, text, re.IGNORECASE):
+            domain = _legacy_extract_domain(match)
+            if domain:
+                domains.add(domain)
+    return domains
+
+
+def bench_domain_extract(args):
+    """Извлечение доменов из синтетических HTML/JS страниц размером N МБ и из пачки URL логов."""
+    import random
+    import domain_extract
+
+    rnd = random.Random(42)
+    hosts = [f"{rnd.choice(('cdn', 'api', 'static', 'img'))}{i}.site{i % 500}.{rnd.choice(('com', 'net', 'ru'))}" for i in range(5000)]
+    html_parts, js_parts, size = [], [], 0
+    while size < args.page_mb * 1024 * 1024:
+        host = rnd.choice(hosts)
+        html = f'<div class="x"><img src="https://{host}/a/{rnd.randrange(10**6)}.png" alt="pic"><a href="/local/{size}">text</a></div>\n'
+        js = f'var u{size}="https://{host}/v1/q?x={size}";fetch("//{rnd.choice(hosts)}/p");var pad="{"z" * 60}";\n'
+        html_parts.append(html)
+        js_parts.append(js)
+        size += len(html)
+    html_text, js_text = "".join(html_parts), "".join(js_parts)
+    urls = [f"https://{rnd.choice(hosts)}/r/{i}?q={i}" for i in range(args.urls)]
+
+    legacy_html = [r'src=["\']https?://([^"\']+)["\']', r'href=["\']https?://([^"\']+)["\']', r'action=["\']https?://([^"\']+)["\']']
+    legacy_js = [r'["\']https?://([^"\']+)["\']', r'["\']//([^"\']+)["\']', r'api\s*:\s*["\']https?://([^"\']+)["\']']
+    cases = [
+        (f"HTML {len(html_text) / 1024 / 1024:.1f} МБ", lambda: _legacy_extract_text(html_text, legacy_html), lambda: domain_extract.extract_domains_from_html(html_text)),
+        (f"JS {len(js_text) / 1024 / 1024:.1f} МБ", lambda: _legacy_extract_text(js_text, legacy_js), lambda: domain_extract.extract_domains_from_js(js_text)),
+        (f"URL x{len(urls)}", lambda: {d for d in map(_legacy_extract_domain, urls) if d}, lambda: domain_extract.extract_many(urls)),
+    ]
+    print(f"{'вход':>14} | {'старо, с':>9} | {'новое, с':>9} | {'доменов':>8}")
+    for name, legacy, current in cases:
+        domain_extract.normalize_host.cache_clear()
+        t0 = time.perf_counter()
+        old = legacy()
+        t_old = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        new = current()
+        t_new = time.perf_counter() - t0
+        mark = "" if old == new else f" (старо: {len(old)})"
+        print(f"{name:>14} | {t_old:>9.2f} | {t_new:>9.2f} | {len(new):>8}{mark}")
+
+
+class _MemoryText:
+    """Замена tk.Text без дисплея: хранит строки и считает объем вставленного текста."""
+
+    def __init__(self):
+        self.lines = []
+        self.inserted_chars = 0
+
+    def config(self, **kwargs):
+        pass
+
+    def see(self, index):
+        pass
+
+    def insert(self, index, text):
+        self.inserted_chars += len(text)
+        self.lines.extend(text.splitlines())
+
+    def delete(self, start, end):
+        if end == "end":
+            self.lines.clear()
+        else:
+            del self.lines[:int(end.split('.')[0]) - 1]
+
+
+def _log_text_widget():
+    """Настоящий tk.Text, если есть дисплей, иначе _MemoryText."""
+    import tkinter as tk
+    try:
+        root = tk.Tk()
+        root.withdraw()
+        return tk.Text(root), "tk.Text"
+    except tk.TclError:
+        return _MemoryText(), "без дисплея"
+
+
+def bench_log_view(args):
+    """Поступление N строк лога пакетами по --batch: полная перерисовка против дописывания в кольцевой буфер."""
+    import types
+    import tkinter as tk
+    from ui_manager import UIManager
+
+    entries = []
+    for i in range(args.log_lines):
+        log_type = ("main", "main", "main", "domain", "status")[i % 5]
+        entries.append({"text": f"[12:00:00] [winws] line {i} " + "x" * 40, "type": log_type})
+    batches = [entries[i:i + args.batch] for i in range(0, len(entries), args.batch)]
+
+    def make_ui(capacity):
+        ui = UIManager(types.SimpleNamespace())
+        ui.log_window, widget_name = _log_text_widget()
+        for name in ("show_main_logs", "show_domain_logs", "show_status_logs"):
+            setattr(ui, name, types.SimpleNamespace(get=lambda: True))
+        ui.set_log_capacity(capacity)
+        return ui, widget_name
+
+    # Старый путь: весь список заново на каждый пакет. Квадратичный, поэтому только начало потока
+    legacy_batches = batches[:max(1, args.legacy_lines // args.batch)]
+    legacy_ui, widget_name = make_ui(args.log_lines)
+    all_logs = []
+    t0 = time.perf_counter()
+    for batch in legacy_batches:
+        all_logs.extend(batch)
+        legacy_ui.log_window.config(state='normal')
+        legacy_ui.log_window.delete('1.0', tk.END)
+        for log_entry in all_logs:
+            legacy_ui.log_window.insert(tk.END, log_entry["text"] + "\n")
+        legacy_ui.log_window.config(state='disabled')
+    t_legacy = time.perf_counter() - t0
+    legacy_lines = sum(len(b) for b in legacy_batches)
+
+    ui, _ = make_ui(args.capacity)
+    t0 = time.perf_counter()
+    for batch in batches:
+        ui.append_logs(batch)
+    t_new = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    ui.update_log_filter()
+    t_filter = time.perf_counter() - t0
+
+    print(f"Виджет: {widget_name}, пакет: {args.batch} строк, буфер: {ui.log_buffer.capacity}")
+    print(f"Полная перерисовка: {legacy_lines} строк за {t_legacy:.2f} с ({t_legacy / legacy_lines * 1e6:.1f} мкс/строка)")
+    print(f"Дописывание: {len(entries)} строк за {t_new:.2f} с ({t_new / len(entries) * 1e6:.1f} мкс/строка), "
+          f"в буфере {len(ui.log_buffer)}, вытеснено {ui.log_buffer.evicted}")
+    print(f"Перерисовка при смене фильтра: {t_filter * 1000:.1f} мс")
+
+
+def bench_winws_parser(args):
+    """Разбор синтетического потока winws --debug: строк в секунду и счетчики секций."""
+    import random
+    import winws_parser
+
+    rnd = random.Random(42)
+    lines = [
+        "github version v70.5",
+        "we have 3 user defined desync profile(s) and default low priority profile 0",
+        "Loading hostlist C:/dpi/lists/list-general.txt",
+        "Loaded 1534 hosts from C:/dpi/lists/list-general.txt",
+        "Loading ipset C:/dpi/lists/ipset-all.txt",
+        "Loaded 20231 ip/subnets from C:/dpi/lists/ipset-all.txt",
+        "windivert initialized. capture is started.",
+    ]
+    while len(lines) < args.winws_lines:
+        profile = rnd.choice((0, 1, 1, 2, 3))
+        host = f"host{rnd.randrange(1000)}.example.com"
+        lines.append(f"packet: id={len(lines)} len=1400")
+        lines.append(f"IP4: 10.0.0.2 => 142.250.{rnd.randrange(256)}.{rnd.randrange(256)} proto=tcp ttl=64 sport=50000 dport=443")
+        lines.append(f"desync profile search for tcp ip1=10.0.0.2 port1=50000 ip2=142.250.1.1 port2=443 l7proto=tls ssid='' hostname='{host}'")
+        lines.append(f"desync profile {profile} matches")
+        if profile:
+            lines.append("dpi desync src=10.0.0.2:50000 dst=142.250.1.1:443")
+            lines.append("sending fake request : 517 bytes")
+            lines.append("sending multisplit part 1 len=1 : 16 03 01")
+    lines = lines[:args.winws_lines]
+
+    parser = winws_parser.WinwsOutputParser()
+    t0 = time.perf_counter()
+    for line in lines:
+        parser.feed(line)
+    elapsed = time.perf_counter() - t0
+    print(f"Строк: {len(lines)} за {elapsed:.2f} с ({len(lines) / elapsed:,.0f} строк/с, {elapsed / len(lines) * 1e6:.2f} мкс/строка)")
+    print(f"События: {parser.summary()['kinds']}")
+    for row in parser.snapshot():
+        print(f"  #{row['section']}: пакетов {row['matches']}, действий {row['actions']}, последний домен {row['last_host']}")
+
+
+def bench_probe(args):
+    """Проверка N адресов локального сервера с задержкой ответа: по очереди против ProbeEngine."""
+    import socketserver
+    import threading
+    import probe_engine
+
+    delay = args.probe_delay / 1000.0
+
+    class SlowHandler(socketserver.BaseRequestHandler):
+        def handle(self):
+            self.request.recv(1024)
+            time.sleep(delay)
+            self.request.sendall(b"HTTP/1.1 200 OK\r\nContent-Length: 0\r\n\r\n")
+
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SlowHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    endpoints = [probe_engine.Endpoint("127.0.0.1", port, False, f"/{i}") for i in range(args.endpoints)]
+    try:
+        t0 = time.perf_counter()
+        sequential = [probe_engine.probe(e) for e in endpoints]
+        seq_time = time.perf_counter() - t0
+        with probe_engine.ProbeEngine() as engine:
+            t0 = time.perf_counter()
+            results = engine.run(endpoints)
+            par_time = time.perf_counter() - t0
+    finally:
+        server.shutdown()
+    summary = probe_engine.summarize(results)
+    print(f"Адресов: {len(endpoints)}, задержка сервера {args.probe_delay:.0f} мс")
+    print(f"По очереди: {seq_time:.2f} с (успешно {sum(r.ok for r in sequential)})")
+    print(f"ProbeEngine: {par_time:.2f} с (успешно {summary['ok']}, p50 {summary['p50'] * 1000:.0f} мс, p90 {summary['p90'] * 1000:.0f} мс)")
+
+
+BENCHMARKS = {
+    "launch-plan": bench_launch_plan,
+    "ipset-index": bench_ipset_index,
+    "domain-trie": bench_domain_trie,
+    "domain-extract": bench_domain_extract,
+    "log-view": bench_log_view,
+    "winws-parser": bench_winws_parser,
+    "probe": bench_probe,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Замеры производительности компонентов DPI GUI.")
+    parser.add_argument('name', choices=sorted(BENCHMARKS), help='Какой замер запустить.')
+    parser.add_argument('--lists', type=int, nargs='+', default=[1, 5, 20], help='Количество списков (launch-plan).')
+    parser.add_argument('--prefixes', type=int, default=100000, help='Количество префиксов (ipset-index).')
+    parser.add_argument('--lookups', type=int, default=1000000, help='Количество проверок (ipset-index).')
+    parser.add_argument('--domains', type=int, default=1000000, help='Размер синтетического списка (domain-trie).')
+    parser.add_argument('--page-mb', type=float, default=8, help='Размер синтетической страницы в МБ (domain-extract).')
+    parser.add_argument('--urls', type=int, default=200000, help='Количество URL из логов (domain-extract).')
+    parser.add_argument('--log-lines', type=int, default=100000, help='Количество строк лога (log-view).')
+    parser.add_argument('--batch', type=int, default=50, help='Строк в одном пакете доставки (log-view).')
+    parser.add_argument('--capacity', type=int, default=20000, help='Емкость буфера логов (log-view).')
+    parser.add_argument('--legacy-lines', type=int, default=5000, help='Сколько строк прогнать через старую перерисовку (log-view).')
+    parser.add_argument('--winws-lines', type=int, default=1000000, help='Строк вывода winws --debug (winws-parser).')
+    parser.add_argument('--endpoints', type=int, default=16, help='Количество проверяемых адресов (probe).')
+    parser.add_argument('--probe-delay', type=float, default=200, help='Задержка ответа сервера в мс (probe).')
+    args = parser.parse_args()
+
+    BENCHMARKS[args.name](args)